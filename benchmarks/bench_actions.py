@@ -0,0 +1,69 @@
+"""
+Throughput of the action grammar over a corpus of typical model outputs.
+
+The corpus (data/model_outputs.jsonl) contains the formats generated by small models: actions
+with and without parentheses, quoted or lowercase object names, numeric arguments, trailing
+explanations and verbal responses. The benchmark measures `parse_response` alone and the full
+`postprocess_response` of both clients (including object ID resolution on a fake observation).
+
+Usage:
+
+    python -m benchmarks.bench_actions --repeat 2000
+"""
+import argparse
+import contextlib
+import json
+import os
+import time
+
+from genair_actions import ParsedAction, parse_response
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "data", "model_outputs.jsonl")
+
+
+def load_corpus(path: str = CORPUS_PATH) -> list:
+    with open(path) as f:
+        return [json.loads(line)["output"] for line in f if line.strip()]
+
+
+def _measure(function, corpus: list, repeat: int) -> float:
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        for output in corpus:
+            function(output)
+    return len(corpus) * repeat / (time.perf_counter() - start_time)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Throughput of the action grammar")
+    parser.add_argument("--repeat", type=int, default=1000, help="passes over the corpus")
+    args = parser.parse_args()
+
+    import genair_llm
+    import genair_vlm
+    from genair_fake import FakeController
+
+    corpus = load_corpus()
+    event = FakeController().step("Initialize")
+    llm_agent = genair_llm.LLMClient()
+    vlm_agent = genair_vlm.VLMClient()
+
+    parsed = [parse_response(output) for output in corpus]
+    num_actions = sum(isinstance(p, ParsedAction) for p in parsed)
+    print(f"Corpus: {len(corpus)} outputs ({num_actions} actions)")
+
+    results = {"parse_response": _measure(parse_response, corpus, args.repeat)}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        results["LLMClient.postprocess_response"] = _measure(
+            lambda output: llm_agent.postprocess_response(event, output), corpus, args.repeat
+        )
+        results["VLMClient.postprocess_response"] = _measure(
+            lambda output: vlm_agent.postprocess_response(event, output), corpus, args.repeat
+        )
+
+    for name, throughput in results.items():
+        print(f"{name:<34}{throughput:>14,.0f} outputs/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Import time of the agent modules.
+
+Every module is imported in a fresh interpreter, several times, and the script reports the
+median import time and which heavy dependencies (the simulator, the HTTP clients, the image and
+video libraries) were loaded as a side effect. The agents import these dependencies on first
+use, so tools that only parse responses (e.g. `genair_responses` and `genair_actions`) never
+pay for them.
+
+Usage:
+
+    python -m benchmarks.bench_imports --repeat 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+MODULES = [
+    "genair_actions",
+    "genair_responses",
+    "genair_llm",
+    "genair_vlm",
+    "genair_replay",
+]
+
+HEAVY_MODULES = ["ai2thor.controller", "ai2thor.server", "openai", "httpx", "av", "PIL", "numpy"]
+
+# Run by the fresh interpreter: imports the module and prints the import time and the heavy
+# modules that were loaded
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, [name for name in {heavy!r} if name in sys.modules]]))
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure_import(module: str, repeat: int) -> tuple:
+    """
+    Args:
+        module (str): The module to import.
+        repeat (int): The number of fresh interpreters.
+
+    Returns:
+        tuple: The median import time in seconds and the heavy modules that were loaded.
+    """
+    times = []
+    loaded = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        elapsed, loaded = json.loads(output.strip().splitlines()[-1])
+        times.append(elapsed)
+    return statistics.median(times), loaded
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Import time of the agent modules")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per module")
+    parser.add_argument("modules", nargs="*", default=MODULES, help="modules to import")
+    args = parser.parse_args()
+
+    for module in args.modules:
+        elapsed, loaded = measure_import(module, args.repeat)
+        print(f"{module:<20}{elapsed * 1000:>10.1f} ms   {', '.join(loaded) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+"""
+End-to-end benchmarks of the agent loop, without a model and without a simulator.
+
+The agents talk to a local stub of the chat completion endpoint (see stub_server.py) and act on
+observations of the fake simulator (see genair_fake.py), so the numbers measure the overhead of
+our own code: prompt building, HTTP round-trips, response parsing, image encoding and video
+writing. Every benchmark runs in a fresh process so that its peak RSS is not affected by the
+others.
+
+Usage:
+
+    python -m benchmarks.run_benchmarks
+    python -m benchmarks.run_benchmarks --steps 500 --latency 0.01 --json results.json
+"""
+import argparse
+import contextlib
+import functools
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+from openai import OpenAI
+
+BENCHMARKS = {}
+
+
+def benchmark(name: str, **params):
+    """
+    Registers a benchmark. A benchmark receives the options and the stub server and returns a
+    function that runs one step. The same setup can be registered several times with different
+    keyword arguments, e.g. to benchmark the options of an agent.
+    """
+
+    def register(setup):
+        # stacked decorators run from the bottom up, so the benchmark goes before the others of
+        # the same setup to keep the order of the source
+        others = {key: value for key, value in BENCHMARKS.items() if value.func is setup}
+        for key in others:
+            del BENCHMARKS[key]
+        BENCHMARKS[name] = functools.partial(setup, **params)
+        BENCHMARKS.update(others)
+        return setup
+
+    return register
+
+
+def _make_events(num_objects: int, num_events: int = 16) -> list:
+    from genair_fake import FakeController
+
+    controller = FakeController(num_objects=num_objects)
+    events = [controller.step("Initialize")]
+    actions = ["MoveAhead", "RotateLeft", "MoveRight", "LookDown", "RotateRight", "MoveBack"]
+    for i in range(num_events - 1):
+        events.append(controller.step(actions[i % len(actions)]))
+    return events
+
+
+@benchmark("llm_act")
+@benchmark("llm_act_stream", stream=True)
+@benchmark("llm_act_compact", compact_observations=True)
+@benchmark("llm_act_structured", structured=True)
+@benchmark("llm_act_cascade", cascade=True)
+def _setup_llm_act(options, server, cascade: bool = False, **agent_kwargs):
+    import genair_agent
+    import genair_llm
+
+    genair_agent.client = OpenAI(base_url=server.base_url, api_key="stub")
+    agent = genair_llm.LLMClient(**agent_kwargs)
+    if cascade:
+        agent = _make_cascade(options, server, agent)
+    events = _make_events(options.num_objects)
+
+    def step(i):
+        agent.act(events[i % len(events)], "Open the fridge")
+
+    if cascade:
+
+        def stats():
+            summary = agent.cascade_stats.summary()
+            return {
+                key: summary[key]
+                for key in ("escalation_rate", "skip_rate", "answered", "rejection_rate")
+            }
+
+        step.stats = stats
+    elif agent.structured:
+        step.stats = agent.output_stats.summary
+    return step
+
+
+def _make_cascade(options, server, agent):
+    from benchmarks.stub_server import DEFAULT_REPLIES
+    from genair_cascade import CascadeClient
+
+    # one reply in four cannot be used: it has no tag or names an object that is not visible
+    unusable = ["I am not sure.", "[Action] OpenObject(Spaceship)"]
+    server.set_replies(
+        [
+            reply
+            for i, (first, second) in enumerate(zip(DEFAULT_REPLIES, DEFAULT_REPLIES[::-1]))
+            for reply in (first, second, "[Action] MoveAhead", unusable[i % 2])
+        ]
+    )
+    # the large model is 4 times slower than the small one
+    server.model_latency.update(
+        {"small": options.model_latency, "large": 4 * options.model_latency}
+    )
+    return CascadeClient(agent, ["small", "large"], latency_budget=options.latency_budget)
+
+
+@benchmark("vlm_act")
+@benchmark("vlm_act_pyramid", pyramid=True)
+def _setup_vlm_act(options, server, pyramid: bool = False):
+    import genair_agent
+    import genair_vlm
+
+    genair_agent.client = OpenAI(base_url=server.base_url, api_key="stub")
+    events = _make_events(options.num_objects)
+    if pyramid:
+        from genair_images import ImagePyramid
+
+        # the frame at 320x320 first, and at 640x640 when the reply names no visible object
+        agent = genair_vlm.VLMClient(pyramid=ImagePyramid(sizes=(320, None)))
+        agent.calibrate_pyramid(events[0])
+    else:
+        agent = genair_vlm.VLMClient()
+
+    def step(i):
+        agent.act(events[i % len(events)], "Open the fridge")
+
+    if pyramid:
+
+        def stats():
+            summary = agent.pyramid_stats.summary()
+            return {
+                key: summary[key]
+                for key in ("escalation_rate", "answered", "saved_prompt_tokens", "saved_latency")
+            }
+
+        step.stats = stats
+    return step
+
+
+@benchmark("postprocess_response")
+def _setup_postprocess_response(options, server):
+    import genair_llm
+    from benchmarks.stub_server import DEFAULT_REPLIES
+
+    agent = genair_llm.LLMClient()
+    events = _make_events(options.num_objects)
+
+    def step(i):
+        agent._standardize_response(
+            events[i % len(events)], DEFAULT_REPLIES[i % len(DEFAULT_REPLIES)]
+        )
+
+    return step
+
+
+@benchmark("object_table")
+def _setup_object_table(options, server):
+    from genair_fake import FakeEvent
+    from genair_objects import get_object_index
+
+    events = _make_events(options.num_objects)
+    names = ["Fridge", "mug", "Apple", "machine", "Knife|"]
+
+    def step(i):
+        # a new observation every step, as in the agent loop: the table is built, the visible
+        # objects are listed for the prompt and an object named by the model is resolved
+        event = events[i % len(events)]
+        index = get_object_index(FakeEvent(event.metadata, event.frame))
+        index.objects_str()
+        index.resolve(names[i % len(names)])
+
+    return step
+
+
+@benchmark("video")
+def _setup_video(options, server):
+    import genair_llm
+    from genair_video import VideoRecorder
+
+    events = _make_events(options.num_objects)
+    path = os.path.join(tempfile.mkdtemp(), "rollout.mp4")
+    recorder = VideoRecorder(path, fps=1)
+
+    def step(i):
+        # one observation and one text card per step, as in main()
+        recorder.append(events[i % len(events)].frame)
+        recorder.append(genair_llm.render_text_on_image(f"Instruction {i % 10}", 640, 640))
+
+    step.close = recorder.close
+    return step
+
+
+@benchmark("loop_serial", pipelined=False)
+@benchmark("loop_pipelined", pipelined=True)
+def _setup_loop(options, server, pipelined: bool):
+    import genair_agent
+    import genair_llm
+    from genair_fake import FakeController
+    from genair_pipeline import AgentPipeline
+    from genair_plan import run_instruction
+    from genair_video import VideoRecorder
+
+    genair_agent.client = OpenAI(base_url=server.base_url, api_key="stub")
+    agent = genair_llm.LLMClient()
+    controller = FakeController(num_objects=options.num_objects)
+    recorder = VideoRecorder(os.path.join(tempfile.mkdtemp(), "rollout.mp4"), fps=1)
+    if pipelined:
+        pipeline = AgentPipeline(agent, recorder, genair_llm.render_text_on_image)
+        observe, prepare, show_text = pipeline.observe, pipeline.prepare, pipeline.show_text
+    else:
+        pipeline = None
+        prepare = agent.prepare
+
+        def observe(event):
+            recorder.append(event.frame)
+
+        def show_text(text):
+            recorder.append(genair_llm.render_text_on_image(text, 640, 640))
+
+    state = {"event": controller.step("Initialize")}
+    observe(state["event"])
+    prepare(state["event"])
+
+    def step(i):
+        # one turn of main(): text card, model call, simulator step, new frame and preparation
+        # of the next prompt
+        instruction = f"Instruction {i % 10}"
+        show_text(instruction)
+        state["event"], _ = run_instruction(
+            agent, controller, state["event"], instruction, max_replans=0, on_step=observe
+        )
+        prepare(state["event"])
+
+    def close():
+        if pipeline is not None:
+            pipeline.close()
+        recorder.close()
+
+    step.close = close
+    return step
+
+
+def _run_benchmark(name: str, options: argparse.Namespace) -> dict:
+    from benchmarks.stub_server import StubServer
+
+    with StubServer(
+        latency=options.latency,
+        token_latency=options.token_latency,
+        chatter=options.chatter,
+        prompt_token_latency=options.prompt_token_latency,
+    ) as server:
+        step = BENCHMARKS[name](options, server)
+
+        latencies = []
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for i in range(options.warmup):
+                step(i)
+
+            start_time = time.perf_counter()
+            for i in range(options.steps):
+                step_start = time.perf_counter()
+                step(i)
+                latencies.append(time.perf_counter() - step_start)
+
+            # background work that is still running is part of the measured time
+            if hasattr(step, "close"):
+                step.close()
+            total_time = time.perf_counter() - start_time
+
+    latencies = numpy.array(latencies) * 1000
+    stats = step.stats() if hasattr(step, "stats") else {}
+    return {
+        "benchmark": name,
+        "steps": options.steps,
+        "steps_per_sec": options.steps / total_time,
+        "p50_ms": float(numpy.percentile(latencies, 50)),
+        "p99_ms": float(numpy.percentile(latencies, 99)),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "generated_tokens": server.num_generated_tokens,
+        "prompt_tokens": server.num_prompt_tokens,
+        **stats,
+    }
+
+
+def run_benchmarks(options: argparse.Namespace) -> list:
+    """
+    Runs the selected benchmarks, each one in a fresh process.
+
+    Args:
+        options (argparse.Namespace): The command line options.
+
+    Returns:
+        list: One dictionary of results per benchmark.
+    """
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for name in options.benchmarks:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results.append(executor.submit(_run_benchmark, name, options).result())
+    return results
+
+
+def print_results(results: list) -> None:
+    header = (
+        f"{'benchmark':<22}{'steps/s':>10}{'p50 ms':>10}{'p99 ms':>10}"
+        f"{'peak RSS MB':>13}{'tokens':>9}{'prompt tokens':>15}"
+    )
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['benchmark']:<22}{r['steps_per_sec']:>10.1f}{r['p50_ms']:>10.2f}"
+            f"{r['p99_ms']:>10.2f}{r['peak_rss_mb']:>13.1f}{r['generated_tokens']:>9}"
+            f"{r['prompt_tokens']:>15}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks of the agent loop")
+    parser.add_argument(
+        "benchmarks",
+        nargs="*",
+        default=None,
+        help=f"benchmarks to run (default: all of {', '.join(BENCHMARKS)})",
+    )
+    parser.add_argument("--steps", type=int, default=200, help="measured steps per benchmark")
+    parser.add_argument("--warmup", type=int, default=10, help="steps before measuring")
+    parser.add_argument("--latency", type=float, default=0.0, help="stub latency in seconds")
+    parser.add_argument(
+        "--token-latency", type=float, default=0.0, help="stub latency per generated token"
+    )
+    parser.add_argument(
+        "--prompt-token-latency",
+        type=float,
+        default=0.0,
+        help="stub latency per prompt token (prefill)",
+    )
+    parser.add_argument(
+        "--chatter",
+        default=" I did this because you asked me to.",
+        help="text the stub appends to every reply",
+    )
+    parser.add_argument(
+        "--model-latency",
+        type=float,
+        default=0.01,
+        help="stub latency of the small model of llm_act_cascade (the large one takes 4x)",
+    )
+    parser.add_argument(
+        "--latency-budget",
+        type=float,
+        default=None,
+        help="latency budget of a step of llm_act_cascade, in seconds",
+    )
+    parser.add_argument(
+        "--num-objects", type=int, default=120, help="objects in the fake scenes"
+    )
+    parser.add_argument("--json", default=None, help="write the results to a JSON file")
+    options = parser.parse_args()
+
+    options.benchmarks = options.benchmarks or list(BENCHMARKS)
+    unknown = set(options.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    results = run_benchmarks(options)
+    print_results(results)
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+"""
+Local stub of the OpenAI-compatible `/v1/chat/completions` endpoint served by Ollama.
+
+The stub answers every request with a canned reply after a configurable delay, so the agent
+loop can be benchmarked without a model and without network access.
+
+Usage:
+
+    python -m benchmarks.stub_server --port 11434 --latency 0.05
+"""
+import argparse
+import base64
+import io
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from PIL import Image
+
+from genair_actions import ParsedSay, parse_response
+
+DEFAULT_REPLIES = [
+    "[Action] OpenObject(Fridge)",
+    "[Action] MoveAhead",
+    "[Action] RotateLeft(90)",
+    "[Say] Hello! I am a robot that can help you in the kitchen.",
+    "[Action] PickupObject(Apple)",
+    "[Action] OpenObject: Microwave",
+    "[Action] LookDown",
+    "[Action] ToggleObjectOn(CoffeeMachine)",
+]
+
+# Vision models turn every patch of 28x28 pixels of an image into a prompt token (Qwen2.5-VL)
+IMAGE_PATCH_SIZE = 28
+
+
+def image_tokens(url: str) -> int:
+    """
+    Estimates the number of prompt tokens of an image sent as a data URL, from its size.
+    """
+    if not url.startswith("data:"):
+        return 0
+    data = base64.b64decode(url.split(",", 1)[1])
+    # only the header of the image is decoded
+    width, height = Image.open(io.BytesIO(data)).size
+    return -(-width // IMAGE_PATCH_SIZE) * -(-height // IMAGE_PATCH_SIZE)
+
+
+def structured_reply(reply: str) -> str:
+    """
+    Converts a canned `[Action]`/`[Say]` reply into the JSON object a model would generate with
+    a `response_format`.
+    """
+    parsed = parse_response(reply)
+    if isinstance(parsed, ParsedSay):
+        return json.dumps({"response": parsed.text})
+    payload = {"action": parsed.action}
+    if parsed.object_name is not None:
+        payload["objectId"] = parsed.object_name
+    if parsed.degrees is not None:
+        payload["degrees"] = parsed.degrees
+    return json.dumps(payload)
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # many clients may connect at the same time
+    request_queue_size = 128
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # keep-alive connections, like a real inference server
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately: without this, Nagle's algorithm and delayed
+    # ACKs add ~40 ms to every reply
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _send_json(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": []})
+        else:
+            self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        if self.path.rstrip("/").endswith("/api/generate"):
+            # model warm-up with the native Ollama API: nothing to load
+            self._send_json(
+                200, {"model": request.get("model", "stub"), "response": "", "done": True}
+            )
+            return
+
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+
+        stub = self.server.stub
+        reply = stub.next_reply()
+        prompt_tokens = stub.record_request(request)
+        latency = (
+            stub.latency
+            + stub.model_latency.get(request.get("model"), 0.0)
+            + stub.prompt_token_latency * prompt_tokens
+        )
+        if latency > 0:
+            time.sleep(latency)
+        if stub.failure_rate > 0 and random.random() < stub.failure_rate:
+            self._send_json(500, {"error": {"message": "Stub failure"}})
+            return
+
+        if request.get("stream"):
+            self._stream_reply(request, reply)
+            return
+
+        if request.get("response_format"):
+            # constrained decoding: the JSON object and nothing after it
+            tokens = stub.tokenize(structured_reply(reply), chatter=False)
+        else:
+            tokens = stub.tokenize(reply)
+        max_tokens = request.get("max_tokens")
+        finish_reason = "stop"
+        if max_tokens is not None and len(tokens) > max_tokens:
+            tokens = tokens[:max_tokens]
+            finish_reason = "length"
+        if stub.token_latency > 0:
+            time.sleep(stub.token_latency * len(tokens))
+        reply = "".join(tokens)
+        stub.add_generated_tokens(len(tokens))
+
+        self._send_json(
+            200,
+            {
+                "id": f"chatcmpl-{stub.num_requests}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "stub"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": finish_reason,
+                        "message": {"role": "assistant", "content": reply},
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(tokens),
+                    "total_tokens": prompt_tokens + len(tokens),
+                },
+            },
+        )
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream_reply(self, request: dict, reply: str) -> None:
+        stub = self.server.stub
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        chunk = {
+            "id": f"chatcmpl-{stub.num_requests}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+        }
+        try:
+            for token in stub.tokenize(reply):
+                if stub.token_latency > 0:
+                    time.sleep(stub.token_latency)
+                chunk["choices"] = [
+                    {"index": 0, "delta": {"content": token}, "finish_reason": None}
+                ]
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                stub.add_generated_tokens(1)
+
+            chunk["choices"] = [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # the client closed the stream early: stop generating, like Ollama does
+            stub.add_cancelled_stream()
+            self.close_connection = True
+
+
+class StubServer:
+    """
+    Runs the stub endpoint in a background thread. Replies can be streamed: they are split in
+    word-level "tokens" sent one at a time, and the stub stops generating when the client
+    closes the stream.
+
+    Attributes:
+        latency (float): The delay in seconds before every reply.
+        prompt_token_latency (float): The delay in seconds for every prompt token (the prefill
+            time). Images count as one token per patch of `IMAGE_PATCH_SIZE` pixels.
+        model_latency (dict): An extra delay in seconds for the requests of some models, e.g.
+            to tell a small model from a large one.
+        token_latency (float): The delay in seconds for every generated token.
+        replies (list): The canned replies, returned in a round-robin fashion.
+        chatter (str): Text appended to every reply, like the explanations small models add
+            after the action.
+        failure_rate (float): The fraction of requests answered with an internal error.
+        num_requests (int): The number of chat completion requests received.
+        num_prompt_tokens (int): The number of prompt tokens received.
+        num_generated_tokens (int): The number of tokens sent to the clients.
+        num_cancelled_streams (int): The number of streams closed early by the clients.
+        base_url (str): The base URL to give to the OpenAI client.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        replies: Optional[list] = None,
+        token_latency: float = 0.0,
+        chatter: str = "",
+        failure_rate: float = 0.0,
+        prompt_token_latency: float = 0.0,
+        model_latency: Optional[dict] = None,
+    ) -> None:
+        """
+        Initializes the stub server. Use port 0 to pick a free port.
+
+        Args:
+            host (str): The host to bind to.
+            port (int): The port to bind to.
+            latency (float): The delay in seconds before every reply.
+            replies (Optional[list]): The canned replies. Defaults to `DEFAULT_REPLIES`.
+            token_latency (float): The delay in seconds for every generated token.
+            chatter (str): Text appended to every reply.
+            failure_rate (float): The fraction of requests answered with an internal error.
+            prompt_token_latency (float): The delay in seconds for every prompt token.
+            model_latency (Optional[dict]): The extra delay in seconds of the requests of
+                every model.
+        """
+        self.latency = latency
+        self.token_latency = token_latency
+        self.replies = list(replies or DEFAULT_REPLIES)
+        self.chatter = chatter
+        self.failure_rate = failure_rate
+        self.prompt_token_latency = prompt_token_latency
+        self.model_latency = dict(model_latency or {})
+        self.num_requests = 0
+        self.num_prompt_tokens = 0
+        self.num_generated_tokens = 0
+        self.num_cancelled_streams = 0
+        self.last_prompt_tokens = 0
+        self._replies = itertools.cycle(self.replies)
+        self._lock = threading.Lock()
+        self._server = _StubHTTPServer((host, port), StubHandler)
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def set_replies(self, replies: list) -> None:
+        with self._lock:
+            self.replies = list(replies)
+            self._replies = itertools.cycle(self.replies)
+
+    def next_reply(self) -> str:
+        with self._lock:
+            self.num_requests += 1
+            return next(self._replies)
+
+    def tokenize(self, reply: str, chatter: bool = True) -> list:
+        return re.findall(r"\s*\S+", reply + self.chatter if chatter else reply)
+
+    def add_generated_tokens(self, count: int) -> None:
+        with self._lock:
+            self.num_generated_tokens += count
+
+    def add_cancelled_stream(self) -> None:
+        with self._lock:
+            self.num_cancelled_streams += 1
+
+    def record_request(self, request: dict) -> int:
+        # a rough token count (4 characters per token) of the text in the prompt, plus the
+        # patches of the images
+        characters = 0
+        images = 0
+        for message in request.get("messages", []):
+            content = message.get("content")
+            if isinstance(content, str):
+                characters += len(content)
+            elif isinstance(content, list):
+                for part in content:
+                    characters += len(part.get("text", ""))
+                    if part.get("type") == "image_url":
+                        images += image_tokens(part["image_url"]["url"])
+        prompt_tokens = characters // 4 + images
+        with self._lock:
+            self.last_prompt_tokens = prompt_tokens
+            self.num_prompt_tokens += prompt_tokens
+        return prompt_tokens
+
+    def serve_forever(self) -> None:
+        """
+        Serves requests in the current thread until interrupted.
+        """
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Stub OpenAI-compatible chat endpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per reply")
+    parser.add_argument(
+        "--token-latency", type=float, default=0.0, help="seconds per generated token"
+    )
+    parser.add_argument(
+        "--prompt-token-latency", type=float, default=0.0, help="seconds per prompt token"
+    )
+    parser.add_argument("--chatter", default="", help="text appended to every reply")
+    parser.add_argument(
+        "--failure-rate", type=float, default=0.0, help="fraction of requests that fail"
+    )
+    parser.add_argument(
+        "--model-latency",
+        action="append",
+        default=[],
+        help="extra seconds per reply of a model, as MODEL=SECONDS, can be repeated",
+    )
+    args = parser.parse_args()
+
+    server = StubServer(
+        args.host,
+        args.port,
+        latency=args.latency,
+        token_latency=args.token_latency,
+        chatter=args.chatter,
+        failure_rate=args.failure_rate,
+        prompt_token_latency=args.prompt_token_latency,
+        model_latency={
+            model: float(seconds)
+            for model, seconds in (item.rsplit("=", 1) for item in args.model_latency)
+        },
+    )
+    print(f"Stub endpoint listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
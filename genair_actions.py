@@ -0,0 +1,178 @@
+import re
+from typing import List, NamedTuple, Optional, Union
+
+
+class ActionSpec(NamedTuple):
+    """
+    Describes how the arguments of an action are parsed.
+
+    Attributes:
+        name (str): The name of the action in AI2-THOR.
+        takes_object (bool): Whether the action needs the ID of a visible object.
+        takes_degrees (bool): Whether the action accepts a number of degrees.
+        default_degrees (Optional[float]): The degrees used when none are given.
+        object_position (int): Which argument names the object, when several are given.
+    """
+
+    name: str
+    takes_object: bool = False
+    takes_degrees: bool = False
+    default_degrees: Optional[float] = None
+    object_position: int = 0
+
+
+# Every action listed in the system prompts. Keys are lowercase so that lookups ignore case.
+ACTIONS = {
+    spec.name.lower(): spec
+    for spec in [
+        ActionSpec("MoveAhead"),
+        ActionSpec("MoveBack"),
+        ActionSpec("MoveLeft"),
+        ActionSpec("MoveRight"),
+        ActionSpec("RotateRight", takes_degrees=True, default_degrees=30.0),
+        ActionSpec("RotateLeft", takes_degrees=True, default_degrees=30.0),
+        ActionSpec("LookUp", takes_degrees=True),
+        ActionSpec("LookDown", takes_degrees=True),
+        ActionSpec("OpenObject", takes_object=True),
+        ActionSpec("CloseObject", takes_object=True),
+        ActionSpec("PickupObject", takes_object=True),
+        # PutObject(<receptacle>): with two arguments, the receptacle is the last one
+        ActionSpec("PutObject", takes_object=True, object_position=-1),
+        ActionSpec("DropObject", takes_object=True),
+        ActionSpec("ToggleObjectOn", takes_object=True),
+        ActionSpec("ToggleObjectOff", takes_object=True),
+        ActionSpec("SliceObject", takes_object=True),
+    ]
+}
+
+# A single pattern accepting the formats generated by the models:
+#   [Action] OpenObject(Fridge)      [Action] OpenObject("Fridge")     [Action] RotateLeft(90)
+#   [Action] OpenObject: Fridge      [Action] OpenObject Fridge        [Action] MoveAhead
+_ACTION_PATTERN = re.compile(
+    r"""
+    \[Action\][ \t]*:?[ \t]*
+    (?P<name>[A-Za-z]\w*)
+    (?:
+        [ \t]*\((?P<args>[^)\n]*)\)?
+      | :?[ \t]+(?P<word>["'<]?[\w|.+\-]+)
+    )?
+    """,
+    re.VERBOSE,
+)
+_NUMBER_PATTERN = re.compile(r"[-+]?\d+(?:\.\d+)?")
+
+# Plans longer than this are cut: the observation changes after every action, so the end of a
+# long plan is rarely still valid
+MAX_PLAN_LENGTH = 8
+
+
+class ParsedAction(NamedTuple):
+    """
+    An action parsed from a model response.
+
+    Attributes:
+        action (str): The name of the action.
+        object_name (Optional[str]): The object named by the model, to be resolved into the ID
+            of a visible object.
+        degrees (Optional[float]): The degrees of rotation, if applicable.
+    """
+
+    action: str
+    object_name: Optional[str] = None
+    degrees: Optional[float] = None
+
+
+class ParsedSay(NamedTuple):
+    """
+    A verbal response parsed from a model response.
+
+    Attributes:
+        text (str): The text to say.
+    """
+
+    text: str
+
+
+def _clean_object_name(argument: str) -> Optional[str]:
+    argument = argument.strip().strip("\"'<>` ").strip()
+    if not argument:
+        return None
+    # "the coffee machine" -> "machine", which still matches CoffeeMachine|...
+    return argument.split()[-1]
+
+
+def parse_response(response: str) -> Union[ParsedAction, ParsedSay]:
+    """
+    Parses a raw model response in a single pass. Responses starting with an `[Action]` tag are
+    parsed as actions, anything else is a verbal response (e.g. "[Say] You can [Action] later").
+
+    Args:
+        response (str): The raw response from the model.
+
+    Returns:
+        Union[ParsedAction, ParsedSay]: The parsed action or verbal response.
+    """
+    match = _ACTION_PATTERN.match(response.lstrip())
+    if match is None:
+        return ParsedSay(response.replace("[Say]", "").strip())
+
+    name = match.group("name")
+    spec = ACTIONS.get(name.lower())
+    if spec is None:
+        # unknown actions are passed to the simulator as they are
+        return ParsedAction(name)
+
+    args = match.group("args")
+    arguments = args.split(",") if args is not None else [match.group("word") or ""]
+
+    if spec.takes_object:
+        return ParsedAction(
+            spec.name, object_name=_clean_object_name(arguments[spec.object_position])
+        )
+
+    if spec.takes_degrees:
+        number = _NUMBER_PATTERN.search(arguments[0])
+        degrees = float(number.group()) if number else spec.default_degrees
+        return ParsedAction(spec.name, degrees=degrees)
+
+    return ParsedAction(spec.name)
+
+
+def follows_format(response: str) -> bool:
+    """
+    Checks whether a raw response starts with one of the tags of the system prompts. Responses
+    without them are still handled as verbal responses by `parse_response`, but they usually
+    mean that the model could not make sense of the observation.
+
+    Args:
+        response (str): The raw response from the model.
+
+    Returns:
+        bool: Whether the response starts with an `[Action]` or a `[Say]` tag.
+    """
+    response = response.lstrip()
+    return response.startswith("[Say]") or _ACTION_PATTERN.match(response) is not None
+
+
+def split_actions(response: str, max_actions: int = MAX_PLAN_LENGTH) -> List[str]:
+    """
+    Splits a response containing several actions (e.g. one per line) into the text of each
+    action, in order. Every item can be parsed with `parse_response`. A response starting with
+    a `[Say]` tag is verbal and contains no action.
+
+    Args:
+        response (str): The raw response from the model.
+        max_actions (int): The maximum number of actions returned.
+
+    Returns:
+        List[str]: The actions found in the response, empty if it contains none.
+    """
+    if response.lstrip().startswith("[Say]"):
+        return []
+
+    actions = []
+    for match in _ACTION_PATTERN.finditer(response):
+        actions.append(match.group(0).strip())
+        if len(actions) == max_actions:
+            break
+    return actions
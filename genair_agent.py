@@ -0,0 +1,346 @@
+"""
+Behaviour shared by the LLM and VLM agents: the requests to the model (local server, backend
+pool, streaming and structured output) and the parsing of its replies into responses. The
+clients only differ in how they build their prompts.
+"""
+import threading
+from contextlib import aclosing
+from typing import TYPE_CHECKING, Optional
+
+from genair_actions import ACTIONS, ParsedSay, parse_response, split_actions
+from genair_async import (
+    OLLAMA_BASE_URL,
+    create_chat_completion,
+    prompt_tokens,
+    stream_chat_completion,
+    warm_up_model,
+)
+from genair_history import ConversationHistory
+from genair_objects import get_object_index
+from genair_plan import PLAN_PROMPT
+from genair_responses import (
+    NO_VISIBLE_OBJECT,
+    STRUCTURED_RESPONSE_FORMAT,
+    AgentActionResponse,
+    AgentPlanResponse,
+    AgentResponse,
+    AgentTextualResponse,
+    StructuredResponse,
+)
+from genair_streaming import StreamingResponseParser
+from genair_structured import (
+    MAX_STRUCTURED_TOKENS,
+    STRUCTURED_PROMPT,
+    StructuredOutputStats,
+    parse_structured,
+)
+
+if TYPE_CHECKING:
+    from ai2thor.server import Event
+    from openai import OpenAI
+
+    from genair_backends import BackendPool
+    from genair_cache import ResponseCache
+
+# The OpenAI client is created on first use by `get_client`: importing openai takes longer
+# than everything else the agents need, and tools that only parse responses never use it
+client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> "OpenAI":
+    """
+    Returns the client of the Ollama server, creating it on first use.
+
+    Returns:
+        OpenAI: The client.
+    """
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                from openai import OpenAI
+
+                client = OpenAI(base_url=OLLAMA_BASE_URL, api_key="ollama")
+    return client
+
+
+class AgentClient:
+    """
+    Base class of LLMClient and VLMClient. Sends the prompts built by the subclasses to the
+    model and converts the replies into AgentResponse objects.
+
+    Attributes:
+        model_name (str): The name of the model to use.
+        history (ConversationHistory): The previous turns of the conversation.
+        cache (Optional[ResponseCache]): The cache of raw model responses, if any.
+        stream (bool): Whether responses are streamed and cut as soon as they are complete.
+        plan (bool): Whether the model generates a sequence of actions for each instruction.
+        structured (bool): Whether the model generates JSON responses following a schema.
+        backend (Optional[BackendPool]): The pool of inference servers, if any.
+        output_stats (StructuredOutputStats): The parse failures and the output tokens.
+        system_prompt (str): The system prompt, including the plan or structured instructions.
+        last_turn (Optional[dict]): The prompt and the raw reply of the last query, e.g. to
+            record them in a trajectory.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        system_prompt: str,
+        cache: Optional["ResponseCache"] = None,
+        stream: bool = False,
+        max_history_tokens: int = 2048,
+        plan: bool = False,
+        structured: bool = False,
+        backend: Optional["BackendPool"] = None,
+    ) -> None:
+        """
+        Args:
+            model_name (str): The name of the model to use.
+            system_prompt (str): The system prompt of the agent, without the plan or
+                structured instructions.
+            cache (Optional[ResponseCache]): A cache of raw model responses.
+            stream (bool): Whether to stream the responses and close the stream as soon as a
+                complete action or "[Say]" sentence is generated.
+            max_history_tokens (int): The token budget of the conversation history.
+            plan (bool): Whether to ask the model for all the actions of an instruction at
+                once. Plans are generated without streaming.
+            structured (bool): Whether to constrain the model to JSON responses. Cannot be
+                combined with the plan mode.
+            backend (Optional[BackendPool]): A pool of inference servers to spread the requests
+                over. Without it, requests go to the local Ollama server.
+        """
+        if structured and plan:
+            raise ValueError("The structured mode cannot be combined with the plan mode.")
+
+        self.model_name = model_name
+        self.history = ConversationHistory(max_tokens=max_history_tokens)
+        self.cache = cache
+        self.stream = stream
+        self.plan = plan
+        self.structured = structured
+        self.backend = backend
+        self.output_stats = StructuredOutputStats()
+        self.system_prompt = system_prompt
+        if plan:
+            self.system_prompt += PLAN_PROMPT
+        if structured:
+            self.system_prompt += STRUCTURED_PROMPT
+        self.last_turn = None
+
+    def warm_up(self, keep_alive: str = "30m", model_name: Optional[str] = None) -> bool:
+        """
+        Loads the model in the memory of the server, so that the first instruction does not
+        wait for it.
+
+        Args:
+            keep_alive (str): How long the model stays in memory after the last request.
+            model_name (Optional[str]): The model to load. Defaults to the model of the agent.
+
+        Returns:
+            bool: True if the model is loaded.
+        """
+        model_name = model_name or self.model_name
+        if self.backend is not None:
+            return self.backend.warm_up(model_name, keep_alive)
+        return warm_up_model(model_name, str(get_client().base_url), keep_alive)
+
+    def _get_object_id(self, raw_object_id: str, env_observation: "Event") -> Optional[str]:
+        """
+        Retrieves the ID of a visible object from the name generated by the model.
+
+        Args:
+            raw_object_id (str): The object name or partial ID generated by the model.
+            env_observation: The environment observation containing metadata.
+
+        Returns:
+            Optional[str]: The matching object ID, or None if no match is found.
+        """
+        return get_object_index(env_observation).resolve(raw_object_id)
+
+    def postprocess_response(self, env_observation: "Event", response: str) -> AgentResponse:
+        """
+        Processes the raw response from the model and converts it into an appropriate
+        AgentResponse object.
+
+        Args:
+            env_observation: The environment observation containing metadata.
+            response (str): The raw response from the model.
+
+        Returns:
+            AgentResponse: The processed response as an action, plan or textual response.
+        """
+        if self.structured:
+            parsed = parse_structured(StructuredResponse, response)
+            self.output_stats.record_response(parsed is not None)
+            if parsed is not None:
+                return self._resolve_structured(env_observation, parsed)
+
+        if self.plan:
+            actions = split_actions(response)
+            if actions:
+                return AgentPlanResponse(actions=actions)
+
+        return self.resolve_action(env_observation, response)
+
+    def _resolve_structured(
+        self, env_observation: "Event", parsed: AgentResponse
+    ) -> AgentResponse:
+        """
+        Normalizes a validated structured response: the action name gets the case expected by
+        AI2-THOR and the object name is resolved into the ID of a visible object.
+
+        Args:
+            env_observation: The environment observation containing metadata.
+            parsed (AgentResponse): The validated response.
+
+        Returns:
+            AgentResponse: The processed response as an action or textual response.
+        """
+        if isinstance(parsed, AgentTextualResponse):
+            return parsed
+
+        spec = ACTIONS.get(parsed.action.lower())
+        action = spec.name if spec is not None else parsed.action
+        if parsed.objectId:
+            object_id = self._get_object_id(parsed.objectId, env_observation)
+            if object_id is None:
+                return AgentActionResponse(action=NO_VISIBLE_OBJECT)
+            return AgentActionResponse(action=action, objectId=object_id)
+
+        degrees = parsed.degrees
+        if degrees is None and spec is not None:
+            degrees = spec.default_degrees
+        return AgentActionResponse(action=action, degrees=degrees)
+
+    def _structured_kwargs(self) -> dict:
+        if not self.structured:
+            return {}
+        return {
+            "response_format": STRUCTURED_RESPONSE_FORMAT,
+            "max_tokens": MAX_STRUCTURED_TOKENS,
+        }
+
+    def _streams(self) -> bool:
+        # Plans and JSON responses would be cut after their first action
+        return self.stream and not self.plan and not self.structured
+
+    def _generation_settings(self) -> dict:
+        # The settings that change the reply to a given prompt, part of the cache keys
+        return {
+            "stream": self._streams(),
+            "structured": self.structured,
+            "max_tokens": self._structured_kwargs().get("max_tokens"),
+        }
+
+    def resolve_action(self, env_observation: "Event", response: str) -> AgentResponse:
+        """
+        Parses a single action (or a verbal response) and resolves the object it names
+        against the given observation.
+
+        Args:
+            env_observation: The environment observation containing metadata.
+            response (str): The raw response, or one action of a plan.
+
+        Returns:
+            AgentResponse: The processed response as an action or textual response.
+        """
+        parsed = parse_response(response)
+        if isinstance(parsed, ParsedSay):
+            return AgentTextualResponse(response=parsed.text)
+
+        if parsed.object_name is not None:
+            object_id = self._get_object_id(parsed.object_name, env_observation)
+            if object_id is None:
+                return AgentActionResponse(action=NO_VISIBLE_OBJECT)
+            return AgentActionResponse(action=parsed.action, objectId=object_id)
+
+        return AgentActionResponse(action=parsed.action, degrees=parsed.degrees)
+
+    def _create(self, **kwargs):
+        """
+        Sends a chat completion to the backend pool, or to the local server.
+        """
+        if self.backend is not None:
+            return self.backend.create(**kwargs)
+        return get_client().chat.completions.create(**kwargs)
+
+    async def _acreate(self, **kwargs):
+        if self.backend is not None:
+            return await self.backend.acreate(**kwargs)
+        return await create_chat_completion(**kwargs)
+
+    def _astream(self, **kwargs):
+        if self.backend is not None:
+            return self.backend.astream(**kwargs)
+        return stream_chat_completion(**kwargs)
+
+    def _complete(self, messages: list, model_name: Optional[str] = None) -> tuple:
+        """
+        Sends the messages to the model and returns the generated text. In streaming mode the
+        stream is closed as soon as a complete action or sentence has been generated.
+
+        Args:
+            messages (list): The messages in the OpenAI chat format.
+            model_name (Optional[str]): The model to send them to. Defaults to the model of the
+                agent (see genair_cascade.py for other models).
+
+        Returns:
+            tuple: The raw response from the model and the number of prompt tokens (None when
+                the server does not report them, e.g. in streaming mode).
+        """
+        model_name = model_name or self.model_name
+        if not self._streams():
+            completion = self._create(
+                temperature=0,
+                model=model_name,
+                messages=messages,
+                **self._structured_kwargs(),
+            )
+            self.output_stats.record_usage(completion)
+            return completion.choices[0].message.content, prompt_tokens(completion)
+
+        parser = StreamingResponseParser()
+        with self._create(
+            temperature=0,
+            model=model_name,
+            messages=messages,
+            stream=True,
+        ) as stream:
+            for chunk in stream:
+                if chunk.choices and parser.feed(chunk.choices[0].delta.content):
+                    break
+        return parser.text, None
+
+    async def _acomplete(self, messages: list, model_name: Optional[str] = None) -> tuple:
+        """
+        Asynchronous version of `_complete`, using the shared AsyncOpenAI client.
+
+        Args:
+            messages (list): The messages in the OpenAI chat format.
+            model_name (Optional[str]): The model to send them to. Defaults to the model of the
+                agent.
+
+        Returns:
+            tuple: The raw response from the model and the number of prompt tokens.
+        """
+        model_name = model_name or self.model_name
+        if not self._streams():
+            completion = await self._acreate(
+                temperature=0,
+                model=model_name,
+                messages=messages,
+                **self._structured_kwargs(),
+            )
+            self.output_stats.record_usage(completion)
+            return completion.choices[0].message.content, prompt_tokens(completion)
+
+        parser = StreamingResponseParser()
+        async with aclosing(
+            self._astream(temperature=0, model=model_name, messages=messages)
+        ) as deltas:
+            async for delta in deltas:
+                if parser.feed(delta):
+                    break
+        return parser.text, None
@@ -0,0 +1,198 @@
+import asyncio
+import weakref
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+# Address of the Ollama server. Ollama exposes an OpenAI-compatible API, so we can use the
+# official OpenAI client to talk to it.
+OLLAMA_BASE_URL = "http://localhost:11434/v1"
+
+# Maximum number of chat completions that can be in flight at the same time. Ollama batches
+# concurrent requests together, so a few dozen parallel requests keep the server busy without
+# flooding it. You can change this value with `configure_async_client`.
+MAX_CONCURRENT_REQUESTS = 32
+
+_settings = {
+    "base_url": OLLAMA_BASE_URL,
+    "api_key": "ollama",
+    "max_concurrent_requests": MAX_CONCURRENT_REQUESTS,
+}
+
+# asyncio objects are bound to the event loop that created them, so we keep one client and one
+# semaphore per running loop. Entries disappear automatically once the loop is garbage collected.
+_loop_state: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, tuple]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def configure_async_client(
+    base_url: str = OLLAMA_BASE_URL,
+    api_key: str = "ollama",
+    max_concurrent_requests: int = MAX_CONCURRENT_REQUESTS,
+) -> None:
+    """
+    Configures the shared asynchronous client. Clients that were already created are discarded
+    so that the new settings apply to the next request.
+
+    Args:
+        base_url (str): The base URL of the OpenAI-compatible endpoint.
+        api_key (str): The API key sent with every request.
+        max_concurrent_requests (int): The maximum number of requests in flight at once.
+    """
+    if max_concurrent_requests < 1:
+        raise ValueError("max_concurrent_requests must be at least 1")
+
+    _settings.update(
+        base_url=base_url,
+        api_key=api_key,
+        max_concurrent_requests=max_concurrent_requests,
+    )
+    _loop_state.clear()
+
+
+def _get_loop_state() -> tuple:
+    """
+    Returns the client and the semaphore associated with the running event loop, creating
+    them on first use.
+
+    Returns:
+        tuple: The AsyncOpenAI client and the semaphore bounding concurrent requests.
+    """
+    loop = asyncio.get_running_loop()
+    state = _loop_state.get(loop)
+    if state is None:
+        # openai and httpx are slow to import, and not needed until the first request
+        import httpx
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+        max_requests = _settings["max_concurrent_requests"]
+        # The connection pool is as large as the number of concurrent requests so that every
+        # request can reuse a keep-alive connection instead of opening a new one.
+        http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=max_requests,
+                max_keepalive_connections=max_requests,
+            )
+        )
+        client = AsyncOpenAI(
+            base_url=_settings["base_url"],
+            api_key=_settings["api_key"],
+            http_client=http_client,
+        )
+        state = (client, asyncio.Semaphore(max_requests))
+        _loop_state[loop] = state
+    return state
+
+
+def get_async_client() -> "AsyncOpenAI":
+    """
+    Returns the AsyncOpenAI client shared by all the agents running in the current event loop.
+
+    Returns:
+        AsyncOpenAI: The shared asynchronous client.
+    """
+    return _get_loop_state()[0]
+
+
+def get_request_semaphore() -> asyncio.Semaphore:
+    """
+    Returns the semaphore bounding the chat completions in flight in the current event loop.
+    It is shared by the agents and the backend pools (see genair_backends.py), so that
+    `max_concurrent_requests` holds whichever server the requests go to.
+
+    Returns:
+        asyncio.Semaphore: The semaphore of the running loop.
+    """
+    return _get_loop_state()[1]
+
+
+def prompt_tokens(completion) -> Optional[int]:
+    """
+    Args:
+        completion (ChatCompletion): A completion returned by the model.
+
+    Returns:
+        Optional[int]: The number of tokens of the prompt, or None if the server did not
+            report the usage.
+    """
+    usage = getattr(completion, "usage", None)
+    return usage.prompt_tokens if usage is not None else None
+
+
+async def create_chat_completion(**kwargs):
+    """
+    Sends a chat completion request using the shared asynchronous client. At most
+    `max_concurrent_requests` requests are sent at the same time; the others wait for a slot.
+
+    Args:
+        **kwargs: The arguments passed to `chat.completions.create`.
+
+    Returns:
+        ChatCompletion: The completion returned by the model.
+    """
+    client, semaphore = _get_loop_state()
+    async with semaphore:
+        return await client.chat.completions.create(**kwargs)
+
+
+async def stream_chat_completion(**kwargs):
+    """
+    Streams a chat completion using the shared asynchronous client, yielding the text deltas
+    as they arrive. The request keeps its concurrency slot until the stream is closed; close
+    the generator (e.g. with `contextlib.aclosing`) to stop the generation early.
+
+    Args:
+        **kwargs: The arguments passed to `chat.completions.create`.
+
+    Yields:
+        str: The new text generated by the model.
+    """
+    client, semaphore = _get_loop_state()
+    async with semaphore:
+        stream = await client.chat.completions.create(stream=True, **kwargs)
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            # closing the response tells the server to stop generating
+            await stream.close()
+
+
+def warm_up_model(
+    model_name: str,
+    base_url: str = OLLAMA_BASE_URL,
+    keep_alive: str = "30m",
+    timeout: float = 300.0,
+) -> bool:
+    """
+    Loads a model in the memory of the Ollama server, so that the first instruction does not
+    wait for the model to be loaded. This uses the native Ollama API, since the
+    OpenAI-compatible one does not accept `keep_alive`: a generate request without a prompt
+    loads the model and keeps it in memory for `keep_alive`.
+
+    Args:
+        model_name (str): The name of the model.
+        base_url (str): The base URL of the OpenAI-compatible endpoint of the server.
+        keep_alive (str): How long the model stays in memory after the last request.
+        timeout (float): The maximum time in seconds to wait for the model to be loaded.
+
+    Returns:
+        bool: True if the model is loaded, False if the server could not load it.
+    """
+    import httpx
+
+    server_url = base_url.rstrip("/").removesuffix("/v1")
+    try:
+        response = httpx.post(
+            f"{server_url}/api/generate",
+            json={"model": model_name, "keep_alive": keep_alive},
+            timeout=timeout,
+        )
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        print(f"Unable to warm up the model {model_name}: {e}")
+        return False
+    return True
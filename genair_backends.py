@@ -0,0 +1,478 @@
+import asyncio
+import itertools
+import threading
+import time
+import weakref
+from collections import deque
+from typing import Optional, Union
+
+import httpx
+import numpy
+import openai
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, OpenAI
+
+from genair_async import get_request_semaphore, warm_up_model
+
+# Errors worth retrying on another endpoint: the server is unreachable, too slow, overloaded or
+# broken. Other errors (e.g. a bad request) would fail on every endpoint.
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+    openai.RateLimitError,
+)
+# Errors of a stream that was cut after the request succeeded (e.g. the server went down)
+STREAM_ERRORS = RETRYABLE_ERRORS + (httpx.HTTPError,)
+
+STRATEGIES = ("least_outstanding", "round_robin")
+
+
+class Endpoint:
+    """
+    An inference server of a BackendPool, with its clients and its metrics.
+
+    Attributes:
+        base_url (str): The base URL of the OpenAI-compatible endpoint.
+        model (Optional[str]): The model served by this endpoint, replacing the model of the
+            requests (e.g. a different quantization on each machine). None keeps the model
+            of the requests. Cannot be used with a cascade, whose requests choose the model.
+        outstanding (int): The number of requests in flight.
+        requests (int): The number of requests completed successfully.
+        failures (int): The number of requests that failed.
+        consecutive_failures (int): The number of failures since the last success.
+        retry_at (float): The time (as `time.monotonic`) before which the endpoint is avoided.
+        latency_ewma (Optional[float]): The exponentially weighted mean latency, in seconds.
+        latencies (deque): The latencies of the last requests, in seconds.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        model: Optional[str] = None,
+        api_key: str = "ollama",
+        timeout: float = 120.0,
+        max_connections: int = 32,
+    ) -> None:
+        self.base_url = base_url
+        self.model = model
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_connections = max_connections
+        # retries are done by the pool, on another endpoint
+        self.client = OpenAI(base_url=base_url, api_key=api_key, timeout=timeout, max_retries=0)
+        self._async_clients = weakref.WeakKeyDictionary()
+
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.retry_at = 0.0
+        self.latency_ewma = None
+        self.latencies = deque(maxlen=1000)
+
+    def async_client(self) -> AsyncOpenAI:
+        # asyncio clients are bound to the event loop that created them (see genair_async.py)
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            http_client = DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                )
+            )
+            client = AsyncOpenAI(
+                base_url=self.base_url,
+                api_key=self.api_key,
+                timeout=self.timeout,
+                max_retries=0,
+                http_client=http_client,
+            )
+            self._async_clients[loop] = client
+        return client
+
+    def is_available(self, now: float) -> bool:
+        # after a failure, a single request probes the endpoint before it gets more traffic
+        return now >= self.retry_at and (self.consecutive_failures == 0 or self.outstanding == 0)
+
+    def metrics(self) -> dict:
+        latencies = numpy.array(self.latencies) * 1000
+        return {
+            "base_url": self.base_url,
+            "model": self.model,
+            "available": self.is_available(time.monotonic()),
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "latency_ewma_ms": self.latency_ewma * 1000 if self.latency_ewma else None,
+            "p50_ms": float(numpy.percentile(latencies, 50)) if len(latencies) else None,
+            "p99_ms": float(numpy.percentile(latencies, 99)) if len(latencies) else None,
+        }
+
+
+class _TrackedStream:
+    """
+    Wraps a streamed completion so that the endpoint counts it as outstanding until the stream
+    is closed, and as failed if the stream was cut by an error.
+    """
+
+    def __init__(self, stream, on_close) -> None:
+        self._stream = stream
+        self._on_close = on_close
+        self._failed = False
+
+    def __iter__(self):
+        try:
+            yield from self._stream
+        except STREAM_ERRORS:
+            self._failed = True
+            raise
+
+    def close(self) -> None:
+        if self._on_close is not None:
+            self._stream.close()
+            self._on_close(self._failed)
+            self._on_close = None
+
+    def __enter__(self) -> "_TrackedStream":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+class BackendPool:
+    """
+    Spreads the chat completions of the agents over several inference servers.
+
+    Every request goes to the available endpoint with the least expected wait (requests in
+    flight times mean latency), or to the next one in round-robin order. An endpoint that
+    fails or times out is avoided for a while, with an exponential backoff, and the request is
+    retried on another endpoint. Slow endpoints get fewer requests with the least-outstanding
+    strategy, since their requests stay in flight longer and their latency is higher.
+
+    Attributes:
+        endpoints (list): The endpoints of the pool.
+        strategy (str): "least_outstanding" or "round_robin".
+        max_retries (int): The number of other endpoints tried when a request fails.
+        backoff (float): The time in seconds an endpoint is avoided after a first failure.
+            It doubles with every consecutive failure, up to `max_backoff`.
+        max_backoff (float): The maximum time in seconds an endpoint is avoided.
+    """
+
+    def __init__(
+        self,
+        endpoints: list,
+        strategy: str = "least_outstanding",
+        max_retries: int = 2,
+        backoff: float = 1.0,
+        max_backoff: float = 30.0,
+        api_key: str = "ollama",
+        timeout: float = 120.0,
+    ) -> None:
+        """
+        Initializes the pool.
+
+        Args:
+            endpoints (list): The endpoints, either as base URLs or as (base URL, model)
+                tuples to serve a specific model on that endpoint.
+            strategy (str): "least_outstanding" or "round_robin".
+            max_retries (int): The number of other endpoints tried when a request fails.
+            backoff (float): The time in seconds an endpoint is avoided after a failure.
+            max_backoff (float): The maximum time in seconds an endpoint is avoided.
+            api_key (str): The API key sent with every request.
+            timeout (float): The timeout of every request, in seconds.
+        """
+        if not endpoints:
+            raise ValueError("The pool needs at least one endpoint.")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown strategy {strategy!r}, expected one of {STRATEGIES}.")
+
+        self.endpoints = []
+        for endpoint in endpoints:
+            base_url, model = (endpoint, None) if isinstance(endpoint, str) else endpoint
+            self.endpoints.append(Endpoint(base_url, model, api_key=api_key, timeout=timeout))
+
+        self.strategy = strategy
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._round_robin = itertools.cycle(range(len(self.endpoints)))
+        self._health_thread = None
+        self._stop_health_checks = threading.Event()
+
+    def _acquire(self, exclude: set) -> Endpoint:
+        """
+        Chooses the endpoint of the next request and counts the request as outstanding.
+        """
+        with self._lock:
+            now = time.monotonic()
+            available = [e for e in self.endpoints if e.is_available(now)]
+            # endpoints that were already tried for this request are only used again if all the
+            # others are backing off
+            available = [e for e in available if e not in exclude] or available
+            if not available:
+                # every endpoint is backing off: try the one that will recover first
+                endpoint = min(self.endpoints, key=lambda e: e.retry_at)
+            elif self.strategy == "round_robin":
+                for _ in range(len(self.endpoints)):
+                    endpoint = self.endpoints[next(self._round_robin)]
+                    if endpoint in available:
+                        break
+            else:
+                # endpoints without measurements yet are assumed to be as fast as the best one,
+                # and win the ties so that they get measured
+                known = [e.latency_ewma for e in self.endpoints if e.latency_ewma is not None]
+                default_latency = min(known) if known else 1.0
+                endpoint = min(
+                    available,
+                    key=lambda e: (
+                        (e.outstanding + 1) * (e.latency_ewma or default_latency),
+                        e.latency_ewma is not None,
+                    ),
+                )
+            endpoint.outstanding += 1
+            return endpoint
+
+    def _release(self, endpoint: Endpoint, start_time: float, failed: bool = False) -> None:
+        """
+        Records the end of a request. Failed requests make the pool avoid the endpoint.
+        """
+        latency = time.monotonic() - start_time
+        with self._lock:
+            endpoint.outstanding -= 1
+            if failed:
+                self._back_off(endpoint)
+                return
+
+            endpoint.requests += 1
+            endpoint.consecutive_failures = 0
+            endpoint.retry_at = 0.0
+            endpoint.latencies.append(latency)
+            if endpoint.latency_ewma is None:
+                endpoint.latency_ewma = latency
+            else:
+                endpoint.latency_ewma = 0.8 * endpoint.latency_ewma + 0.2 * latency
+
+    def _back_off(self, endpoint: Endpoint) -> None:
+        endpoint.failures += 1
+        endpoint.consecutive_failures += 1
+        delay = self.backoff * 2 ** (endpoint.consecutive_failures - 1)
+        endpoint.retry_at = time.monotonic() + min(delay, self.max_backoff)
+
+    @staticmethod
+    def _request(endpoint: Endpoint, kwargs: dict) -> dict:
+        if endpoint.model is not None:
+            kwargs = {**kwargs, "model": endpoint.model}
+        return kwargs
+
+    def create(self, **kwargs):
+        """
+        Sends a chat completion to the best endpoint, retrying on other endpoints if it fails.
+        With `stream=True`, the stream must be closed (e.g. with a `with` block) to release
+        the endpoint.
+
+        Args:
+            **kwargs: The arguments passed to `chat.completions.create`.
+
+        Returns:
+            ChatCompletion: The completion, or the stream of chunks.
+        """
+        tried = set()
+        for attempt in range(self.max_retries + 1):
+            endpoint = self._acquire(tried)
+            tried.add(endpoint)
+            start_time = time.monotonic()
+            try:
+                response = endpoint.client.chat.completions.create(
+                    **self._request(endpoint, kwargs)
+                )
+            except RETRYABLE_ERRORS:
+                self._release(endpoint, start_time, failed=True)
+                if attempt == self.max_retries:
+                    raise
+                continue
+            except BaseException:
+                # the request itself is wrong: the endpoint is not to blame
+                self._release(endpoint, start_time)
+                raise
+
+            if kwargs.get("stream"):
+                return _TrackedStream(
+                    response, lambda failed: self._release(endpoint, start_time, failed)
+                )
+            self._release(endpoint, start_time)
+            return response
+
+    async def acreate(self, **kwargs):
+        """
+        Asynchronous version of `create`, without streaming. The request holds a slot of the
+        concurrency limit of genair_async.py until it completes, like the requests sent to the
+        local server.
+
+        Args:
+            **kwargs: The arguments passed to `chat.completions.create`.
+
+        Returns:
+            ChatCompletion: The completion.
+        """
+        async with get_request_semaphore():
+            tried = set()
+            for attempt in range(self.max_retries + 1):
+                endpoint = self._acquire(tried)
+                tried.add(endpoint)
+                start_time = time.monotonic()
+                try:
+                    response = await endpoint.async_client().chat.completions.create(
+                        **self._request(endpoint, kwargs)
+                    )
+                except RETRYABLE_ERRORS:
+                    self._release(endpoint, start_time, failed=True)
+                    if attempt == self.max_retries:
+                        raise
+                    continue
+                except BaseException:
+                    self._release(endpoint, start_time)
+                    raise
+
+                self._release(endpoint, start_time)
+                return response
+
+    async def astream(self, **kwargs):
+        """
+        Streams a chat completion from the best endpoint, yielding the text deltas as they
+        arrive, like `genair_async.stream_chat_completion`. Only the request itself is retried
+        on another endpoint: once text has been generated, errors are raised, and the endpoint
+        is avoided as if the request had failed. The stream holds a slot of the concurrency
+        limit of genair_async.py until it is closed.
+
+        Args:
+            **kwargs: The arguments passed to `chat.completions.create`.
+
+        Yields:
+            str: The new text generated by the model.
+        """
+        async with get_request_semaphore():
+            tried = set()
+            for attempt in range(self.max_retries + 1):
+                endpoint = self._acquire(tried)
+                tried.add(endpoint)
+                start_time = time.monotonic()
+                try:
+                    stream = await endpoint.async_client().chat.completions.create(
+                        stream=True, **self._request(endpoint, kwargs)
+                    )
+                except RETRYABLE_ERRORS:
+                    self._release(endpoint, start_time, failed=True)
+                    if attempt == self.max_retries:
+                        raise
+                    continue
+                except BaseException:
+                    self._release(endpoint, start_time)
+                    raise
+                break
+
+            failed = False
+            try:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            except STREAM_ERRORS:
+                failed = True
+                raise
+            finally:
+                # closing the response tells the server to stop generating
+                await stream.close()
+                self._release(endpoint, start_time, failed=failed)
+
+    def health_check(self, timeout: float = 2.0) -> dict:
+        """
+        Checks that every endpoint answers. Endpoints that do not are avoided as if a request
+        had failed; endpoints that do are used again straight away.
+
+        Args:
+            timeout (float): The timeout of every check, in seconds.
+
+        Returns:
+            dict: Whether each endpoint is healthy, by base URL.
+        """
+        results = {}
+        for endpoint in self.endpoints:
+            try:
+                endpoint.client.with_options(timeout=timeout).models.list()
+            except openai.OpenAIError:
+                with self._lock:
+                    self._back_off(endpoint)
+                results[endpoint.base_url] = False
+            else:
+                with self._lock:
+                    endpoint.consecutive_failures = 0
+                    endpoint.retry_at = 0.0
+                results[endpoint.base_url] = True
+        return results
+
+    def start_health_checks(self, interval: float = 10.0) -> None:
+        """
+        Checks the endpoints every `interval` seconds in a background thread.
+
+        Args:
+            interval (float): The time between two checks, in seconds.
+        """
+        if self._health_thread is not None:
+            return
+
+        def run() -> None:
+            while not self._stop_health_checks.wait(interval):
+                self.health_check()
+
+        self._stop_health_checks.clear()
+        self._health_thread = threading.Thread(target=run, name="health-checks", daemon=True)
+        self._health_thread.start()
+
+    def stop_health_checks(self) -> None:
+        if self._health_thread is not None:
+            self._stop_health_checks.set()
+            self._health_thread.join()
+            self._health_thread = None
+
+    def warm_up(self, model_name: str, keep_alive: str = "30m") -> bool:
+        """
+        Loads the model on every endpoint (see `genair_async.warm_up_model`).
+
+        Args:
+            model_name (str): The model of the requests, unless the endpoint has its own.
+            keep_alive (str): How long the model stays in memory after the last request.
+
+        Returns:
+            bool: True if every endpoint loaded its model.
+        """
+        return all(
+            [
+                warm_up_model(endpoint.model or model_name, endpoint.base_url, keep_alive)
+                for endpoint in self.endpoints
+            ]
+        )
+
+    def metrics(self) -> list:
+        """
+        Returns:
+            list: For every endpoint, its outstanding requests, completed requests, failures,
+                latency (mean, p50 and p99) and whether it is currently used.
+        """
+        with self._lock:
+            return [endpoint.metrics() for endpoint in self.endpoints]
+
+
+def parse_endpoint(spec: str) -> Union[str, tuple]:
+    """
+    Parses an endpoint given on the command line, either "URL" or "URL=MODEL".
+
+    Args:
+        spec (str): The endpoint.
+
+    Returns:
+        Union[str, tuple]: The base URL, or a (base URL, model) tuple.
+    """
+    base_url, _, model = spec.partition("=")
+    return (base_url, model) if model else base_url
@@ -0,0 +1,210 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import numpy
+
+
+def make_cache_key(*parts) -> str:
+    """
+    Builds a cache key from the inputs that determine the model response.
+
+    Args:
+        *parts: JSON-serialisable values such as the model name, the system prompt, the visible
+            objects and the user instruction.
+
+    Returns:
+        str: A hex digest identifying the inputs.
+    """
+    payload = json.dumps(parts, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def hash_frame(frame: "numpy.ndarray") -> str:
+    """
+    Hashes the pixels of an environment frame so that it can be used as part of a cache key.
+
+    Args:
+        frame (numpy.ndarray): The RGB frame returned by the simulator.
+
+    Returns:
+        str: A hex digest of the frame shape and content.
+    """
+    import numpy
+
+    frame = numpy.ascontiguousarray(frame)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(frame.shape).encode("ascii"))
+    digest.update(memoryview(frame).cast("B"))
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """
+    LRU cache of raw model responses with optional persistence in a sqlite database. With
+    `temperature=0` the model output only depends on the prompt, so replaying the same
+    instructions on the same scene can skip the model entirely.
+
+    Attributes:
+        max_size (int): The maximum number of responses kept in the cache.
+        path (Optional[str]): The sqlite file used to persist the cache, if any.
+        hits (int): The number of lookups that found a response.
+        misses (int): The number of lookups that did not find a response.
+        evictions (int): The number of responses removed to respect `max_size`.
+    """
+
+    def __init__(self, max_size: int = 10000, path: Optional[str] = None) -> None:
+        """
+        Initializes the cache and loads the persisted responses, if any.
+
+        Args:
+            max_size (int): The maximum number of responses kept in the cache.
+            path (Optional[str]): The sqlite file used to persist the cache. When None, the
+                cache only lives in memory.
+        """
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+
+        self.max_size = max_size
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        # the batch tools call the agents from several threads
+        self._lock = threading.Lock()
+        self._db = None
+        # logical clock used to order the persisted entries by last use
+        self._clock = 0
+        # last use of the entries read since the last write, persisted with the next write so
+        # that lookups do not touch the database
+        self._touched = {}
+
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, last_used INTEGER NOT NULL)"
+            )
+            rows = self._db.execute(
+                "SELECT key, response, last_used FROM responses ORDER BY last_used"
+            ).fetchall()
+            for key, response, last_used in rows:
+                self._entries[key] = response
+                self._clock = last_used
+            self._evict()
+            self._db.commit()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the response stored for a key and marks it as the most recently used.
+
+        Args:
+            key (str): The key returned by `make_cache_key`.
+
+        Returns:
+            Optional[str]: The cached raw response, or None if the key is not cached.
+        """
+        with self._lock:
+            response = self._entries.get(key)
+            if response is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+            if self._db is not None:
+                self._clock += 1
+                self._touched[key] = self._clock
+            return response
+
+    def put(self, key: str, response: str) -> None:
+        """
+        Stores a response, evicting the least recently used ones if the cache is full.
+
+        Args:
+            key (str): The key returned by `make_cache_key`.
+            response (str): The raw response generated by the model.
+        """
+        if response is None:
+            return
+
+        with self._lock:
+            self._entries[key] = response
+            self._entries.move_to_end(key)
+            if self._db is not None:
+                self._clock += 1
+                self._touched.pop(key, None)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, last_used) VALUES (?, ?, ?)",
+                    (key, response, self._clock),
+                )
+            self._evict()
+            if self._db is not None:
+                self._flush_touched()
+                self._db.commit()
+
+    def _flush_touched(self) -> None:
+        if self._touched:
+            self._db.executemany(
+                "UPDATE responses SET last_used = ? WHERE key = ?",
+                [(last_used, key) for key, last_used in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def _evict(self) -> None:
+        while len(self._entries) > self.max_size:
+            key, _ = self._entries.popitem(last=False)
+            self.evictions += 1
+            self._touched.pop(key, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        """
+        Removes all the responses from memory and from disk. Counters are left untouched.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._touched.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self) -> dict:
+        """
+        Returns the cache counters.
+
+        Returns:
+            dict: The number of hits, misses and evictions, the current size and the hit rate.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        """
+        Closes the underlying sqlite database, if any.
+        """
+        if self._db is not None:
+            with self._lock:
+                self._flush_touched()
+                self._db.commit()
+            self._db.close()
+            self._db = None
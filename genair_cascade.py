@@ -0,0 +1,261 @@
+"""
+Cascade of models of increasing size behind a single agent.
+
+The fast model answers every step first. Its response is sent to the next model only when it
+cannot be used (the reply does not follow the format of the prompt, or the action names no
+visible object, see `genair_escalation.needs_escalation`) and the larger model is expected to answer
+within the latency budget of the step. The statistics of the cascade (escalation rates and
+latencies of every model) are recorded to tune the budget and the choice of models.
+
+Usage:
+
+    agent = CascadeClient(LLMClient(), ["qwen2.5:0.5b", "qwen2.5:1.5b", "qwen2.5:7b"], 2.0)
+    response = agent.act(event, "Open the fridge")
+    print(agent.cascade_stats.summary())
+"""
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from genair_escalation import needs_escalation
+from genair_tracing import span
+
+# Weight of the last request in the mean latency of a model
+LATENCY_EWMA_ALPHA = 0.2
+
+
+class CascadeStats:
+    """
+    Counts how often every model of a cascade had the last word, and how long the steps took.
+
+    Attributes:
+        models (list): The models of the cascade, smallest first.
+        steps (int): The number of steps (queries of the agent).
+        escalations (int): The number of steps sent to more than one model.
+        skipped (int): The number of escalations that were not done because the next model
+            was not expected to answer within the latency budget.
+        requests (list): The number of requests sent to every model.
+        rejected (list): The number of responses of every model that needed an escalation.
+        answered (list): The number of steps answered by every model.
+        latency_ewma (list): The exponentially weighted mean latency of every model, in
+            seconds, None until the model was queried. It is kept by `reset`, since it decides
+            the escalations of the next episodes.
+        step_latencies (deque): The latencies of the last steps, in seconds.
+    """
+
+    def __init__(self, models: list) -> None:
+        self.models = list(models)
+        self._lock = threading.Lock()
+        self.latency_ewma = [None] * len(self.models)
+        self.reset()
+
+    def reset(self) -> None:
+        self.steps = 0
+        self.escalations = 0
+        self.skipped = 0
+        self.requests = [0] * len(self.models)
+        self.rejected = [0] * len(self.models)
+        self.answered = [0] * len(self.models)
+        self._latency = [0.0] * len(self.models)
+        self.step_latencies = deque(maxlen=1000)
+
+    def record_request(self, stage: int, latency: float, rejected: bool) -> None:
+        with self._lock:
+            self.requests[stage] += 1
+            self.rejected[stage] += int(rejected)
+            self._latency[stage] += latency
+            ewma = self.latency_ewma[stage]
+            self.latency_ewma[stage] = (
+                latency
+                if ewma is None
+                else LATENCY_EWMA_ALPHA * latency + (1 - LATENCY_EWMA_ALPHA) * ewma
+            )
+
+    def record_step(self, stage: int, latency: float, skipped: bool) -> None:
+        with self._lock:
+            self.steps += 1
+            self.escalations += int(stage > 0)
+            self.skipped += int(skipped)
+            self.answered[stage] += 1
+            self.step_latencies.append(latency)
+
+    def summary(self) -> dict:
+        """
+        Returns:
+            dict: The counters, the escalation rate, the rate of skipped escalations, and for
+                every model the rate of rejected responses and the mean latency (in seconds),
+                and the p50/p95 step latency in milliseconds.
+        """
+        import numpy
+
+        with self._lock:
+            latencies = numpy.array(self.step_latencies) * 1000
+            return {
+                "models": list(self.models),
+                "steps": self.steps,
+                "escalations": self.escalations,
+                "escalation_rate": self.escalations / self.steps if self.steps else 0.0,
+                "skipped": self.skipped,
+                "skip_rate": self.skipped / self.steps if self.steps else 0.0,
+                "requests": list(self.requests),
+                "answered": list(self.answered),
+                "rejection_rate": [
+                    rejected / requests if requests else None
+                    for rejected, requests in zip(self.rejected, self.requests)
+                ],
+                "mean_latency": [
+                    total / requests if requests else None
+                    for total, requests in zip(self._latency, self.requests)
+                ],
+                "p50_step_ms": float(numpy.percentile(latencies, 50)) if len(latencies) else None,
+                "p95_step_ms": float(numpy.percentile(latencies, 95)) if len(latencies) else None,
+            }
+
+
+class CascadeClient:
+    """
+    Queries a fast model first and larger models only when its response cannot be used.
+
+    The cascade wraps an LLMClient or a VLMClient, whose prompt, history and parsing are used
+    for every model: a step builds the messages once and sends the same messages to each model
+    in turn. Only the kept reply goes to the history. The other attributes and methods (e.g.
+    `reset`, `resolve_action` or `output_stats`) are those of the wrapped agent, so the cascade
+    can be used wherever an agent is expected (e.g. `genair_plan.run_instruction`).
+
+    With a latency budget, a response is only escalated when the time already spent on the
+    step plus the mean latency of the next model fits in the budget; otherwise the response of
+    the current model is kept. A model that was never queried is always tried, so that its
+    latency gets measured.
+
+    Attributes:
+        agent: The wrapped LLMClient or VLMClient.
+        models (list): The models of the cascade, smallest first.
+        latency_budget (Optional[float]): The time allowed for a step, in seconds. None never
+            skips an escalation.
+        cascade_stats (CascadeStats): The escalation and latency statistics.
+    """
+
+    def __init__(self, agent, models: list, latency_budget: Optional[float] = None) -> None:
+        """
+        Builds the cascade.
+
+        Args:
+            agent: The LLMClient or VLMClient used to build the prompts and parse the replies.
+            models (list): The models of the cascade, from the fastest to the most capable.
+            latency_budget (Optional[float]): The time allowed for a step, in seconds.
+        """
+        if not models:
+            raise ValueError("The cascade needs at least one model.")
+        if agent.cache is not None:
+            # the kept reply depends on the latency of the models, not only on the prompt
+            raise ValueError("The cascade cannot be combined with a response cache.")
+        if getattr(agent, "pyramid", None) is not None:
+            raise ValueError("The cascade cannot be combined with the image pyramid.")
+        if agent.backend is not None and any(e.model for e in agent.backend.endpoints):
+            # the endpoint would replace the model of every stage of the cascade
+            raise ValueError("The cascade cannot be combined with endpoints serving a model.")
+
+        self.agent = agent
+        self.models = list(models)
+        self.latency_budget = latency_budget
+        self.cascade_stats = CascadeStats(self.models)
+
+    @property
+    def model_name(self) -> str:
+        return ">".join(self.models)
+
+    def __getattr__(self, name: str):
+        # everything but the queries is handled by the wrapped agent
+        if name == "agent":
+            raise AttributeError(name)
+        return getattr(self.agent, name)
+
+    def warm_up(self, keep_alive="30m") -> bool:
+        # Loads every model of the cascade in the memory of the server
+        return all([self.agent.warm_up(keep_alive, model_name) for model_name in self.models])
+
+    def _within_budget(self, stage: int, start: float) -> bool:
+        expected = self.cascade_stats.latency_ewma[stage]
+        return (
+            self.latency_budget is None
+            or expected is None
+            or time.perf_counter() - start + expected <= self.latency_budget
+        )
+
+    def _check(self, stage: int, request_start: float, env_observation, raw_response: str):
+        # Parses the reply of a model and records whether it can be used
+        with span("parse_response"):
+            response = self.agent.postprocess_response(env_observation, raw_response)
+        rejected = needs_escalation(self.agent, env_observation, raw_response, response)
+        self.cascade_stats.record_request(stage, time.perf_counter() - request_start, rejected)
+        return response, rejected
+
+    def act(self, env_observation, language_input: str):
+        """
+        Sends a language input to the models of the cascade, from the smallest one, until a
+        response can be used or the budget runs out.
+
+        Args:
+            env_observation: The environment observation.
+            language_input (str): The language input provided by the user.
+
+        Returns:
+            AgentResponse: The kept response.
+        """
+        start = time.perf_counter()
+        with span("build_prompt"):
+            messages = self.agent._build_messages(env_observation, language_input)
+
+        skipped = False
+        for stage, model_name in enumerate(self.models):
+            request_start = time.perf_counter()
+            try:
+                with span("chat_completion", model=model_name, stage=stage):
+                    raw_response, _ = self.agent._complete(messages, model_name)
+            except Exception as e:
+                raise ValueError(f"Error: {e}")
+            response, rejected = self._check(stage, request_start, env_observation, raw_response)
+            if not rejected or stage == len(self.models) - 1:
+                break
+            if not self._within_budget(stage + 1, start):
+                skipped = True
+                break
+
+        self.agent._record_turn(messages, language_input, raw_response)
+        self.cascade_stats.record_step(stage, time.perf_counter() - start, skipped)
+        return response
+
+    async def aact(self, env_observation, language_input: str):
+        """
+        Asynchronous version of `act`, using the shared AsyncOpenAI client.
+
+        Args:
+            env_observation: The environment observation.
+            language_input (str): The language input provided by the user.
+
+        Returns:
+            AgentResponse: The kept response.
+        """
+        start = time.perf_counter()
+        with span("build_prompt"):
+            messages = self.agent._build_messages(env_observation, language_input)
+
+        skipped = False
+        for stage, model_name in enumerate(self.models):
+            request_start = time.perf_counter()
+            try:
+                with span("chat_completion", model=model_name, stage=stage):
+                    raw_response, _ = await self.agent._acomplete(messages, model_name)
+            except Exception as e:
+                raise ValueError(f"Error: {e}")
+            response, rejected = self._check(stage, request_start, env_observation, raw_response)
+            if not rejected or stage == len(self.models) - 1:
+                break
+            if not self._within_budget(stage + 1, start):
+                skipped = True
+                break
+
+        self.agent._record_turn(messages, language_input, raw_response)
+        self.cascade_stats.record_step(stage, time.perf_counter() - start, skipped)
+        return response
@@ -0,0 +1,297 @@
+import copy
+import functools
+import queue
+import threading
+import time
+from typing import Callable, Optional
+
+from genair_tracing import span
+
+# Settings of the simulators used by the agents
+CONTROLLER_KWARGS = {
+    "quality": "Medium",
+    "renderDepthImage": False,
+    "width": 640,
+    "height": 640,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def ithor_scenes(
+    include_kitchens: bool = True,
+    include_living_rooms: bool = True,
+    include_bedrooms: bool = True,
+    include_bathrooms: bool = True,
+) -> tuple:
+    """
+    Returns the names of the iTHOR scenes, as `Controller.ithor_scenes`, without a simulator.
+    The catalogue is computed once per process.
+
+    Args:
+        include_kitchens (bool): Whether to include the kitchens.
+        include_living_rooms (bool): Whether to include the living rooms.
+        include_bedrooms (bool): Whether to include the bedrooms.
+        include_bathrooms (bool): Whether to include the bathrooms.
+
+    Returns:
+        tuple: The scene names.
+    """
+    from ai2thor.controller import Controller
+
+    # ithor_scenes only looks at its arguments, so it can be called without a simulator
+    return tuple(
+        Controller.ithor_scenes(
+            None,
+            include_kitchens=include_kitchens,
+            include_living_rooms=include_living_rooms,
+            include_bedrooms=include_bedrooms,
+            include_bathrooms=include_bathrooms,
+        )
+    )
+
+
+def _make_controller(fake: bool, **kwargs):
+    if fake:
+        from genair_fake import FakeController
+
+        return FakeController(**kwargs)
+
+    from ai2thor.controller import Controller
+
+    return Controller(**kwargs)
+
+
+class ControllerPool:
+    """
+    Keeps simulators alive across episodes, so that an episode only pays for a reset to its
+    scene instead of the start-up of Unity.
+
+    Controllers are started on demand, up to `size`, and handed out by `checkout` already reset
+    to the requested scene. `release` makes them available to the next episode. A controller
+    whose reset fails (e.g. because the Unity process died) is stopped and replaced by a new
+    one. The first observation of every scene is kept, so its metadata (e.g. the objects of the
+    scene) is available without a simulator afterwards.
+
+    Simulators do not survive a fork, so every process needs its own pool. A pool can be shared
+    by the threads of a process.
+
+    Attributes:
+        size (int): The maximum number of controllers.
+        controller_kwargs (dict): The arguments of the controllers.
+        fake (bool): Whether the controllers are `FakeController`s.
+        launches (int): The number of controllers started.
+        resets (int): The number of resets done by `checkout`.
+        reset_time (float): The total time spent in these resets, in seconds.
+        launch_time (float): The total time spent starting controllers, in seconds.
+    """
+
+    def __init__(
+        self,
+        size: int = 1,
+        controller_kwargs: Optional[dict] = None,
+        fake: bool = False,
+        factory: Optional[Callable] = None,
+    ) -> None:
+        """
+        Creates an empty pool. Controllers are started by `start` or by the first checkouts.
+
+        Args:
+            size (int): The maximum number of controllers.
+            controller_kwargs (Optional[dict]): The arguments of the controllers. Defaults to
+                `CONTROLLER_KWARGS`.
+            fake (bool): Whether to use `FakeController`s, which do not need Unity.
+            factory (Optional[Callable]): Creates a controller from the keyword arguments.
+                Overrides `fake`.
+        """
+        if size < 1:
+            raise ValueError("size must be at least 1")
+
+        self.size = size
+        self.controller_kwargs = dict(
+            CONTROLLER_KWARGS if controller_kwargs is None else controller_kwargs
+        )
+        self.fake = fake
+        self._factory = factory or functools.partial(_make_controller, fake)
+
+        self._lock = threading.Lock()
+        self._idle = queue.LifoQueue()
+        self._num_controllers = 0
+        self._initial_metadata = {}
+        self._closed = False
+
+        self.launches = 0
+        self.resets = 0
+        self.reset_time = 0.0
+        self.launch_time = 0.0
+
+    def _launch(self):
+        start = time.perf_counter()
+        try:
+            with span("controller_launch"):
+                controller = self._factory(**self.controller_kwargs)
+        except Exception:
+            with self._lock:
+                self._num_controllers -= 1
+            raise
+
+        with self._lock:
+            self.launches += 1
+            self.launch_time += time.perf_counter() - start
+        return controller
+
+    def _discard(self, controller) -> None:
+        with self._lock:
+            self._num_controllers -= 1
+        try:
+            controller.stop()
+        except Exception as e:
+            print(f"Unable to stop a controller: {e}")
+
+    def _take(self, timeout: Optional[float]):
+        # an idle controller if there is one, a new one if the pool is not full, or the first
+        # controller released otherwise. Waiting is done in short slices, so that a waiter
+        # starts a new controller if one of the others is discarded in the meantime.
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError("The controller pool is closed.")
+                launch = self._num_controllers < self.size
+                if launch:
+                    self._num_controllers += 1
+            if launch:
+                return self._launch()
+
+            wait = 0.5 if deadline is None else min(0.5, deadline - time.monotonic())
+            if wait <= 0:
+                raise TimeoutError("No controller became available.")
+            try:
+                return self._idle.get(timeout=wait)
+            except queue.Empty:
+                pass
+
+    def _reset(self, controller, scene: str):
+        start = time.perf_counter()
+        with span("controller_reset", scene=scene):
+            # `reset` already initializes the scene and returns its first observation
+            event = controller.reset(scene=scene)
+
+        with self._lock:
+            self.resets += 1
+            self.reset_time += time.perf_counter() - start
+            if scene not in self._initial_metadata:
+                self._initial_metadata[scene] = copy.deepcopy(event.metadata)
+        return event
+
+    def start(self, num_controllers: Optional[int] = None) -> None:
+        """
+        Starts controllers ahead of the first checkouts.
+
+        Args:
+            num_controllers (Optional[int]): The number of controllers to start, at most the
+                free room in the pool. Defaults to filling the pool.
+        """
+        with self._lock:
+            room = self.size - self._num_controllers
+            count = room if num_controllers is None else min(num_controllers, room)
+            self._num_controllers += count
+        for _ in range(count):
+            self._idle.put(self._launch())
+
+    def checkout(self, scene: str, timeout: Optional[float] = None) -> tuple:
+        """
+        Takes a controller from the pool and resets it to a scene. The controller must be given
+        back with `release`.
+
+        Args:
+            scene (str): The scene of the episode.
+            timeout (Optional[float]): How long to wait for a controller when all of them are
+                in use. Waits forever by default.
+
+        Returns:
+            tuple: The controller and the first observation of the scene.
+        """
+        controller = self._take(timeout)
+        try:
+            return controller, self._reset(controller, scene)
+        except Exception as e:
+            print(f"Unable to reset a controller to {scene}, starting a new one: {e}")
+            self._discard(controller)
+
+        with self._lock:
+            self._num_controllers += 1
+        controller = self._launch()
+        try:
+            return controller, self._reset(controller, scene)
+        except Exception:
+            self._discard(controller)
+            raise
+
+    def release(self, controller, discard: bool = False) -> None:
+        """
+        Gives a controller back to the pool.
+
+        Args:
+            controller: A controller returned by `checkout`.
+            discard (bool): Whether to stop the controller instead, e.g. because the simulator
+                stopped responding. A new one is started when needed.
+        """
+        with self._lock:
+            closed = self._closed
+        if discard or closed:
+            self._discard(controller)
+        else:
+            self._idle.put(controller)
+
+    def initial_metadata(self, scene: str) -> Optional[dict]:
+        """
+        Args:
+            scene (str): The name of a scene.
+
+        Returns:
+            Optional[dict]: The metadata of the first observation of the scene, or None if no
+                controller was reset to it yet.
+        """
+        with self._lock:
+            return self._initial_metadata.get(scene)
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: The number of controllers, launches and resets, and the mean launch and reset
+                times in seconds.
+        """
+        with self._lock:
+            return {
+                "controllers": self._num_controllers,
+                "launches": self.launches,
+                "resets": self.resets,
+                "mean_launch_time": self.launch_time / self.launches if self.launches else 0.0,
+                "mean_reset_time": self.reset_time / self.resets if self.resets else 0.0,
+                "cached_scenes": len(self._initial_metadata),
+            }
+
+    def close(self) -> None:
+        """
+        Stops the idle controllers. Controllers that are checked out are stopped when they are
+        released.
+        """
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                controller = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(controller)
+
+    def __enter__(self) -> "ControllerPool":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
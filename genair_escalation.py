@@ -0,0 +1,34 @@
+"""
+Decides whether a response of an agent is worth asking again, to a larger model (see
+genair_cascade.py) or with a sharper image (see `genair_images.ImagePyramid`).
+"""
+from genair_actions import follows_format
+from genair_responses import NO_VISIBLE_OBJECT, StructuredResponse
+from genair_structured import parse_structured
+
+
+def needs_escalation(agent, event, raw_response: str, response) -> bool:
+    """
+    Checks whether a response is worth asking again with more information or a more capable
+    model: the reply does not follow the format of the prompt, or the action it starts with
+    names no visible object.
+
+    Args:
+        agent: The LLMClient or VLMClient that generated the response.
+        event: The observation the response was generated for.
+        raw_response (str): The raw response from the model.
+        response: The response returned by `postprocess_response`.
+
+    Returns:
+        bool: Whether the response should be asked again.
+    """
+    parsed = agent.structured and parse_structured(StructuredResponse, raw_response) is not None
+    if not parsed and not follows_format(raw_response):
+        return True
+
+    actions = getattr(response, "actions", None)
+    if actions:
+        # the other actions of a plan run in later observations, where their objects may be
+        # visible
+        response = agent.resolve_action(event, actions[0])
+    return getattr(response, "action", None) == NO_VISIBLE_OBJECT
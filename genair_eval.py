@@ -0,0 +1,462 @@
+"""
+Headless evaluation of the agents on a set of scripted tasks.
+
+Each task of the manifest describes an episode: the scene to load, the instructions given to
+the agent one after the other and the conditions that must hold at the end of the episode.
+Episodes run in parallel on a pool of worker processes, each one owning its own simulator, and
+one JSON line per episode is written to the output file.
+
+Example of a manifest (JSON list or JSONL file):
+
+    [
+        {
+            "task_id": "open-fridge",
+            "scene": "FloorPlan1_physics",
+            "instructions": ["Open the fridge"],
+            "success": [{"objectType": "Fridge", "isOpen": true}]
+        },
+        {
+            "task_id": "pickup-apple",
+            "scene": "kitchens",
+            "instructions": ["Pick up the apple"],
+            "success": [{"inventory": "Apple"}]
+        }
+    ]
+
+`scene` can also be one of "kitchens", "living_rooms", "bedrooms" or "bathrooms", in which case
+the task is repeated in every scene of that category.
+
+Usage:
+
+    python genair_eval.py --manifest tasks.json --output results.jsonl --agent llm --workers 4
+    python genair_eval.py --manifest tasks.json --output results.jsonl --fake
+    python genair_eval.py --manifest tasks.json --output results.jsonl --plan --max-replans 2
+    python genair_eval.py --manifest tasks.json --output results.jsonl --structured
+    python genair_eval.py --manifest tasks.json --output results.jsonl --agent vlm --pyramid
+    python genair_eval.py --manifest tasks.json --output results.jsonl \
+        --cascade qwen2.5:0.5b --cascade qwen2.5:7b --latency-budget 2.0
+    python genair_eval.py --manifest tasks.json --output results.jsonl --workers 8 \
+        --backend http://gpu1:11434/v1 --backend http://gpu2:11434/v1=llama3.2:1b
+"""
+import argparse
+import json
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from genair_backends import STRATEGIES, parse_endpoint
+from genair_controllers import CONTROLLER_KWARGS, ControllerPool, ithor_scenes
+from genair_plan import run_instruction
+
+SCENE_CATEGORIES = ("kitchens", "living_rooms", "bedrooms", "bathrooms")
+
+
+def load_manifest(path: str) -> list:
+    """
+    Loads the tasks of a manifest and expands the scene categories.
+
+    Args:
+        path (str): A JSON file containing a list of tasks, or a JSONL file with one task per
+            line.
+
+    Returns:
+        list: The tasks, one per episode.
+    """
+    with open(path) as f:
+        if path.endswith(".jsonl"):
+            tasks = [json.loads(line) for line in f if line.strip()]
+        else:
+            tasks = json.load(f)
+
+    episodes = []
+    for i, task in enumerate(tasks):
+        if "instructions" not in task or "scene" not in task:
+            raise ValueError(f"Task {i} must define 'scene' and 'instructions'.")
+
+        task = {"task_id": str(task.get("task_id", i)), "success": [], **task}
+        scene = task["scene"]
+        if scene in SCENE_CATEGORIES:
+            scenes = ithor_scenes(
+                **{f"include_{category}": category == scene for category in SCENE_CATEGORIES}
+            )
+            episodes.extend({**task, "scene": name} for name in scenes)
+        else:
+            episodes.append(task)
+
+    return episodes
+
+
+def check_success(conditions: list, event) -> bool:
+    """
+    Checks the success conditions of a task against the last observation of an episode.
+
+    Each condition is a dictionary. `{"inventory": "Apple"}` requires the agent to hold an
+    object of that type, `{"lastActionSuccess": true}` requires the last action to have
+    succeeded, and any other condition (e.g. `{"objectType": "Fridge", "isOpen": true}`)
+    requires at least one object of the scene to match all the given properties.
+
+    Args:
+        conditions (list): The success conditions of the task.
+        event: The last observation of the episode.
+
+    Returns:
+        bool: True if all the conditions hold.
+    """
+    return _conditions_hold(conditions, event.metadata)
+
+
+def _conditions_hold(conditions: list, metadata: dict) -> bool:
+    for condition in conditions:
+        if "inventory" in condition:
+            held = [o["objectType"] for o in metadata["inventoryObjects"]]
+            if condition["inventory"] not in held:
+                return False
+        elif "lastActionSuccess" in condition:
+            if metadata["lastActionSuccess"] != condition["lastActionSuccess"]:
+                return False
+        elif not any(
+            all(o.get(key) == value for key, value in condition.items())
+            for o in metadata["objects"]
+        ):
+            return False
+    return True
+
+
+# State of a worker process: its simulator and its agent
+_worker = {}
+
+
+def _init_worker(
+    agent_type: str,
+    model_name: str,
+    fake: bool,
+    plan: bool,
+    max_replans: int,
+    structured: bool,
+    backends: list,
+    strategy: str,
+    pyramid: bool,
+    cascade: list,
+    latency_budget: float,
+) -> None:
+    # the simulator is started once and reset to the scene of every episode
+    controllers = ControllerPool(size=1, controller_kwargs=CONTROLLER_KWARGS, fake=fake)
+    controllers.start()
+
+    agent_kwargs = {"plan": plan, "structured": structured}
+    if model_name:
+        agent_kwargs["model_name"] = model_name
+    if backends:
+        from genair_backends import BackendPool
+
+        agent_kwargs["backend"] = BackendPool(backends, strategy=strategy)
+
+    if agent_type == "vlm":
+        from genair_vlm import VLMClient
+
+        if pyramid:
+            from genair_images import ImagePyramid
+
+            agent_kwargs["pyramid"] = ImagePyramid()
+        agent = VLMClient(**agent_kwargs)
+    else:
+        from genair_llm import LLMClient
+
+        agent = LLMClient(**agent_kwargs)
+
+    if cascade:
+        from genair_cascade import CascadeClient
+
+        agent = CascadeClient(agent, cascade, latency_budget)
+
+    _worker["controllers"] = controllers
+    _worker["agent"] = agent
+    _worker["max_replans"] = max_replans
+    # the savings of the pyramid are estimated from requests measured on the first episode
+    _worker["calibrate"] = getattr(agent, "pyramid", None) is not None
+
+
+def run_episode(task: dict) -> dict:
+    """
+    Runs an episode in the worker process, following the same steps as `main()` in
+    genair_llm.py: every instruction is sent to the agent and the generated actions are
+    executed in the simulator. The model is queried again (at most `max_replans` times per
+    instruction) only when an action fails.
+
+    Args:
+        task (dict): The task to run.
+
+    Returns:
+        dict: The result of the episode.
+    """
+    controllers = _worker["controllers"]
+    agent = _worker["agent"]
+    pyramid_stats = getattr(agent, "pyramid_stats", None)
+    cascade_stats = getattr(agent, "cascade_stats", None)
+    start_time = time.perf_counter()
+
+    result = {
+        "task_id": task["task_id"],
+        "scene": task["scene"],
+        "model": agent.model_name,
+        "success": False,
+        "initially_successful": False,
+        "steps": [],
+        "error": None,
+    }
+
+    controller = None
+    try:
+        agent.reset()
+        agent.output_stats.reset()
+        if pyramid_stats is not None:
+            pyramid_stats.reset()
+        if cascade_stats is not None:
+            cascade_stats.reset()
+        controller, event = controllers.checkout(task["scene"])
+        if _worker["calibrate"]:
+            agent.calibrate_pyramid(event)
+            _worker["calibrate"] = False
+        result["setup_duration"] = time.perf_counter() - start_time
+
+        for instruction in task["instructions"]:
+            step_start = time.perf_counter()
+            event, step = run_instruction(
+                agent, controller, event, instruction, max_replans=_worker["max_replans"]
+            )
+            step["duration"] = time.perf_counter() - step_start
+            result["steps"].append(step)
+
+        result["success"] = check_success(task["success"], event)
+        # a task whose conditions hold in the first observation of its scene measures nothing
+        initial_metadata = controllers.initial_metadata(task["scene"])
+        result["initially_successful"] = initial_metadata is not None and _conditions_hold(
+            task["success"], initial_metadata
+        )
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        if controller is not None:
+            controllers.release(controller)
+
+    result["duration"] = time.perf_counter() - start_time
+    # parse failures of the structured mode and tokens generated by the model
+    result["output_stats"] = agent.output_stats.summary()
+    if pyramid_stats is not None:
+        # escalations and the tokens and time saved against the full-resolution images
+        result["pyramid_stats"] = pyramid_stats.summary()
+    if cascade_stats is not None:
+        # how often the larger models were needed, or skipped for the latency budget
+        result["cascade_stats"] = cascade_stats.summary()
+    return result
+
+
+def run_evaluation(
+    tasks: list,
+    output_path: str,
+    agent_type: str = "llm",
+    model_name: str = None,
+    num_workers: int = 2,
+    fake: bool = False,
+    plan: bool = False,
+    max_replans: int = 1,
+    structured: bool = False,
+    backends: list = None,
+    strategy: str = "least_outstanding",
+    pyramid: bool = False,
+    cascade: list = None,
+    latency_budget: float = None,
+) -> dict:
+    """
+    Runs all the episodes on a pool of worker processes and writes their results to a JSONL
+    file as soon as they complete.
+
+    Args:
+        tasks (list): The tasks returned by `load_manifest`.
+        output_path (str): The JSONL file where the results are written.
+        agent_type (str): "llm" or "vlm".
+        model_name (str): The Ollama model to use. Defaults to the model of the agent.
+        num_workers (int): The number of worker processes (and simulators).
+        fake (bool): Whether to use the fake simulator instead of AI2-THOR.
+        plan (bool): Whether the agent generates all the actions of an instruction at once.
+        max_replans (int): How many times the model can be queried again after a failed
+            action.
+        structured (bool): Whether the model generates JSON responses following a schema.
+        backends (Optional[list]): The inference endpoints shared by the agents of each
+            worker, as accepted by `BackendPool`. Defaults to the local Ollama server.
+        strategy (str): How requests are spread over the endpoints.
+        pyramid (bool): Whether the VLM sends a downscaled image first and the full frame only
+            when it cannot act on it (see `genair_images.ImagePyramid`).
+        cascade (Optional[list]): The models of a cascade, from the fastest to the most
+            capable (see `genair_cascade.CascadeClient`). Replaces `model_name`.
+        latency_budget (Optional[float]): The time allowed for a step of the cascade, in
+            seconds.
+
+    Returns:
+        dict: A summary with the number of episodes, successes, episodes whose success
+            conditions already held when they started, and errors, and the totals of
+            the output statistics of the agents and, with `pyramid` or `cascade`, of the
+            escalations.
+    """
+    summary = {
+        "episodes": 0,
+        "successes": 0,
+        "initially_successful": 0,
+        "errors": 0,
+        "responses": 0,
+        "parse_failures": 0,
+        "completions": 0,
+        "output_tokens": 0,
+    }
+    if pyramid:
+        summary.update(queries=0, escalations=0, saved_prompt_tokens=0, saved_latency=0.0)
+    if cascade:
+        summary.update(cascade_steps=0, cascade_escalations=0, cascade_skipped=0)
+
+    # Unity and the HTTP clients do not survive a fork, so workers start from a fresh process
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=num_workers,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(
+            agent_type,
+            model_name,
+            fake,
+            plan,
+            max_replans,
+            structured,
+            backends,
+            strategy,
+            pyramid,
+            cascade,
+            latency_budget,
+        ),
+    ) as executor, open(output_path, "w") as output:
+        futures = [executor.submit(run_episode, task) for task in tasks]
+        for future in as_completed(futures):
+            result = future.result()
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+
+            summary["episodes"] += 1
+            summary["successes"] += int(result["success"])
+            summary["initially_successful"] += int(result["initially_successful"])
+            summary["errors"] += int(result["error"] is not None)
+            for key in ("responses", "parse_failures", "completions", "output_tokens"):
+                summary[key] += result["output_stats"][key]
+            for key in ("queries", "escalations", "saved_prompt_tokens", "saved_latency"):
+                # savings that could not be estimated are left out
+                if "pyramid_stats" in result and result["pyramid_stats"][key] is not None:
+                    summary[key] += result["pyramid_stats"][key]
+            for key in ("steps", "escalations", "skipped"):
+                if "cascade_stats" in result:
+                    summary[f"cascade_{key}"] += result["cascade_stats"][key]
+            print(
+                f"[{summary['episodes']}/{len(tasks)}] {result['task_id']} "
+                f"({result['scene']}): {'success' if result['success'] else 'failure'}"
+            )
+
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--manifest", required=True, help="JSON or JSONL file with the tasks")
+    parser.add_argument("--output", default="results.jsonl", help="JSONL file for the results")
+    parser.add_argument("--agent", choices=("llm", "vlm"), default="llm")
+    parser.add_argument("--model", default=None, help="Ollama model (defaults to the agent's)")
+    parser.add_argument("--workers", type=int, default=2, help="number of worker processes")
+    parser.add_argument(
+        "--fake", action="store_true", help="use the fake simulator instead of AI2-THOR"
+    )
+    parser.add_argument(
+        "--plan", action="store_true", help="generate all the actions of an instruction at once"
+    )
+    parser.add_argument(
+        "--max-replans",
+        type=int,
+        default=1,
+        help="queries after a failed action, per instruction",
+    )
+    parser.add_argument(
+        "--structured",
+        action="store_true",
+        help="constrain the model to JSON responses following a schema",
+    )
+    parser.add_argument(
+        "--backend",
+        action="append",
+        type=parse_endpoint,
+        help="inference endpoint as URL or URL=MODEL, can be repeated to spread the requests",
+    )
+    parser.add_argument(
+        "--strategy",
+        choices=STRATEGIES,
+        default="least_outstanding",
+        help="how requests are spread over the endpoints",
+    )
+    parser.add_argument(
+        "--pyramid",
+        action="store_true",
+        help="send a downscaled image first and the full frame only when needed (VLM only)",
+    )
+    parser.add_argument(
+        "--cascade",
+        action="append",
+        help="model of a cascade, from the fastest to the most capable, can be repeated",
+    )
+    parser.add_argument(
+        "--latency-budget",
+        type=float,
+        default=None,
+        help="seconds allowed per step before the cascade stops escalating",
+    )
+    args = parser.parse_args()
+    if args.cascade and any(isinstance(backend, tuple) for backend in args.backend or []):
+        parser.error("--cascade chooses the model of every request, use --backend URL only")
+
+    tasks = load_manifest(args.manifest)
+    summary = run_evaluation(
+        tasks,
+        args.output,
+        agent_type=args.agent,
+        model_name=args.model,
+        num_workers=args.workers,
+        fake=args.fake,
+        plan=args.plan,
+        max_replans=args.max_replans,
+        structured=args.structured,
+        backends=args.backend,
+        strategy=args.strategy,
+        pyramid=args.pyramid,
+        cascade=args.cascade,
+        latency_budget=args.latency_budget,
+    )
+
+    success_rate = summary["successes"] / max(1, summary["episodes"])
+    print("------")
+    print(f"Episodes: {summary['episodes']} (errors: {summary['errors']})")
+    print(f"Success rate: {success_rate:.1%}")
+    if summary["initially_successful"]:
+        print(f"Successful before the first action: {summary['initially_successful']}")
+    if summary["completions"]:
+        print(f"Output tokens per completion: {summary['output_tokens'] / summary['completions']:.1f}")
+    if summary["responses"]:
+        print(f"Parse failures: {summary['parse_failures']}/{summary['responses']}")
+    if summary.get("queries"):
+        print(f"Escalated queries: {summary['escalations']}/{summary['queries']}")
+        print(
+            f"Saved against full resolution: {summary['saved_prompt_tokens']:.0f} prompt tokens, "
+            f"{summary['saved_latency']:.1f} s"
+        )
+    if summary.get("cascade_steps"):
+        print(
+            f"Cascade escalations: {summary['cascade_escalations']}/{summary['cascade_steps']} "
+            f"(skipped for the latency budget: {summary['cascade_skipped']})"
+        )
+    print(f"Results are available in '{args.output}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+import random
+import time
+import zlib
+from typing import Optional
+
+import numpy
+
+# Object types that appear in the fake kitchens, with the interactions they support
+KITCHEN_OBJECT_TYPES = {
+    "Apple": {"pickupable": True, "sliceable": True},
+    "Bread": {"pickupable": True, "sliceable": True},
+    "Bowl": {"pickupable": True, "receptacle": True},
+    "ButterKnife": {"pickupable": True},
+    "Cabinet": {"openable": True, "receptacle": True},
+    "CoffeeMachine": {"toggleable": True, "receptacle": True},
+    "CounterTop": {"receptacle": True},
+    "Cup": {"pickupable": True, "receptacle": True},
+    "DishSponge": {"pickupable": True},
+    "Drawer": {"openable": True, "receptacle": True},
+    "Egg": {"pickupable": True, "sliceable": True},
+    "Faucet": {"toggleable": True},
+    "Fork": {"pickupable": True},
+    "Fridge": {"openable": True, "receptacle": True},
+    "Knife": {"pickupable": True},
+    "Lettuce": {"pickupable": True, "sliceable": True},
+    "LightSwitch": {"toggleable": True},
+    "Microwave": {"openable": True, "toggleable": True, "receptacle": True},
+    "Mug": {"pickupable": True, "receptacle": True},
+    "Pan": {"pickupable": True, "receptacle": True},
+    "Plate": {"pickupable": True, "receptacle": True},
+    "Pot": {"pickupable": True, "receptacle": True},
+    "Potato": {"pickupable": True, "sliceable": True},
+    "SaltShaker": {"pickupable": True},
+    "Sink": {"receptacle": True},
+    "Spatula": {"pickupable": True},
+    "Spoon": {"pickupable": True},
+    "StoveBurner": {"toggleable": True, "receptacle": True},
+    "StoveKnob": {"toggleable": True},
+    "Toaster": {"toggleable": True, "receptacle": True},
+    "Tomato": {"pickupable": True, "sliceable": True},
+}
+
+# Objects that must exist in every fake kitchen, so that scripted tasks can rely on them
+_FIXED_OBJECT_TYPES = ["Fridge", "Microwave", "CounterTop", "Apple", "Mug", "Knife", "Sink"]
+
+
+class FakeEvent:
+    """
+    Stand-in for `ai2thor.server.Event` exposing the attributes used by the agents and the
+    evaluation tools: `metadata` and `frame`.
+
+    Attributes:
+        metadata (dict): The metadata of the observation, in the AI2-THOR format.
+        frame (numpy.ndarray): The RGB frame of the observation.
+    """
+
+    def __init__(self, metadata: dict, frame: numpy.ndarray) -> None:
+        self.metadata = metadata
+        self.frame = frame
+
+    def __repr__(self) -> str:
+        return (
+            f"<FakeEvent: scene={self.metadata['sceneName']} "
+            f"action={self.metadata['lastAction']} "
+            f"success={self.metadata['lastActionSuccess']}>"
+        )
+
+
+class FakeController:
+    """
+    Stand-in for `ai2thor.controller.Controller` that does not need Unity. It generates a
+    deterministic kitchen for every scene name and implements the actions listed in the
+    system prompts with a simplified logic, so that the agent loop and the evaluation tools
+    can run (and be benchmarked) on any machine.
+
+    Attributes:
+        width (int): The width of the frames.
+        height (int): The height of the frames.
+        num_objects (int): The number of objects in each scene.
+        scene (str): The name of the current scene.
+        last_event (FakeEvent): The event returned by the last action.
+    """
+
+    def __init__(
+        self,
+        width: int = 640,
+        height: int = 640,
+        num_objects: int = 120,
+        visible_ratio: float = 0.3,
+        scene: str = "FloorPlan1_physics",
+        launch_delay: float = 0.0,
+        reset_delay: float = 0.0,
+        **kwargs,
+    ) -> None:
+        """
+        Initializes the fake simulator and loads a scene.
+
+        Args:
+            width (int): The width of the frames.
+            height (int): The height of the frames.
+            num_objects (int): The number of objects in each scene.
+            visible_ratio (float): The fraction of objects visible from any given pose.
+            scene (str): The scene loaded at start-up.
+            launch_delay (float): Seconds spent starting up, to mimic the launch of Unity in
+                benchmarks.
+            reset_delay (float): Seconds spent in every reset, to mimic the loading of a scene.
+            **kwargs: Other Controller arguments (e.g. quality), accepted and ignored.
+        """
+        self.width = width
+        self.height = height
+        self.num_objects = num_objects
+        self.visible_ratio = visible_ratio
+        self.last_event = None
+        self.reset_delay = reset_delay
+        time.sleep(launch_delay)
+        self.reset(scene=scene)
+
+    def ithor_scenes(
+        self,
+        include_kitchens: bool = True,
+        include_living_rooms: bool = True,
+        include_bedrooms: bool = True,
+        include_bathrooms: bool = True,
+    ) -> list:
+        """
+        Returns the same scene names as `Controller.ithor_scenes`.
+        """
+        from genair_controllers import ithor_scenes
+
+        return list(
+            ithor_scenes(
+                include_kitchens=include_kitchens,
+                include_living_rooms=include_living_rooms,
+                include_bedrooms=include_bedrooms,
+                include_bathrooms=include_bathrooms,
+            )
+        )
+
+    def reset(self, scene: Optional[str] = None, **kwargs) -> FakeEvent:
+        """
+        Loads a scene, generating its objects from the scene name.
+
+        Args:
+            scene (Optional[str]): The scene to load. Defaults to the current scene.
+
+        Returns:
+            FakeEvent: The first observation of the scene.
+        """
+        time.sleep(self.reset_delay)
+        if scene is not None:
+            self.scene = scene
+
+        seed = zlib.crc32(self.scene.encode("utf-8"))
+        self._rng = random.Random(seed)
+        self._objects = self._generate_objects()
+        self._inventory = None
+        self._position = {"x": 0.0, "y": 0.9, "z": 0.0}
+        self._rotation = 0.0
+        self._horizon = 0.0
+
+        frame_rng = numpy.random.default_rng(seed)
+        self._base_frame = frame_rng.integers(
+            0, 256, size=(self.height, self.width, 3), dtype=numpy.uint8
+        )
+        self._frame = None
+        self._update_visibility()
+        return self._event("Reset", True)
+
+    def _generate_objects(self) -> list:
+        types = list(KITCHEN_OBJECT_TYPES)
+        object_types = _FIXED_OBJECT_TYPES + [
+            self._rng.choice(types)
+            for _ in range(max(0, self.num_objects - len(_FIXED_OBJECT_TYPES)))
+        ]
+
+        objects = []
+        for object_type in object_types:
+            position = {
+                "x": round(self._rng.uniform(-3, 3), 2),
+                "y": round(self._rng.uniform(0, 2), 2),
+                "z": round(self._rng.uniform(-3, 3), 2),
+            }
+            affordances = KITCHEN_OBJECT_TYPES[object_type]
+            objects.append(
+                {
+                    "objectId": (
+                        f"{object_type}|{position['x']:+06.2f}|"
+                        f"{position['y']:+06.2f}|{position['z']:+06.2f}"
+                    ),
+                    "objectType": object_type,
+                    "name": object_type,
+                    "position": position,
+                    "distance": 0.0,
+                    "visible": False,
+                    "openable": affordances.get("openable", False),
+                    "isOpen": False,
+                    "pickupable": affordances.get("pickupable", False),
+                    "isPickedUp": False,
+                    "toggleable": affordances.get("toggleable", False),
+                    "isToggled": False,
+                    "sliceable": affordances.get("sliceable", False),
+                    "isSliced": False,
+                    "receptacle": affordances.get("receptacle", False),
+                    "receptacleObjectIds": [] if affordances.get("receptacle") else None,
+                    "parentReceptacles": None,
+                }
+            )
+        return objects
+
+    def _update_visibility(self) -> None:
+        # Visibility is a deterministic function of the pose of the agent, so that moving
+        # around changes the visible objects like in the real simulator
+        pose_key = (
+            f"{self.scene}|{self._position['x']:.2f}|{self._position['z']:.2f}|"
+            f"{self._rotation:.0f}|{self._horizon:.0f}"
+        )
+        pose_rng = random.Random(zlib.crc32(pose_key.encode("utf-8")))
+        for i, o in enumerate(self._objects):
+            o["distance"] = round(
+                (
+                    (o["position"]["x"] - self._position["x"]) ** 2
+                    + (o["position"]["z"] - self._position["z"]) ** 2
+                )
+                ** 0.5,
+                3,
+            )
+            # the fixed objects are always in view
+            o["visible"] = (
+                i < len(_FIXED_OBJECT_TYPES) or pose_rng.random() < self.visible_ratio
+            ) and not o["isPickedUp"]
+
+        # A new view is a shifted version of the base frame
+        shift = int(self._rotation + 7 * self._position["x"] + 11 * self._position["z"])
+        self._frame = numpy.roll(self._base_frame, shift=(int(self._horizon), shift), axis=(0, 1))
+
+    def _event(self, action: str, success: bool, error_message: str = "") -> FakeEvent:
+        inventory = []
+        if self._inventory is not None:
+            inventory = [
+                {
+                    "objectId": self._inventory["objectId"],
+                    "objectType": self._inventory["objectType"],
+                }
+            ]
+
+        metadata = {
+            "sceneName": self.scene,
+            "lastAction": action,
+            "lastActionSuccess": success,
+            "errorMessage": error_message,
+            "objects": [dict(o) for o in self._objects],
+            "inventoryObjects": inventory,
+            "agent": {
+                "position": dict(self._position),
+                "rotation": {"x": 0.0, "y": self._rotation, "z": 0.0},
+                "cameraHorizon": self._horizon,
+            },
+            "screenWidth": self.width,
+            "screenHeight": self.height,
+        }
+        self.last_event = FakeEvent(metadata, self._frame)
+        return self.last_event
+
+    def _find_visible(self, object_id: Optional[str]) -> Optional[dict]:
+        for o in self._objects:
+            if o["objectId"] == object_id and o["visible"]:
+                return o
+        return None
+
+    def step(self, action=None, **action_args) -> FakeEvent:
+        """
+        Executes an action, mirroring the signature of `Controller.step`.
+
+        Args:
+            action (Union[str, dict]): The name of the action, or a dictionary with the action
+                and its arguments.
+            **action_args: The arguments of the action (e.g. objectId, degrees).
+
+        Returns:
+            FakeEvent: The observation after the action.
+        """
+        if isinstance(action, dict):
+            action_args = {**action, **action_args}
+            action = action_args.pop("action")
+        elif action is None:
+            action = action_args.pop("action")
+
+        handler = getattr(self, f"_do_{action}", None)
+        if handler is None:
+            return self._event(action, False, f"Invalid action: {action}")
+
+        error_message = handler(**action_args)
+        if error_message is None:
+            self._update_visibility()
+        return self._event(action, error_message is None, error_message or "")
+
+    def stop(self) -> None:
+        """
+        Does nothing: there is no simulator process to stop.
+        """
+
+    def _do_Initialize(self, **kwargs) -> None:
+        return None
+
+    def _do_NoOp(self, **kwargs) -> None:
+        return None
+
+    def _do_Done(self, **kwargs) -> None:
+        return None
+
+    def _move(self, dx: float, dz: float) -> None:
+        self._position["x"] = round(self._position["x"] + dx, 2)
+        self._position["z"] = round(self._position["z"] + dz, 2)
+
+    def _do_MoveAhead(self, moveMagnitude: float = 0.25, **kwargs) -> None:
+        self._move(0.0, moveMagnitude)
+
+    def _do_MoveBack(self, moveMagnitude: float = 0.25, **kwargs) -> None:
+        self._move(0.0, -moveMagnitude)
+
+    def _do_MoveLeft(self, moveMagnitude: float = 0.25, **kwargs) -> None:
+        self._move(-moveMagnitude, 0.0)
+
+    def _do_MoveRight(self, moveMagnitude: float = 0.25, **kwargs) -> None:
+        self._move(moveMagnitude, 0.0)
+
+    def _do_RotateRight(self, degrees: float = 90.0, **kwargs) -> None:
+        self._rotation = (self._rotation + degrees) % 360
+
+    def _do_RotateLeft(self, degrees: float = 90.0, **kwargs) -> None:
+        self._rotation = (self._rotation - degrees) % 360
+
+    def _do_LookUp(self, degrees: float = 30.0, **kwargs) -> Optional[str]:
+        if self._horizon - degrees < -30:
+            return "Cannot look up any further."
+        self._horizon -= degrees
+
+    def _do_LookDown(self, degrees: float = 30.0, **kwargs) -> Optional[str]:
+        if self._horizon + degrees > 60:
+            return "Cannot look down any further."
+        self._horizon += degrees
+
+    def _set_property(
+        self, objectId: Optional[str], affordance: str, state: str, value: bool
+    ) -> Optional[str]:
+        target = self._find_visible(objectId)
+        if target is None:
+            return f"Object ID appears to be invalid or not visible: {objectId}"
+        if not target[affordance]:
+            return f"{objectId} is not {affordance}."
+        target[state] = value
+
+    def _do_OpenObject(self, objectId: Optional[str] = None, **kwargs) -> Optional[str]:
+        return self._set_property(objectId, "openable", "isOpen", True)
+
+    def _do_CloseObject(self, objectId: Optional[str] = None, **kwargs) -> Optional[str]:
+        return self._set_property(objectId, "openable", "isOpen", False)
+
+    def _do_ToggleObjectOn(self, objectId: Optional[str] = None, **kwargs) -> Optional[str]:
+        return self._set_property(objectId, "toggleable", "isToggled", True)
+
+    def _do_ToggleObjectOff(self, objectId: Optional[str] = None, **kwargs) -> Optional[str]:
+        return self._set_property(objectId, "toggleable", "isToggled", False)
+
+    def _do_PickupObject(self, objectId: Optional[str] = None, **kwargs) -> Optional[str]:
+        if self._inventory is not None:
+            return "Agent hand is already holding an object."
+        error_message = self._set_property(objectId, "pickupable", "isPickedUp", True)
+        if error_message is None:
+            self._inventory = self._find_visible(objectId)
+        return error_message
+
+    def _do_DropObject(self, **kwargs) -> Optional[str]:
+        if self._inventory is None:
+            return "Agent is not holding an object."
+        self._inventory["isPickedUp"] = False
+        self._inventory = None
+
+    def _do_PutObject(self, objectId: Optional[str] = None, **kwargs) -> Optional[str]:
+        if self._inventory is None:
+            return "Agent is not holding an object."
+        receptacle = self._find_visible(objectId)
+        if receptacle is None:
+            return f"Object ID appears to be invalid or not visible: {objectId}"
+        if not receptacle["receptacle"]:
+            return f"{objectId} is not a receptacle."
+        receptacle["receptacleObjectIds"].append(self._inventory["objectId"])
+        self._inventory["parentReceptacles"] = [receptacle["objectId"]]
+        self._inventory["isPickedUp"] = False
+        self._inventory = None
+
+    def _do_SliceObject(self, objectId: Optional[str] = None, **kwargs) -> Optional[str]:
+        if self._inventory is None or "Knife" not in self._inventory["objectType"]:
+            return "Agent must be holding a knife to slice objects."
+        return self._set_property(objectId, "sliceable", "isSliced", True)
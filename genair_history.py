@@ -0,0 +1,137 @@
+def estimate_tokens(text: str) -> int:
+    """
+    Roughly estimates the number of tokens of a text (about 4 characters per token), which is
+    enough to keep the prompt within a budget without loading a tokenizer.
+
+    Args:
+        text (str): The text to measure.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return len(text) // 4 + 1
+
+
+def _shorten(text: str, max_length: int = 120) -> str:
+    text = " ".join(text.split())
+    if len(text) <= max_length:
+        return text
+    return text[: max_length - 3] + "..."
+
+
+class ConversationHistory:
+    """
+    Keeps the previous turns of a conversation within a token budget.
+
+    Every turn is stored as the user instruction followed by the raw model reply, and turns are
+    never modified once added. The messages of a new request therefore start with exactly the
+    same bytes as the previous request (system prompt and earlier turns), so the inference
+    server can reuse the prompt cache it computed for them and only process the new messages.
+
+    When the turns exceed the budget, the oldest ones are compacted into a single summary
+    message. Compaction frees a large part of the budget at once, so that it happens rarely
+    and the prefix stays stable for many turns in between.
+
+    Attributes:
+        max_tokens (int): The token budget of the history. 0 disables the history.
+        compact_to (float): The fraction of the budget kept after a compaction.
+        turns (list): The turns as (instruction, reply) tuples, oldest first.
+        summary (list): One line per compacted turn, oldest first.
+    """
+
+    def __init__(self, max_tokens: int = 2048, compact_to: float = 0.5) -> None:
+        """
+        Initializes an empty history.
+
+        Args:
+            max_tokens (int): The token budget of the history. 0 disables the history.
+            compact_to (float): The fraction of the budget kept after a compaction.
+        """
+        if not 0 < compact_to < 1:
+            raise ValueError("compact_to must be between 0 and 1")
+
+        self.max_tokens = max_tokens
+        self.compact_to = compact_to
+        self.clear()
+
+    def clear(self) -> None:
+        self.turns = []
+        self.summary = []
+        self._turn_tokens = []
+        self._summary_tokens = 0
+        self._messages = []
+
+    def __len__(self) -> int:
+        return len(self.turns)
+
+    @property
+    def num_tokens(self) -> int:
+        """
+        The estimated number of tokens of the history messages.
+        """
+        return self._summary_tokens + sum(self._turn_tokens)
+
+    def add_turn(self, instruction: str, reply: str) -> None:
+        """
+        Adds a turn, compacting the oldest turns if the budget is exceeded.
+
+        Args:
+            instruction (str): The user instruction.
+            reply (str): The raw reply generated by the model.
+        """
+        if self.max_tokens <= 0 or reply is None:
+            return
+
+        self.turns.append((instruction, reply))
+        self._turn_tokens.append(estimate_tokens(instruction) + estimate_tokens(reply))
+        self._messages.extend(
+            [
+                {"role": "user", "content": instruction},
+                {"role": "assistant", "content": reply},
+            ]
+        )
+
+        if self.num_tokens > self.max_tokens:
+            self._compact()
+
+    def _compact(self) -> None:
+        # after a compaction, the recent turns and the summary take half of the target each
+        target = int(self.max_tokens * self.compact_to) // 2
+
+        # move the oldest turns to the summary
+        while self.turns and sum(self._turn_tokens) > target:
+            instruction, reply = self.turns.pop(0)
+            self._turn_tokens.pop(0)
+            line = f"- User: {_shorten(instruction)} | You: {_shorten(reply)}"
+            self.summary.append(line)
+            self._summary_tokens += estimate_tokens(line)
+
+        # the summary must leave room for the recent turns: forget its oldest lines
+        while self.summary and self._summary_tokens > target:
+            self._summary_tokens -= estimate_tokens(self.summary.pop(0))
+
+        self._messages = []
+        if self.summary:
+            self._messages.append(
+                {
+                    "role": "user",
+                    "content": "Summary of the earlier conversation:\n" + "\n".join(self.summary),
+                }
+            )
+        for instruction, reply in self.turns:
+            self._messages.extend(
+                [
+                    {"role": "user", "content": instruction},
+                    {"role": "assistant", "content": reply},
+                ]
+            )
+
+    def messages(self) -> list:
+        """
+        Returns the history as chat messages, to be placed between the system prompt and the
+        messages of the current turn.
+
+        Returns:
+            list: The messages in the OpenAI chat format.
+        """
+        return list(self._messages)
@@ -0,0 +1,411 @@
+import base64
+import io
+import threading
+from collections import OrderedDict
+from typing import Optional, Union
+
+import numpy
+from PIL import Image
+
+from genair_cache import hash_frame
+
+_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+
+class ImageEncoder:
+    """
+    Encodes simulator frames as base64 images for the VLM. Lossy formats are much faster to
+    encode than PNG and produce smaller requests, and frames can be downscaled before encoding.
+    Encoded frames are memoized by content, so an unchanged view (e.g. after a failed action)
+    is never encoded twice.
+
+    Attributes:
+        image_format (str): The image format, one of "JPEG", "WEBP" or "PNG".
+        quality (int): The quality used by the lossy formats (1-100).
+        max_size (Optional[int]): The maximum width/height of the encoded image, if any.
+        hits (int): The number of frames served from the memo.
+        misses (int): The number of frames that had to be encoded.
+    """
+
+    def __init__(
+        self,
+        image_format: str = "JPEG",
+        quality: int = 90,
+        max_size: Optional[int] = None,
+        memo_size: int = 32,
+    ) -> None:
+        """
+        Initializes the encoder.
+
+        Args:
+            image_format (str): The image format, one of "JPEG", "WEBP" or "PNG".
+            quality (int): The quality used by the lossy formats (1-100).
+            max_size (Optional[int]): The maximum width/height of the encoded image. Larger
+                frames are downscaled keeping their aspect ratio.
+            memo_size (int): The number of encoded frames remembered.
+        """
+        image_format = image_format.upper()
+        if image_format not in _MIME_TYPES:
+            raise ValueError(
+                f"Unsupported image format '{image_format}'. Use one of {list(_MIME_TYPES)}."
+            )
+
+        self.image_format = image_format
+        self.quality = quality
+        self.max_size = max_size
+        self.memo_size = memo_size
+        self.hits = 0
+        self.misses = 0
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def mime_type(self) -> str:
+        """
+        The MIME type of the encoded images, as used in data URLs.
+        """
+        return _MIME_TYPES[self.image_format]
+
+    @property
+    def settings(self) -> tuple:
+        """
+        The settings that affect the encoded image. They are part of the response cache key,
+        since the model sees a different image when they change.
+        """
+        return (self.image_format, self.quality, self.max_size)
+
+    def _resize(self, image: Image.Image) -> Image.Image:
+        if self.max_size is None or max(image.size) <= self.max_size:
+            return image
+
+        factor = max(image.size) / self.max_size
+        if factor == int(factor):
+            # reducing by an integer factor is a plain box filter and much faster than a resize
+            return image.reduce(int(factor))
+        size = (
+            max(1, round(image.width / factor)),
+            max(1, round(image.height / factor)),
+        )
+        return image.resize(size, Image.BILINEAR, reducing_gap=2.0)
+
+    def _encode(self, image: Image.Image) -> str:
+        image = self._resize(image)
+        buffered = io.BytesIO()
+        if self.image_format == "PNG":
+            # the default compression level spends a lot of time for a few bytes
+            image.save(buffered, format="PNG", compress_level=1)
+        elif self.image_format == "WEBP":
+            image.save(buffered, format="WEBP", quality=self.quality, method=0)
+        else:
+            image.save(buffered, format="JPEG", quality=self.quality)
+        return base64.b64encode(buffered.getbuffer()).decode("ascii")
+
+    def encode(self, frame: Union[numpy.ndarray, Image.Image]) -> str:
+        """
+        Encodes a frame as a base64 string.
+
+        Args:
+            frame (Union[numpy.ndarray, Image.Image]): The RGB frame returned by the simulator,
+                or a PIL image.
+
+        Returns:
+            str: The base64-encoded image.
+        """
+        if isinstance(frame, Image.Image):
+            # PIL images are not memoized: hashing them would require a copy of the pixels
+            return self._encode(frame)
+
+        frame = numpy.ascontiguousarray(frame)
+        key = hash_frame(frame)
+        with self._lock:
+            encoded = self._memo.get(key)
+            if encoded is not None:
+                self.hits += 1
+                self._memo.move_to_end(key)
+                return encoded
+
+        encoded = self._encode(Image.fromarray(frame))
+        with self._lock:
+            self.misses += 1
+            self._memo[key] = encoded
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return encoded
+
+    def encode_data_url(self, frame: Union[numpy.ndarray, Image.Image]) -> str:
+        """
+        Encodes a frame as a data URL that can be sent in an `image_url` message.
+
+        Args:
+            frame (Union[numpy.ndarray, Image.Image]): The RGB frame returned by the simulator,
+                or a PIL image.
+
+        Returns:
+            str: The data URL of the encoded image.
+        """
+        return f"data:{self.mime_type};base64,{self.encode(frame)}"
+
+
+class PyramidLevels:
+    """
+    The levels of the pyramid of one frame (see `ImagePyramid.levels`). Levels are encoded on
+    first use, so the full-resolution image is never encoded when a smaller one was enough.
+    """
+
+    def __init__(self, pyramid: "ImagePyramid", frame: numpy.ndarray, encoded: list) -> None:
+        self._pyramid = pyramid
+        self._frame = frame
+        self._image = None
+        # shared with the memo of the pyramid
+        self._encoded = encoded
+
+    def __len__(self) -> int:
+        return len(self._encoded)
+
+    def encode(self, level: int) -> str:
+        """
+        Args:
+            level (int): The level, from 0 (the smallest image) to `len(self) - 1` (the
+                largest one).
+
+        Returns:
+            str: The base64-encoded image of the level.
+        """
+        encoded = self._encoded[level]
+        if encoded is None:
+            if self._image is None:
+                # converted once for all the levels of the frame
+                self._image = Image.fromarray(self._frame)
+            encoded = self._pyramid.encoders[level]._encode(self._image)
+            self._pyramid._record_encode(level)
+            self._encoded[level] = encoded
+        return encoded
+
+    def data_url(self, level: int) -> str:
+        """
+        Args:
+            level (int): The level, from 0 (the smallest image) to `len(self) - 1`.
+
+        Returns:
+            str: The data URL of the image of the level.
+        """
+        return f"data:{self._pyramid.mime_type};base64,{self.encode(level)}"
+
+
+class ImagePyramid:
+    """
+    Encodes frames at several resolutions, from a small view of the scene to the full frame.
+    The VLM sends the smallest image first and only escalates to the next level when the model
+    could not act on it (see `VLMClient`), since the number of vision tokens, and with it the
+    prefill time, grows with the size of the image.
+
+    Every level is downscaled from the full frame. The levels of a frame are encoded at most
+    once: they are memoized by content, so escalating on an observation or seeing the same view
+    again reuses them.
+
+    Attributes:
+        sizes (tuple): The maximum width/height of every level, in increasing order. None keeps
+            the size of the frame.
+        encoders (list): The ImageEncoder of every level.
+        encodes (list): The number of images encoded at every level.
+        hits (int): The number of frames whose levels were found in the memo.
+        misses (int): The number of frames seen for the first time.
+    """
+
+    def __init__(
+        self,
+        sizes: tuple = (320, None),
+        image_format: str = "JPEG",
+        quality: int = 90,
+        memo_size: int = 32,
+    ) -> None:
+        """
+        Initializes the pyramid.
+
+        Args:
+            sizes (tuple): The maximum width/height of every level, in increasing order, the
+                last one being usually None (the full frame). Sizes that divide the frame size
+                are faster to produce (e.g. 320 and 160 for the 640x640 frames of the agents).
+            image_format (str): The image format, one of "JPEG", "WEBP" or "PNG".
+            quality (int): The quality used by the lossy formats (1-100).
+            memo_size (int): The number of frames whose levels are remembered.
+        """
+        if not sizes:
+            raise ValueError("The pyramid needs at least one level.")
+
+        self.sizes = tuple(sizes)
+        self.encoders = [ImageEncoder(image_format, quality, max_size=size) for size in sizes]
+        self.memo_size = memo_size
+        self.encodes = [0] * len(self.sizes)
+        self.hits = 0
+        self.misses = 0
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.sizes)
+
+    @property
+    def mime_type(self) -> str:
+        return self.encoders[0].mime_type
+
+    @property
+    def settings(self) -> tuple:
+        """
+        The settings that affect the encoded images, for the response cache key.
+        """
+        return (*self.encoders[0].settings[:2], self.sizes)
+
+    def _record_encode(self, level: int) -> None:
+        with self._lock:
+            self.encodes[level] += 1
+
+    def levels(self, frame: numpy.ndarray) -> PyramidLevels:
+        """
+        Returns the levels of a frame. The frame is hashed once, and the levels already encoded
+        for the same pixels are reused.
+
+        Args:
+            frame (numpy.ndarray): The RGB frame returned by the simulator.
+
+        Returns:
+            PyramidLevels: The levels of the frame.
+        """
+        frame = numpy.ascontiguousarray(frame)
+        key = hash_frame(frame)
+        with self._lock:
+            encoded = self._memo.get(key)
+            if encoded is not None:
+                self.hits += 1
+                self._memo.move_to_end(key)
+            else:
+                self.misses += 1
+                # only the encoded images are kept: the frame is not held by the memo
+                encoded = self._memo[key] = [None] * len(self.sizes)
+                while len(self._memo) > self.memo_size:
+                    self._memo.popitem(last=False)
+        return PyramidLevels(self, frame, encoded)
+
+
+class PyramidStats:
+    """
+    Measures the tokens and the time that the multi-resolution mode of the VLM saves against
+    sending every observation at full resolution.
+
+    A query records the requests it took, from the smallest level to the level whose response
+    was kept. On the fixed-resolution path, the query would have sent one full-resolution
+    request instead. The difference between a full-resolution request and a request at a lower
+    level is measured on requests with the same text, whose only difference is the image: the
+    queries escalated up to the full resolution, and the calibration requests (see
+    `VLMClient.calibrate_pyramid`). These differences are kept by `reset`, which only clears
+    the counters of the episode.
+
+    Attributes:
+        num_levels (int): The number of levels of the pyramid.
+        queries (int): The number of queries.
+        escalations (int): The number of queries that needed more than one request.
+        answered (list): The number of queries answered at every level.
+        requests (list): The number of requests sent at every level.
+    """
+
+    def __init__(self, num_levels: int) -> None:
+        self.num_levels = num_levels
+        self._lock = threading.Lock()
+        # per level: the number of measured differences with the full resolution and their
+        # total, for the prompt tokens and for the latency
+        self._token_deltas = [[0, 0] for _ in range(num_levels)]
+        self._latency_deltas = [[0, 0.0] for _ in range(num_levels)]
+        self.reset()
+
+    def reset(self) -> None:
+        self.queries = 0
+        self.escalations = 0
+        self.answered = [0] * self.num_levels
+        self.requests = [0] * self.num_levels
+        self._queries = []
+
+    def _add_deltas(self, attempts: list) -> None:
+        level, full_tokens, full_latency = attempts[-1]
+        if level != self.num_levels - 1:
+            return
+        for level, prompt_tokens, latency in attempts[:-1]:
+            if prompt_tokens is not None and full_tokens is not None:
+                self._token_deltas[level][0] += 1
+                self._token_deltas[level][1] += full_tokens - prompt_tokens
+            self._latency_deltas[level][0] += 1
+            self._latency_deltas[level][1] += full_latency - latency
+
+    def record_query(self, attempts: list) -> None:
+        """
+        Args:
+            attempts (list): The requests of the query, in order, as (level, prompt tokens or
+                None if the server did not report them, latency in seconds) tuples.
+        """
+        with self._lock:
+            self.queries += 1
+            self.escalations += int(len(attempts) > 1)
+            self.answered[attempts[-1][0]] += 1
+            for level, _, _ in attempts:
+                self.requests[level] += 1
+            self._add_deltas(attempts)
+            self._queries.append(attempts)
+
+    def record_calibration(self, attempts: list) -> None:
+        """
+        Records requests sent with the same text at every level, the last one at full
+        resolution. They are not counted as queries.
+
+        Args:
+            attempts (list): The requests, as in `record_query`.
+        """
+        with self._lock:
+            self._add_deltas(attempts)
+
+    @staticmethod
+    def _saved(attempts: list, index: int, deltas: list) -> Optional[float]:
+        values = [attempt[index] for attempt in attempts]
+        if None in values:
+            return None
+        # the last request replaces a full-resolution one, the others come on top of it
+        saved = -sum(values[:-1])
+        level = attempts[-1][0]
+        if level != len(deltas) - 1:
+            count, total = deltas[level]
+            if not count:
+                return None
+            saved += total / count
+        return saved
+
+    def summary(self) -> dict:
+        """
+        Returns:
+            dict: The counters, the mean difference of prompt tokens and latency (in seconds)
+                between a full-resolution request and a request at every level, the prompt
+                tokens and latency spent by the queries, and the estimated `saved_prompt_tokens`
+                and `saved_latency` against the full-resolution path (None until the
+                differences were measured for the levels used; negative when the escalations
+                cost more than they saved).
+        """
+        with self._lock:
+            result = {
+                "queries": self.queries,
+                "escalations": self.escalations,
+                "escalation_rate": self.escalations / self.queries if self.queries else 0.0,
+                "answered": list(self.answered),
+                "requests": list(self.requests),
+            }
+            for key, index, deltas in (
+                ("prompt_tokens", 1, self._token_deltas),
+                ("latency", 2, self._latency_deltas),
+            ):
+                result[f"{key}_delta"] = [
+                    total / count if count else None for count, total in deltas[:-1]
+                ]
+                result[key] = sum(
+                    attempt[index] or 0 for attempts in self._queries for attempt in attempts
+                )
+                estimates = [self._saved(attempts, index, deltas) for attempts in self._queries]
+                result[f"saved_{key}"] = (
+                    sum(estimates) if None not in estimates else None
+                )
+            return result
@@ -1,94 +1,120 @@
 import io
-import re
-from typing import Optional
-
-import imageio
-import numpy
-from ai2thor.controller import Controller
-from ai2thor.server import Event
-from openai import OpenAI
-from PIL import Image, ImageDraw, ImageFont
-import textwrap
-from pydantic import BaseModel
+from typing import TYPE_CHECKING, Optional
 
-# TODO: add a prompt to the model
-SYSTEM_PROMPT = """
-"""
-
-client = OpenAI(base_url="http://localhost:11434/v1", api_key="ollama")
-
-
-class AgentResponse(BaseModel):
-    """
-    Base class for agent responses. Provides a method to convert the response
-    to a dictionary, filtering out None values.
-    """
-
-    def to_dict(self) -> dict:
-        """
-        Converts the response object to a dictionary, excluding keys with None values.
-
-        Returns:
-            dict: A dictionary representation of the response.
-        """
-        current_dict = self.model_dump(mode="python")
-        return {key: value for key, value in current_dict.items() if value is not None}
-
-
-class AgentTextualResponse(AgentResponse):
-    """
-    Represents a textual response from the agent.
-
-    Attributes:
-        response (str): The textual response generated by the agent.
-    """
+from genair_agent import AgentClient
+from genair_cache import ResponseCache, make_cache_key
+from genair_objects import get_object_index
+from genair_observations import ObservationEncoder
+from genair_pipeline import AgentPipeline, warm_up_in_background
+from genair_plan import run_instruction
+from genair_responses import AgentResponse
+from genair_tracing import span, tracer
 
-    response: str
+if TYPE_CHECKING:
+    # The simulator, the video writer and the image libraries are only imported when they are
+    # used (see `main`), to keep the import fast
+    from ai2thor.server import Event
+    from PIL import Image
 
+    from genair_backends import BackendPool
 
-class AgentActionResponse(AgentResponse):
-    """
-    Represents an action response from the agent.
-
-    Attributes:
-        action (str): The action to be performed by the agent.
-        objectId (Optional[str]): The ID of the object involved in the action, if any.
-        degrees (Optional[float]): The degrees of rotation, if applicable.
-    """
-
-    action: str
-    objectId: Optional[str] = None
-    degrees: Optional[float] = None
+# TODO: add a prompt to the model
+SYSTEM_PROMPT = """
+"""
 
 
-class LLMClient:
+class LLMClient(AgentClient):
     """
     Client for interacting with a language model. Handles communication with the model
     and processes responses.
 
     Attributes:
         model_name (str): The name of the language model to use.
-        history (list): A history of interactions with the model.
+        history (ConversationHistory): The previous turns of the conversation.
+        cache (Optional[ResponseCache]): The cache of raw model responses, if any.
+        stream (bool): Whether responses are streamed and cut as soon as they are complete.
+        plan (bool): Whether the model generates a sequence of actions for each instruction.
+        system_prompt (str): The system prompt, including the plan instructions in plan mode.
+        observation_encoder (Optional[ObservationEncoder]): The encoder of the visible objects
+            when compact observations are enabled.
+        structured (bool): Whether the model generates JSON responses following a schema.
+        backend (Optional[BackendPool]): The pool of inference servers, if any.
+        output_stats (StructuredOutputStats): The parse failures and the output tokens.
+        last_turn (Optional[dict]): The prompt and the raw reply of the last query, e.g. to
+            record them in a trajectory.
     """
 
-    def __init__(self, model_name: str = "qwen2.5:1.5b") -> None:
+    def __init__(
+        self,
+        model_name: str = "qwen2.5:1.5b",
+        cache: Optional[ResponseCache] = None,
+        stream: bool = False,
+        max_history_tokens: int = 2048,
+        plan: bool = False,
+        compact_observations: bool = False,
+        structured: bool = False,
+        backend: Optional["BackendPool"] = None,
+    ) -> None:
         """
         Initializes the LLMClient with a specified model name.
 
         Args:
             model_name (str): The name of the language model to use.
+            cache (Optional[ResponseCache]): A cache of raw model responses. Responses are
+                generated with temperature 0, so the same prompt always gives the same answer.
+            stream (bool): Whether to stream the responses. The stream is closed as soon as a
+                complete action or "[Say]" sentence is generated, instead of waiting for the
+                model to stop talking.
+            max_history_tokens (int): The token budget of the conversation history. Older
+                turns are compacted into a summary when it is exceeded; 0 disables the history.
+            plan (bool): Whether to ask the model for all the actions needed by an instruction
+                at once. `act` then returns an AgentPlanResponse. Plans are generated without
+                streaming, since the stream would be cut after the first action.
+            compact_observations (bool): Whether to describe the visible objects with short
+                aliases (e.g. "Apple_1") instead of their full IDs, listed once in a reference
+                message after the system prompt. Every turn then only sends the objects that
+                appeared or disappeared since the reference.
+            structured (bool): Whether to constrain the model to JSON responses following the
+                schema of AgentActionResponse or AgentTextualResponse, with a tight
+                `max_tokens`. Responses that do not validate go through the regular
+                expression parser. Cannot be combined with the plan mode.
+            backend (Optional[BackendPool]): A pool of inference servers to spread the requests
+                over. Without it, requests go to the local Ollama server.
         """
-        self.model_name = model_name
-        self.history = []
+        super().__init__(
+            model_name,
+            SYSTEM_PROMPT,
+            cache=cache,
+            stream=stream,
+            max_history_tokens=max_history_tokens,
+            plan=plan,
+            structured=structured,
+            backend=backend,
+        )
+        self.observation_encoder = ObservationEncoder() if compact_observations else None
 
     def reset(self) -> None:
         """
         Resets the interaction history with the model.
         """
         print("Model history reset...")
-        self.history = []
+        self.history.clear()
+        if self.observation_encoder is not None:
+            self.observation_encoder.reset()
+        self.last_turn = None
+
+    def prepare(self, env_observation: "Event") -> None:
+        """
+        Precomputes the parts of the prompt that only depend on the observation (the index of
+        the visible objects), e.g. in a background thread while the user types the next
+        instruction.
+
+        Args:
+            env_observation: The environment observation containing metadata.
+        """
+        get_object_index(env_observation)
 
-    def _image_to_bytes(self, image: Image.Image) -> bytes:
+    def _image_to_bytes(self, image: "Image.Image") -> bytes:
         """
         Converts a PIL Image to a byte array in PNG format.
 
@@ -103,10 +129,11 @@ class LLMClient:
         return img_byte_arr.getvalue()
 
     def _get_object_id(
-        self, raw_object_id: str, env_observation: Event
+        self, raw_object_id: str, env_observation: "Event"
     ) -> Optional[str]:
         """
-        Retrieves the object ID of a visible object based on a partial or raw object ID.
+        Retrieves the object ID of a visible object based on a partial or raw object ID, or
+        on its alias when compact observations are enabled.
 
         Args:
             raw_object_id (str): The raw object ID to search for.
@@ -115,87 +142,123 @@ class LLMClient:
         Returns:
             Optional[str]: The matching object ID, or None if no match is found.
         """
-        visible_objects_ids = [
-            o["objectId"] for o in env_observation.metadata["objects"] if o["visible"]
-        ]
+        print(f"raw_object_id: {raw_object_id}")
+        index = get_object_index(env_observation)
         object_id = None
-
-        for visible_object_id in visible_objects_ids:
-            if raw_object_id.lower() in visible_object_id.lower():
-                object_id = visible_object_id
-                print("Found object ID: %s", object_id)
-                break
+        if self.observation_encoder is not None:
+            object_id = self.observation_encoder.resolve(raw_object_id)
+            if object_id is not None and object_id not in index:
+                object_id = None
+        if object_id is None:
+            object_id = index.resolve(raw_object_id)
+        if object_id is not None:
+            print("Found object ID: %s", object_id)
 
         return object_id
     
     
-    def postprocess_response(
-        self, env_observation: Event, response: str
-    ) -> AgentResponse:
+    def _build_messages(self, env_observation: "Event", language_input: str) -> list:
         """
-        Processes the raw response from the language model and converts it into
-        an appropriate AgentResponse object.
+        Builds the list of messages sent to the model for the current observation.
+
+        The system prompt and the previous turns come first and never change, so the server
+        can reuse the prompt cache of the previous request. The visible objects change at
+        every step, so they are sent with the current instruction only. With compact
+        observations, the reference list of objects follows the system prompt and the
+        current instruction only comes with the changes since that reference.
 
         Args:
             env_observation: The environment observation containing metadata.
-            response (str): The raw response from the language model.
+            language_input (str): The language input provided by the user.
 
         Returns:
-            AgentResponse: The processed response as an action or textual response.
+            list: The messages in the OpenAI chat format.
         """
-        if response.startswith("[Action]"):
-            raw_action = response.replace("[Action]", "").strip()
-
-            is_interaction_action = any(
-                raw_action.startswith(interaction)
-                for interaction in [
-                    "OpenObject",
-                    "CloseObject",
-                    "PickupObject",
-                    "PutObject",
-                    "DropObject",
-                    "ToggleObject",
-                    "SliceObject",
-                ]
-            )
+        messages = [{"role": "system", "content": self.system_prompt}]
+        if self.observation_encoder is None:
+            objects_str = get_object_index(env_observation).objects_str()
+            observation = f"Visible objects: {objects_str}"
+        else:
+            reference, observation = self.observation_encoder.encode(env_observation)
+            messages.append({"role": "user", "content": reference})
+
+        return [
+            *messages,
+            *self.history.messages(),
+            {
+                "role": "user",
+                "content": observation,
+            },
+            {
+                "role": "user",
+                "content": language_input,
+            },
+        ]
 
-            if is_interaction_action:
-                # create regex to extract object id and action name based on template
-                # e.g. OpenObject(<object_id>)
-
-                pattern = r"(\w+)\((\w+).*\)"
-                match = re.match(pattern, raw_action)
-
-                if match:
-                    action = match.group(1)
-                    raw_object_id = match.group(2).strip()
-                    print(f"raw_object_id: {raw_object_id}")
-
-                    object_id = self._get_object_id(raw_object_id, env_observation)
-                    if object_id is None:
-                        return AgentActionResponse(
-                            action="No visible object with that id."
-                        )
-                    return AgentActionResponse(action=action, objectId=object_id)
-
-            # now extract the first part only
-            main_command = raw_action.split("(")[0]
-            if main_command in ("RotateRight", "RotateLeft"):
-                # attempt to parse the degrees from the raw action
-                degrees = None
-                try:
-                    degrees = float(raw_action.split("(")[1].replace(")", ""))
-                except:
-                    degrees = 30.0
-                # if degrees is not provided, default to 30.0
-                return AgentActionResponse(action=main_command, degrees=degrees)
-            return AgentActionResponse(action=main_command)
+    def _lookup_cache(self, messages: list) -> tuple:
+        """
+        Looks up the response for a prompt in the cache. The messages contain the system
+        prompt, the history, the visible objects and the instruction, so together with the
+        model name and the generation settings (streaming, structured output, max_tokens) they
+        identify the response.
 
-        else:
-            verbal_response = response.replace("[Say]", "").strip()
-            return AgentTextualResponse(response=verbal_response)
+        Args:
+            messages (list): The messages that would be sent to the model.
+
+        Returns:
+            tuple: The cache key and the cached raw response (None on a miss or without cache).
+        """
+        if self.cache is None:
+            return None, None
+
+        cache_key = make_cache_key(self.model_name, self._generation_settings(), messages)
+        return cache_key, self.cache.get(cache_key)
+
+    def _store_cache(self, cache_key: Optional[str], raw_response: str) -> None:
+        """
+        Stores a raw response in the cache, if caching is enabled.
+
+        Args:
+            cache_key (Optional[str]): The key returned by `_lookup_cache`.
+            raw_response (str): The raw response from the language model.
+        """
+        if self.cache is not None:
+            self.cache.put(cache_key, raw_response)
+
+    def _record_turn(self, messages: list, language_input: str, raw_response: str) -> None:
+        """
+        Adds the turn to the history. Observations are not kept: with compact observations,
+        the next deltas refer to the reference list, which is part of every prompt.
+
+        Args:
+            messages (list): The messages sent to the model.
+            language_input (str): The language input provided by the user.
+            raw_response (str): The raw response from the language model.
+        """
+        self.last_turn = {"prompt": messages, "reply": raw_response}
+        self.history.add_turn(language_input, raw_response)
+        if self.observation_encoder is not None:
+            self.observation_encoder.commit()
 
-    def act(self, env_observation: Event, language_input: str) -> AgentResponse:
+    def _standardize_response(
+        self, env_observation: "Event", raw_response: str
+    ) -> AgentResponse:
+        """
+        Converts the raw response into an AgentResponse. The action grammar accepts the
+        formats generated by small models (e.g. "[Action] OpenObject: Fridge") as well as the
+        one described in the prompt.
+
+        Args:
+            env_observation: The environment observation containing metadata.
+            raw_response (str): The raw response from the language model.
+
+        Returns:
+            AgentResponse: The processed response as an action or textual response.
+        """
+        print(f"Raw response: {raw_response}")
+        return self.postprocess_response(env_observation, raw_response)
+
+    def act(self, env_observation: "Event", language_input: str) -> AgentResponse:
         """
         Sends a language input to the model and processes the response to generate
         an action or textual response.
@@ -207,79 +270,59 @@ class LLMClient:
         Returns:
             AgentResponse: The processed response as an action or textual response.
         """
-        visible_objects = [
-            o["objectId"] for o in env_observation.metadata["objects"] if o["visible"]
-        ]
-        objects_str = "\n".join(visible_objects)
-
-        try:
-            completion = client.chat.completions.create(
-                temperature=0,
-                model=self.model_name,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {
-                        "role": "user",
-                        "content": f"Visible objects: {objects_str}",
-                    },
-                    {
-                        "role": "user",
-                        "content": language_input,
-                    },
-                ],
-            )
+        with span("build_prompt"):
+            messages = self._build_messages(env_observation, language_input)
+            cache_key, raw_response = self._lookup_cache(messages)
 
-            raw_response = completion.choices[0].message.content
-            print(f"Raw response: {raw_response}")
-            pattern = r"\[Action\] (\w+):? (\w+)"
-            match = re.search(pattern,raw_response)
-            if match:
-                    action = match.group(1)
-                    object_name = match.group(2).strip('\"').strip(")")
-    
-                    standardized_response=f"[Action] {action}({object_name})"
-                    print(f"Standardized raw response: {standardized_response}")
-                    return self.postprocess_response(env_observation, standardized_response) 
-        except Exception as e:
-                    print(f"Error: {e}")
+        if raw_response is None:
+            with span("chat_completion", model=self.model_name):
+                raw_response, _ = self._complete(messages)
+            self._store_cache(cache_key, raw_response)
+        self._record_turn(messages, language_input, raw_response)
 
-        return self.postprocess_response(env_observation, raw_response)
+        with span("parse_response"):
+            return self._standardize_response(env_observation, raw_response)
+
+    async def aact(self, env_observation: "Event", language_input: str) -> AgentResponse:
+        """
+        Asynchronous version of `act`. Requests go through the shared AsyncOpenAI client, so
+        several agents (e.g. one per episode) can wait for the model at the same time.
+
+        Args:
+            env_observation: The environment observation containing metadata.
+            language_input (str): The language input provided by the user.
+
+        Returns:
+            AgentResponse: The processed response as an action or textual response.
+        """
+        with span("build_prompt"):
+            messages = self._build_messages(env_observation, language_input)
+            cache_key, raw_response = self._lookup_cache(messages)
+
+        if raw_response is None:
+            with span("chat_completion", model=self.model_name):
+                raw_response, _ = await self._acomplete(messages)
+            self._store_cache(cache_key, raw_response)
+        self._record_turn(messages, language_input, raw_response)
+
+        with span("parse_response"):
+            return self._standardize_response(env_observation, raw_response)
+
+
+# The renderer loads the font once and remembers the cards it has already rendered
+# Created with the first text card, since the renderer needs the video module
+text_renderer = None
 
 
-def render_text_on_image(language_instruction: str, width: int, height: int) -> None:
+def render_text_on_image(language_instruction: str, width: int, height: int) -> "Image.Image":
     # Render the language instruction as an image - handle multi-line text
-    font_size = 55
+    global text_renderer
     try:
-        # Create a blank image with white background
-        text_image = Image.new("RGB", (width, height), "white")
-        draw = ImageDraw.Draw(text_image)
-
-        # Load a default font
-        try:
-            font = ImageFont.truetype("arial.ttf", font_size)
-        except IOError:
-            font = ImageFont.load_default()
-
-        # Wrap the text to fit within max_width
-        max_width = 2000   
-        lines = textwrap.wrap(language_instruction, width=int(max_width / (font_size / 2)))  # Adjust divisor for char width
-
-        # Set the line height
-        line_height = 20 
-        
-        # Calculate total text height
-        total_text_height = len(lines) * line_height
-
-         # Calculate starting y position to center the text vertically
-        y = (height - total_text_height) // 2
-        
-        # Draw each line of text
-        for line in lines:
-            draw.text((50, y), line, fill="black", font=font)  # 10 is the left margin
-            y += line_height  # Move to the next line
-
-
-        return text_image
+        if text_renderer is None:
+            from genair_video import TextCardRenderer
+
+            text_renderer = TextCardRenderer()
+        return text_renderer.render(language_instruction, width, height)
     except Exception as e:
         print(f"Error rendering text as image: {e}")
 
@@ -289,6 +332,28 @@ def main() -> None:
     Main function to initialize the environment, interact with the language model,
     and process user instructions in a loop. Generates a video of the agent's actions.
     """
+    from ai2thor.controller import Controller
+
+    from genair_trajectory import TrajectoryWriter
+    from genair_video import VideoRecorder
+
+    # The LLM client is responsible for interacting with the language model.
+    # It is initialized with a specific model name. You can change this to any other model from
+    # Ollama
+    # https://ollama.com/models
+    # The model name is passed as a string. Make sure that you "pull" the model first using
+    # ollama pull <model_name>
+    # For this example, we will use the "qwen2.5:1.5b" model.
+    # If you replay the same instructions often, you can pass
+    # cache=ResponseCache(path="responses.sqlite") to reuse the responses of previous runs.
+    # With plan=True, the model generates all the actions of an instruction in one reply.
+    model_to_use = "qwen2.5:1.5b"
+    client = LLMClient(model_name=model_to_use)
+
+    # Loading the model takes a while: Ollama loads it while the simulator starts, instead of
+    # when the first instruction arrives
+    warm_up_in_background(client)
+
     # Initialize the AI2-THOR controller which will be used to interact with the environment
     # The controller is responsible for rendering the environment and sending actions to it
     # The controller is initialized with a specific scene and a set of parameters
@@ -320,59 +385,77 @@ def main() -> None:
         scene=kitchen_scene,
     )
 
-    # The LLM client is responsible for interacting with the language model.
-    # It is initialized with a specific model name. You can change this to any other model from
-    # Ollama
-    # https://ollama.com/models
-    # The model name is passed as a string. Make sure that you "pull" the model first using
-    # ollama pull <model_name>
-    # For this example, we will use the "qwen2.5:1.5b" model.
-    model_to_use = "qwen2.5:1.5b"
-    client = LLMClient(model_name=model_to_use)
-
-    frames = []
-    # The first step is to initialize the environment. This is done by calling the step method
-    # on the controller. The step method takes a string as an argument which specifies the action
-    # to be performed. In this case, we are initializing the environment.
-    # The step method returns an event object which contains information about the current state
-    # of the environment.
-    event = controller.step("Initialize")
-    done = False
-
-    while not done:
-        image = Image.fromarray(event.frame)
-        frames.append(image)
-        language_instruction = input("Enter instruction (enter CLOSE or x to exit): ")
-        if language_instruction == "CLOSE" or language_instruction == "x":
-            print("Interrupting task...")
-            break
-
-        # Render the language instruction as an image
-        text_image = render_text_on_image(language_instruction, 640, 640)
-        frames.append(text_image)
-
-        print("Processing instruction...")
-        response = client.act(event, language_instruction)
-        if isinstance(response, AgentTextualResponse):
-            print(f"Generated response: {response.response}")
-            robot_text=response.response
-            formatted_robot_response = robot_text.replace(".", "\n")
-            robot_text_image = render_text_on_image(formatted_robot_response, 640, 640)
-            frames.append(robot_text_image)
-        else:
-            print(f"Generated action: {response}")
-            try:
-                event = controller.step(**response.to_dict(), forceAction=True)
-                # forces the GUI to update
-                controller.step("NoOp")
-            except Exception as e:
-                print(f"Unable to execute action due to an error: {e}")
-
-    # Encode all frames into a mp4 video.
+    # Frames are written to the video as soon as they are produced, so memory usage does not
+    # grow with the length of the session and the video is still usable if the program crashes.
     video_path = "rollout.mp4"
-    imageio.mimsave(str(video_path), numpy.stack(frames), fps=1, codec="libx264")
+    # The raw frames, the metadata of every step, the prompts and the replies of the model are
+    # recorded in a trajectory, which can be opened with genair_trajectory.TrajectoryReader
+    trajectory_path = "rollout_trajectory"
+    # Record how long each stage of the loop takes (see the summary at the end of the session)
+    tracer.enable()
+    # Writing the video, rendering the text cards and preparing the prompt of the next turn
+    # happen in background threads while the model generates (see genair_pipeline.py)
+    with VideoRecorder(video_path, fps=1, codec="libx264") as recorder, TrajectoryWriter(
+        trajectory_path
+    ) as trajectory, AgentPipeline(
+        client, recorder, render_text_on_image, trajectory
+    ) as pipeline:
+        # The first step is to initialize the environment. This is done by calling the step
+        # method on the controller. The step method takes a string as an argument which specifies
+        # the action to be performed. In this case, we are initializing the environment.
+        # The step method returns an event object which contains information about the current
+        # state of the environment.
+        event = controller.step("Initialize")
+        done = False
+
+        pipeline.observe(event)
+        pipeline.prepare(event)
+        while not done:
+            language_instruction = input("Enter instruction (enter CLOSE or x to exit): ")
+            if language_instruction == "CLOSE" or language_instruction == "x":
+                print("Interrupting task...")
+                break
+
+            # Render the language instruction as an image
+            pipeline.show_text(language_instruction, 640, 640)
+
+            print("Processing instruction...")
+            # The generated actions are executed back-to-back. In plan mode, the model is
+            # queried again if one of them fails. Every new frame is added to the video.
+            event, record = run_instruction(
+                client,
+                controller,
+                event,
+                language_instruction,
+                max_replans=1 if client.plan else 0,
+                on_step=pipeline.observe,
+                on_response=pipeline.record_response,
+            )
+            # the last observation is the one the next instruction is sent with
+            pipeline.prepare(event)
+            pipeline.record_instruction(record)
+            for step in record["steps"]:
+                print(f"Generated action: {step['response']}")
+                if not step["lastActionSuccess"]:
+                    print(f"Unable to execute action due to an error: {step['errorMessage']}")
+
+            response = record["responses"][-1]
+            if "response" in response:
+                print(f"Generated response: {response['response']}")
+                robot_text=response["response"]
+                formatted_robot_response = robot_text.replace(".", "\n")
+                pipeline.show_text(formatted_robot_response, 640, 640)
 
     print(f"Video of the evaluation is available in '{video_path}'.")
+    print(f"Trajectory of the evaluation is available in '{trajectory_path}'.")
+
+    # Time spent in each stage of the agent loop. The trace can be opened in
+    # https://ui.perfetto.dev to see the stages of every turn.
+    print("------")
+    tracer.print_summary()
+    tracer.export_chrome_trace("rollout_trace.json")
+    tracer.export_jsonl("rollout_trace.jsonl")
+    print("Trace of the evaluation is available in 'rollout_trace.json'.")
 
 
 if __name__ == "__main__":
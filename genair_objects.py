@@ -0,0 +1,316 @@
+import threading
+import weakref
+from collections import OrderedDict
+from itertools import compress
+from operator import itemgetter
+from typing import TYPE_CHECKING, Callable, Optional
+
+if TYPE_CHECKING:
+    import numpy
+    from ai2thor.server import Event
+
+# Rank of the objects matching a raw object ID: an exact ID match wins over an object of the
+# same type, which wins over an ID containing the raw ID
+_EXACT, _TYPE, _SUBSTRING, _NO_MATCH = range(4)
+
+# Number of raw object IDs whose ranks are kept (see `_InternTable.ranks`). The oldest keys are
+# dropped first
+MAX_CACHED_KEYS = 1024
+
+_get_visible = itemgetter("visible")
+_get_object_id = itemgetter("objectId")
+_get_distance = itemgetter("distance")
+
+
+class _InternTable:
+    """
+    Assigns an integer code to every object ID seen by the process. The same objects appear in
+    every observation of a scene, so the per-observation tables only store codes, and what only
+    depends on the ID (its type, its lowercase form, how it matches a raw object ID) is
+    computed once per ID instead of once per observation.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.ids = []
+        self.codes = {}
+        self.codes_by_lower_id = {}
+        self._lower_ids = []
+        self._types = []
+        self._type_codes = {}
+        self._type_array = None
+        self._ranks = OrderedDict()
+
+    def intern(self, object_id: str) -> int:
+        code = self.codes.get(object_id)
+        if code is None:
+            with self._lock:
+                code = self.codes.get(object_id)
+                if code is None:
+                    code = len(self.ids)
+                    lower_id = object_id.lower()
+                    object_type = lower_id.split("|")[0]
+                    self.ids.append(object_id)
+                    self._lower_ids.append(lower_id)
+                    type_code = self._type_codes.setdefault(object_type, len(self._type_codes))
+                    self._types.append(type_code)
+                    self.codes_by_lower_id.setdefault(lower_id, code)
+                    # published last: readers that find the code find everything else too
+                    self.codes[object_id] = code
+        return code
+
+    def type_codes(self) -> "numpy.ndarray":
+        """
+        Returns:
+            numpy.ndarray: The type code of every interned ID, indexed by code. The array is
+                rebuilt only when new IDs were interned.
+        """
+        types = self._type_array
+        if types is None or len(types) != len(self.ids):
+            import numpy
+
+            with self._lock:
+                types = numpy.array(self._types, dtype=numpy.int32)
+                self._type_array = types
+        return types
+
+    def ranks(self, key: str, codes: list) -> "numpy.ndarray":
+        """
+        Ranks interned IDs against a lowercase raw object ID. Only the given codes (the visible
+        objects of an observation) are compared, so the cost does not grow with the number of
+        IDs seen by the process. The ranks are kept per key and reused by later observations.
+
+        Args:
+            key (str): The lowercase raw object ID.
+            codes (list): The codes of the IDs to rank.
+
+        Returns:
+            numpy.ndarray: The rank of each code (`_EXACT`, `_TYPE`, `_SUBSTRING` or
+                `_NO_MATCH`), in the order of `codes`.
+        """
+        import numpy
+
+        cached = self._ranks.get(key)
+        if cached is not None:
+            try:
+                return numpy.fromiter(
+                    map(cached.__getitem__, codes), dtype=numpy.int8, count=len(codes)
+                )
+            except KeyError:
+                # some of the codes were never ranked against this key
+                pass
+
+        with self._lock:
+            cached = self._ranks.get(key)
+            if cached is None:
+                cached = self._ranks[key] = {}
+                if len(self._ranks) > MAX_CACHED_KEYS:
+                    self._ranks.popitem(last=False)
+
+            type_code = self._type_codes.get(key)
+            substring = bool(key) and "\n" not in key
+            for code in codes:
+                if code in cached:
+                    continue
+                lower_id = self._lower_ids[code]
+                cached[code] = (
+                    _EXACT
+                    if lower_id == key
+                    else _TYPE
+                    if self._types[code] == type_code
+                    else _SUBSTRING
+                    if substring and key in lower_id
+                    else _NO_MATCH
+                )
+        return numpy.fromiter(map(cached.__getitem__, codes), dtype=numpy.int8, count=len(codes))
+
+_interned = _InternTable()
+
+
+class ObjectTable:
+    """
+    Compact table of the objects of an observation, stored as a struct of arrays. It is built
+    once per Event and answers the lookups needed by the agents (prompt building and object ID
+    resolution) with array operations instead of walking the list of dictionaries again.
+
+    Object IDs are interned (see `_InternTable`), so the table only holds integer codes. The
+    visible objects are gathered when the table is built, since every lookup needs them; the
+    columns covering all the objects are only built when they are used.
+
+    Attributes:
+        visible_ids (list): The IDs of the visible objects, in metadata order.
+        visible_codes (numpy.ndarray): The codes of these IDs.
+        codes (numpy.ndarray): The code of the ID of every object, in metadata order.
+        visible (numpy.ndarray): The visibility mask of the objects.
+        type_codes (numpy.ndarray): The code of the type of the objects.
+        distances (numpy.ndarray): The distance of the objects to the agent.
+        positions (numpy.ndarray): The positions of the objects, of shape (num_objects, 3).
+    """
+
+    def __init__(self, metadata: dict) -> None:
+        """
+        Builds the table from the metadata of an observation.
+
+        Args:
+            metadata (dict): The metadata of the observation (`event.metadata`).
+        """
+        import numpy
+
+        self._objects = metadata["objects"]
+        self._agent = metadata.get("agent")
+        self._columns = {}
+        self._resolved = {}
+
+        self.visible_ids = list(
+            compress(map(_get_object_id, self._objects), map(_get_visible, self._objects))
+        )
+        codes = list(map(_interned.codes.get, self.visible_ids))
+        if None in codes:
+            codes = list(map(_interned.intern, self.visible_ids))
+        self.visible_codes = numpy.array(codes, dtype=numpy.int32)
+
+    def _column(self, name: str, build: Callable) -> "numpy.ndarray":
+        column = self._columns.get(name)
+        if column is None:
+            column = self._columns[name] = build()
+        return column
+
+    def _build_positions(self) -> "numpy.ndarray":
+        import numpy
+
+        get_xyz = itemgetter("x", "y", "z")
+        return numpy.array(
+            [get_xyz(o["position"]) for o in self._objects], dtype=numpy.float32
+        ).reshape(-1, 3)
+
+    def _build_distances(self) -> "numpy.ndarray":
+        import numpy
+
+        if self._objects and "distance" in self._objects[0]:
+            return numpy.fromiter(
+                map(_get_distance, self._objects), dtype=numpy.float32, count=len(self._objects)
+            )
+        agent = numpy.array(itemgetter("x", "y", "z")(self._agent["position"]), dtype=numpy.float32)
+        return numpy.linalg.norm(self.positions - agent, axis=1)
+
+    def _build_visible_distances(self) -> "numpy.ndarray":
+        import numpy
+
+        if self._objects and "distance" in self._objects[0]:
+            return numpy.fromiter(
+                compress(map(_get_distance, self._objects), map(_get_visible, self._objects)),
+                dtype=numpy.float32,
+                count=len(self.visible_ids),
+            )
+        return self.distances[self.visible]
+
+    @property
+    def codes(self) -> "numpy.ndarray":
+        import numpy
+
+        return self._column(
+            "codes",
+            lambda: numpy.array(
+                list(map(_interned.intern, map(_get_object_id, self._objects))),
+                dtype=numpy.int32,
+            ),
+        )
+
+    @property
+    def visible(self) -> "numpy.ndarray":
+        import numpy
+
+        return self._column(
+            "visible",
+            lambda: numpy.fromiter(
+                map(_get_visible, self._objects), dtype=bool, count=len(self._objects)
+            ),
+        )
+
+    @property
+    def type_codes(self) -> "numpy.ndarray":
+        # the codes first, since they intern the IDs of the objects that were never visible
+        codes = self.codes
+        return self._column("type_codes", lambda: _interned.type_codes()[codes])
+
+    @property
+    def distances(self) -> "numpy.ndarray":
+        return self._column("distances", self._build_distances)
+
+    @property
+    def positions(self) -> "numpy.ndarray":
+        return self._column("positions", self._build_positions)
+
+    def __len__(self) -> int:
+        return len(self.visible_ids)
+
+    def __contains__(self, object_id: str) -> bool:
+        code = _interned.codes_by_lower_id.get(object_id.lower())
+        return code is not None and bool((self.visible_codes == code).any())
+
+    def objects_str(self) -> str:
+        """
+        Returns the visible object IDs as a newline-separated string, as used in the prompts.
+
+        Returns:
+            str: The newline-separated object IDs.
+        """
+        return "\n".join(self.visible_ids)
+
+    def resolve(self, raw_object_id: str) -> Optional[str]:
+        """
+        Finds the visible object referred to by a partial or raw object ID. An exact ID match
+        wins, followed by the objects of the same type, and finally the objects whose ID
+        contains the raw ID (case insensitive). When several visible objects match equally
+        well (e.g. two mugs), the nearest one is chosen.
+
+        Args:
+            raw_object_id (str): The raw object ID generated by the model.
+
+        Returns:
+            Optional[str]: The matching object ID, or None if no match is found.
+        """
+        key = raw_object_id.lower()
+        if key in self._resolved:
+            return self._resolved[key]
+
+        object_id = None
+        if self.visible_ids:
+            ranks = _interned.ranks(key, self.visible_codes.tolist())
+            best = ranks.min()
+            if best != _NO_MATCH:
+                candidates = (ranks == best).nonzero()[0]
+                if len(candidates) > 1:
+                    distances = self._column("visible_distances", self._build_visible_distances)
+                    candidates = candidates[distances[candidates].argmin(keepdims=True)]
+                object_id = self.visible_ids[candidates[0]]
+
+        self._resolved[key] = object_id
+        return object_id
+
+
+# Tables are cached per Event and released together with the observation they describe
+_tables: "weakref.WeakKeyDictionary[Event, ObjectTable]" = weakref.WeakKeyDictionary()
+# The table of an observation can be requested by a background thread (see genair_pipeline.py)
+# while the agent loop needs it too: the lock makes sure that it is only built once
+_tables_lock = threading.Lock()
+
+
+def get_object_index(env_observation: "Event") -> ObjectTable:
+    """
+    Returns the object table of an observation, building it on first use.
+
+    Args:
+        env_observation: The environment observation containing metadata.
+
+    Returns:
+        ObjectTable: The table of the objects of the observation.
+    """
+    table = _tables.get(env_observation)
+    if table is None:
+        with _tables_lock:
+            table = _tables.get(env_observation)
+            if table is None:
+                table = ObjectTable(env_observation.metadata)
+                _tables[env_observation] = table
+    return table
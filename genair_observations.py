@@ -0,0 +1,127 @@
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from ai2thor.server import Event
+
+
+class ObservationEncoder:
+    """
+    Describes the visible objects to the model in a compact form.
+
+    Object IDs such as "Apple|-01.65|+00.94|-00.08" are replaced by short aliases ("Apple_1")
+    that stay the same for the whole episode and are mapped back to the IDs with `resolve`.
+
+    The objects are listed once in a reference message placed right after the system prompt,
+    and every turn only sends the objects that appeared or disappeared since that reference.
+    The conversation history keeps the instructions and the replies only, so the prompt grows
+    with the deltas and not with the observations, and its prefix (system prompt, reference
+    and earlier turns) stays the same from one turn to the next. The reference is replaced by
+    the current list when the delta gets longer than `max_delta_ratio` times the visible
+    objects.
+
+    Every observation is first encoded with `encode`, and then `commit` must be called once
+    it has been sent, so that a reference that was never sent (e.g. because the request
+    failed) is not used for the next deltas.
+
+    Attributes:
+        max_delta_ratio (float): The size of the delta, relative to the number of visible
+            objects, above which the reference is replaced.
+        aliases (dict): Maps the object IDs to their aliases.
+        object_ids (dict): Maps the lowercase aliases to the object IDs.
+    """
+
+    def __init__(self, max_delta_ratio: float = 0.5) -> None:
+        """
+        Initializes the encoder for a new episode.
+
+        Args:
+            max_delta_ratio (float): The size of the delta, relative to the number of visible
+                objects, above which the reference is replaced.
+        """
+        if max_delta_ratio <= 0:
+            raise ValueError("max_delta_ratio must be positive")
+
+        self.max_delta_ratio = max_delta_ratio
+        self.reset()
+
+    def reset(self) -> None:
+        self.aliases = {}
+        self.object_ids = {}
+        self._counts = {}
+        # the visible aliases of the last reference sent to the model, and its message
+        self._reference = None
+        self._reference_message = None
+        self._pending = None
+
+    def _alias(self, obj: dict) -> str:
+        object_id = obj["objectId"]
+        alias = self.aliases.get(object_id)
+        if alias is None:
+            object_type = obj.get("objectType") or object_id.split("|")[0]
+            count = self._counts.get(object_type, 0) + 1
+            self._counts[object_type] = count
+            alias = f"{object_type}_{count}"
+            self.aliases[object_id] = alias
+            self.object_ids[alias.lower()] = object_id
+        return alias
+
+    def encode(self, env_observation: "Event") -> tuple:
+        """
+        Describes the objects visible in an observation.
+
+        Args:
+            env_observation: The environment observation containing metadata.
+
+        Returns:
+            tuple: The reference message, to be placed after the system prompt, and the
+                description of the visible objects relative to it, to be sent with the
+                instruction.
+        """
+        visible = [self._alias(o) for o in env_observation.metadata["objects"] if o["visible"]]
+
+        reference, message = self._reference, self._reference_message
+        if reference is not None:
+            current = set(visible)
+            previous = set(reference)
+            added = [alias for alias in visible if alias not in previous]
+            removed = [alias for alias in reference if alias not in current]
+            if len(added) + len(removed) > self.max_delta_ratio * max(len(visible), 1):
+                reference = None
+
+        if reference is None:
+            reference, added, removed = visible, [], []
+            message = f"Reference list of visible objects: {', '.join(visible)}"
+        self._pending = (reference, message)
+
+        if not added and not removed:
+            return message, "Visible objects: same as the reference list."
+
+        parts = ["Visible objects: the reference list"]
+        if added:
+            parts.append(f"plus {', '.join(added)}")
+        if removed:
+            parts.append(f"minus {', '.join(removed)}")
+        return message, ", ".join(parts) + "."
+
+    def commit(self) -> None:
+        """
+        Records that the last encoded observation was sent to the model, so that the next
+        deltas are computed with respect to the reference it was sent with.
+        """
+        if self._pending is None:
+            return
+
+        self._reference, self._reference_message = self._pending
+        self._pending = None
+
+    def resolve(self, alias: str) -> Optional[str]:
+        """
+        Maps an alias generated by the model back to the object ID.
+
+        Args:
+            alias (str): The alias, in any case.
+
+        Returns:
+            Optional[str]: The object ID, or None if the alias is unknown.
+        """
+        return self.object_ids.get(alias.lower())
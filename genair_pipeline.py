@@ -0,0 +1,183 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from genair_tracing import span
+
+
+def _report_error(future: Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Error in a background task: {future.exception()}")
+
+
+def warm_up_in_background(agent, keep_alive: str = "30m") -> threading.Thread:
+    """
+    Loads the model of an agent in a background thread, e.g. while the simulator starts.
+
+    Args:
+        agent: The LLMClient or VLMClient.
+        keep_alive (str): How long the model stays in memory after the last request.
+
+    Returns:
+        threading.Thread: The thread loading the model.
+    """
+    thread = threading.Thread(
+        target=agent.warm_up, args=(keep_alive,), name="warm-up", daemon=True
+    )
+    thread.start()
+    return thread
+
+
+class AgentPipeline:
+    """
+    Runs the work of the agent loop that does not need the model in background threads, so
+    that it overlaps with inference and with the simulator instead of adding to them:
+
+    - the video thread renders the text cards and appends the frames to the video and to the
+      trajectory, in the order in which they are submitted;
+    - the prepare thread precomputes the parts of the prompt that only depend on the
+      observation (the visible objects, or the encoded image for the VLM) of the observation
+      the next instruction will be sent with, e.g. while the user types it, so `act` finds
+      them ready.
+
+    PyAV, PIL and the HTTP client release the GIL while they work, so the stages really run in
+    parallel and the time of a turn gets close to its slowest stage. The threads only pay off
+    when there is something to overlap with: on a single core with an instant model, the
+    serial loop has a higher throughput.
+
+    Attributes:
+        agent: The LLMClient or VLMClient.
+        recorder (Optional[VideoRecorder]): The video of the episode, if any.
+        render_text (Optional[Callable]): Renders a text card, as `render_text_on_image`.
+        trajectory (Optional[TrajectoryWriter]): The recording of the episode, if any.
+    """
+
+    def __init__(
+        self,
+        agent,
+        recorder=None,
+        render_text: Optional[Callable] = None,
+        trajectory=None,
+    ) -> None:
+        """
+        Starts the background threads.
+
+        Args:
+            agent: The LLMClient or VLMClient.
+            recorder (Optional[VideoRecorder]): The video of the episode, if any.
+            render_text (Optional[Callable]): Renders a text card given the text, the width and
+                the height. Without it, `show_text` does nothing.
+            trajectory (Optional[TrajectoryWriter]): Records the observations, the queries of
+                the model and the instructions of the episode.
+        """
+        self.agent = agent
+        self.recorder = recorder
+        self.render_text = render_text
+        self.trajectory = trajectory
+        self._video = ThreadPoolExecutor(max_workers=1, thread_name_prefix="video")
+        self._prepare = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prepare")
+
+    def _submit(
+        self, executor: ThreadPoolExecutor, function: Callable, *args, **kwargs
+    ) -> Future:
+        future = executor.submit(function, *args, **kwargs)
+        future.add_done_callback(_report_error)
+        return future
+
+    def _append(self, frame) -> None:
+        with span("video_append"):
+            self.recorder.append(frame)
+
+    def _append_text(self, text: str, width: int, height: int) -> None:
+        with span("render_text"):
+            image = self.render_text(text, width, height)
+        if image is not None:
+            self._append(image)
+
+    def _record(self, function: Callable, *args, **kwargs) -> None:
+        with span("trajectory_append"):
+            function(*args, **kwargs)
+
+    def _prepare_observation(self, event) -> None:
+        with span("prepare_observation"):
+            self.agent.prepare(event)
+
+    def observe(self, event) -> None:
+        """
+        Adds the frame of a new observation to the video and to the trajectory, in the
+        background.
+
+        Args:
+            event: The new observation.
+        """
+        if self.recorder is not None:
+            self._submit(self._video, self._append, event.frame)
+        if self.trajectory is not None:
+            self._submit(self._video, self._record, self.trajectory.append_observation, event)
+
+    def prepare(self, event) -> None:
+        """
+        Prepares the prompt of the next query in the background. Only the observation the
+        model will be queried with should be prepared (e.g. the last one of a plan, not every
+        intermediate step), since the VLM encodes its frame.
+
+        Args:
+            event: The observation of the next query.
+        """
+        self._submit(self._prepare, self._prepare_observation, event)
+
+    def record_response(self, language_input: str, response) -> None:
+        """
+        Records a query of the model in the trajectory, in the background. Must be called
+        right after `act`, before the agent is queried again.
+
+        Args:
+            language_input (str): The input sent to the agent.
+            response: The response of the agent.
+        """
+        if self.trajectory is not None:
+            self._submit(
+                self._video,
+                self._record,
+                self.trajectory.append_model_turn,
+                language_input,
+                response,
+                self.agent.last_turn,
+            )
+
+    def record_instruction(self, record: dict) -> None:
+        """
+        Records the outcome of an instruction in the trajectory, in the background.
+
+        Args:
+            record (dict): The record returned by `run_instruction`.
+        """
+        if self.trajectory is not None:
+            self._submit(
+                self._video, self._record, self.trajectory.append_step, "instruction", **record
+            )
+
+    def show_text(self, text: str, width: int = 640, height: int = 640) -> None:
+        """
+        Renders a text card and adds it to the video in the background.
+
+        Args:
+            text (str): The text to render.
+            width (int): The width of the card.
+            height (int): The height of the card.
+        """
+        if self.recorder is not None and self.render_text is not None:
+            self._submit(self._video, self._append_text, text, width, height)
+
+    def close(self) -> None:
+        """
+        Waits for the frames and cards that are still being written.
+        """
+        self._prepare.shutdown(wait=True)
+        self._video.shutdown(wait=True)
+
+    def __enter__(self) -> "AgentPipeline":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
@@ -0,0 +1,159 @@
+from typing import Callable, Optional
+
+from genair_responses import NO_VISIBLE_OBJECT
+from genair_tracing import span
+
+# Appended to the system prompt of the agents in plan mode
+PLAN_PROMPT = """
+You can generate several actions at once to complete an instruction. Write one action per line,
+each one starting with the tag `[Action]`, in the order in which they must be executed, e.g.
+[Action] MoveAhead
+[Action] RotateRight(90)
+[Action] OpenObject(Fridge)
+If an action fails, you will be told which one and you can generate a new plan.
+"""
+
+
+def execute_plan(
+    agent,
+    controller,
+    event,
+    response,
+    on_step: Optional[Callable] = None,
+) -> tuple:
+    """
+    Executes the actions generated by an agent back-to-back, without querying the model or
+    stepping the simulator with NoOp in between: the event returned by each step already
+    contains the new observation. A single NoOp after the last action updates the GUI.
+    Execution stops at the first action that fails.
+
+    The actions of a plan are resolved against the observation in which they are executed, so
+    that an object that only becomes visible after the first moves can still be used.
+
+    Args:
+        agent: The LLMClient or VLMClient that generated the response.
+        controller: The simulator.
+        event: The current observation.
+        response: An action response, or a plan response in plan mode.
+        on_step (Optional[Callable]): Called with the event returned by every step, e.g. to
+            record the frames.
+
+    Returns:
+        tuple: The last observation, the list of executed steps (one dictionary per action,
+            with the action, `lastActionSuccess`, `errorMessage` and, for the actions of a plan,
+            the `command` generated by the model) and whether every action succeeded.
+    """
+    actions = getattr(response, "actions", None)
+    if actions is None:
+        actions = [response]
+
+    steps = []
+    completed = True
+    stepped = False
+    for action in actions:
+        step = {}
+        if isinstance(action, str):
+            step["command"] = action
+            action = agent.resolve_action(event, action)
+
+        step["response"] = action.to_dict()
+        steps.append(step)
+        if not hasattr(action, "action"):
+            # a verbal response does not change the state of the simulator
+            step.update(lastActionSuccess=True, errorMessage="")
+            continue
+
+        if action.action == NO_VISIBLE_OBJECT:
+            step.update(lastActionSuccess=False, errorMessage=NO_VISIBLE_OBJECT)
+            completed = False
+            break
+
+        try:
+            with span("controller_step", action=action.action):
+                event = controller.step(**action.to_dict(), forceAction=True)
+        except Exception as e:
+            step.update(lastActionSuccess=False, errorMessage=str(e))
+            completed = False
+            break
+
+        stepped = True
+        step.update(
+            lastActionSuccess=event.metadata["lastActionSuccess"],
+            errorMessage=event.metadata["errorMessage"],
+        )
+        if on_step is not None:
+            on_step(event)
+        if not step["lastActionSuccess"]:
+            completed = False
+            break
+
+    if stepped:
+        # forces the GUI to update, once per plan rather than after every action
+        with span("controller_noop"):
+            controller.step("NoOp")
+
+    return event, steps, completed
+
+
+def _failure_feedback(instruction: str, steps: list) -> str:
+    failed = steps[-1]
+    action = failed.get("command") or " ".join(str(v) for v in failed["response"].values())
+    error = (failed["errorMessage"] or "the action was not possible").rstrip(".")
+    return (
+        f"{instruction}\n"
+        f"The action {action} failed after {len(steps) - 1} successful actions: {error}. "
+        "Continue from the current state."
+    )
+
+
+def run_instruction(
+    agent,
+    controller,
+    event,
+    instruction: str,
+    max_replans: int = 1,
+    on_step: Optional[Callable] = None,
+    on_response: Optional[Callable] = None,
+) -> tuple:
+    """
+    Sends an instruction to the agent and executes the actions it generates. The model is
+    queried again only when an action fails, with the failed action and the error message,
+    at most `max_replans` times.
+
+    Args:
+        agent: The LLMClient or VLMClient.
+        controller: The simulator.
+        event: The current observation.
+        instruction (str): The instruction of the user.
+        max_replans (int): How many times the model can be queried again after a failure.
+        on_step (Optional[Callable]): Called with the event returned by every step.
+        on_response (Optional[Callable]): Called with the language input and the response of
+            the agent every time the model is queried, before the actions are executed.
+
+    Returns:
+        tuple: The last observation and a dictionary describing what happened: the responses
+            of the model, the executed steps, `lastActionSuccess` and `errorMessage` of the
+            last step.
+    """
+    record = {"instruction": instruction, "responses": [], "steps": []}
+    language_input = instruction
+
+    for _ in range(max_replans + 1):
+        response = agent.act(event, language_input)
+        record["responses"].append(response.to_dict())
+        if on_response is not None:
+            on_response(language_input, response)
+        if not hasattr(response, "action") and not hasattr(response, "actions"):
+            # verbal response
+            break
+
+        event, steps, completed = execute_plan(agent, controller, event, response, on_step)
+        record["steps"].extend(steps)
+        if completed or not steps:
+            break
+        language_input = _failure_feedback(instruction, steps)
+
+    if record["steps"]:
+        record["lastActionSuccess"] = record["steps"][-1]["lastActionSuccess"]
+        record["errorMessage"] = record["steps"][-1]["errorMessage"]
+    return event, record
@@ -0,0 +1,288 @@
+"""
+Offline replay of recorded trajectories, to compare models and prompts without the simulator.
+
+Every query of the model recorded in a trajectory (see genair_trajectory.py) is sent again to
+the agent, with the observation (visible objects and frame) and the input recorded at the time.
+The conversation history of each query is rebuilt from the reference replies of the previous
+turns, so the queries do not depend on each other and run concurrently through `aact`. The
+script reports the latency and the throughput of the model, and how often its responses agree
+with the reference ones.
+
+Usage:
+
+    python genair_replay.py rollout_trajectory --model qwen2.5:1.5b --model llama3.2:1b
+    python genair_replay.py rollout_trajectory --agent vlm --concurrency 4 --output replay.jsonl
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Callable, Optional
+
+import numpy
+
+from genair_async import configure_async_client
+from genair_backends import STRATEGIES, BackendPool, parse_endpoint
+from genair_fake import FakeEvent
+from genair_trajectory import TrajectoryReader
+
+
+def load_replay_items(path: str, history: bool = True) -> list:
+    """
+    Extracts the queries of the model from a trajectory. Frames are not loaded: every item
+    refers to a slice of the memory-mapped frames of the trajectory.
+
+    Args:
+        path (str): The directory of the trajectory.
+        history (bool): Whether to rebuild the conversation history of every query from the
+            previous turns of the trajectory.
+
+    Returns:
+        list: One dictionary per query, with the observation (`event`), the `language_input`,
+            the `history` as a list of (input, reply) tuples and the `reference` response.
+    """
+    reader = TrajectoryReader(path)
+    items = []
+    turns = []
+    metadata = None
+    for step in reader.steps():
+        if step["kind"] == "observation":
+            metadata = step["metadata"]
+        elif step["kind"] == "model" and metadata is not None:
+            frame = reader.frames[step["frame"]] if step["frame"] >= 0 else None
+            items.append(
+                {
+                    "trajectory": path,
+                    "step": step["step"],
+                    "event": FakeEvent(metadata, frame),
+                    "language_input": step["language_input"],
+                    "history": list(turns) if history else [],
+                    "reference": step["response"],
+                }
+            )
+            if step["reply"] is not None:
+                turns.append((step["language_input"], step["reply"]))
+    return items
+
+
+def _comparable(agent, event, response: dict):
+    # Plans are compared after resolving every action in the observation, and verbal responses
+    # only by their kind, since their wording is expected to change between models
+    if "actions" in response:
+        return [agent.resolve_action(event, action).to_dict() for action in response["actions"]]
+    if "action" in response:
+        return [response]
+    return "response"
+
+
+async def _replay_item(
+    agent_factory: Callable, item: dict, semaphore: asyncio.Semaphore
+) -> dict:
+    agent = agent_factory()
+    for language_input, reply in item["history"]:
+        agent.history.add_turn(language_input, reply)
+
+    result = {
+        "trajectory": item["trajectory"],
+        "step": item["step"],
+        "language_input": item["language_input"],
+        "reference": item["reference"],
+        "response": None,
+        "error": None,
+    }
+    async with semaphore:
+        start = time.perf_counter()
+        try:
+            response = await agent.aact(item["event"], item["language_input"])
+        except Exception as e:
+            result["error"] = str(e)
+        result["latency"] = time.perf_counter() - start
+
+    if result["error"] is None:
+        result["response"] = response.to_dict()
+        replayed = _comparable(agent, item["event"], result["response"])
+        reference = _comparable(agent, item["event"], item["reference"])
+        result["agreement"] = replayed == reference
+        result["kind_agreement"] = isinstance(replayed, list) == isinstance(reference, list)
+    return result
+
+
+async def replay(items: list, agent_factory: Callable, concurrency: int = 8) -> list:
+    """
+    Sends the queries of the trajectories to fresh agents, at most `concurrency` at a time.
+
+    Args:
+        items (list): The queries returned by `load_replay_items`.
+        agent_factory (Callable): Creates an agent (LLMClient or VLMClient) without history.
+        concurrency (int): The maximum number of queries in flight.
+
+    Returns:
+        list: One result per query, in the order of the items, with the `response`, the
+            `latency` in seconds, whether it agrees with the reference (`agreement`, and
+            `kind_agreement` for the kind of response: action or verbal) and the `error`, if
+            any.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(
+        *(_replay_item(agent_factory, item, semaphore) for item in items)
+    )
+
+
+def summarize(results: list, wall_time: float) -> dict:
+    """
+    Args:
+        results (list): The results returned by `replay`.
+        wall_time (float): The duration of the replay in seconds.
+
+    Returns:
+        dict: The number of queries and errors, the throughput, the latency percentiles and
+            the agreement rates.
+    """
+    completed = [result for result in results if result["error"] is None]
+    latencies = numpy.array([result["latency"] for result in completed]) * 1000
+    summary = {
+        "queries": len(results),
+        "errors": len(results) - len(completed),
+        "wall_time": wall_time,
+        "queries_per_s": len(completed) / wall_time if wall_time else 0.0,
+        "p50_ms": float(numpy.percentile(latencies, 50)) if len(latencies) else None,
+        "p99_ms": float(numpy.percentile(latencies, 99)) if len(latencies) else None,
+        "agreement": None,
+        "kind_agreement": None,
+    }
+    if completed:
+        summary["agreement"] = sum(r["agreement"] for r in completed) / len(completed)
+        summary["kind_agreement"] = sum(r["kind_agreement"] for r in completed) / len(completed)
+    return summary
+
+
+def run_replay(
+    paths: list,
+    agent_type: str = "llm",
+    model_name: Optional[str] = None,
+    concurrency: int = 8,
+    history: bool = True,
+    plan: bool = False,
+    structured: bool = False,
+    backend: Optional[BackendPool] = None,
+) -> tuple:
+    """
+    Replays the queries of several trajectories with one model.
+
+    Args:
+        paths (list): The directories of the trajectories.
+        agent_type (str): "llm" or "vlm".
+        model_name (Optional[str]): The Ollama model to use. Defaults to the model of the agent.
+        concurrency (int): The maximum number of queries in flight.
+        history (bool): Whether every query gets the conversation history of the recording.
+        plan (bool): Whether the agent generates all the actions of an instruction at once.
+        structured (bool): Whether the model generates JSON responses following a schema.
+        backend (Optional[BackendPool]): The inference servers. Defaults to the local server.
+
+    Returns:
+        tuple: The results of the queries and their summary.
+    """
+    if agent_type == "vlm":
+        from genair_vlm import VLMClient as agent_class
+    else:
+        from genair_llm import LLMClient as agent_class
+
+    agent_kwargs = {"plan": plan, "structured": structured, "backend": backend}
+    if model_name:
+        agent_kwargs["model_name"] = model_name
+
+    items = [item for path in paths for item in load_replay_items(path, history)]
+    # the shared client must not queue the requests allowed by the replay
+    configure_async_client(max_concurrent_requests=concurrency)
+
+    start = time.perf_counter()
+    results = asyncio.run(replay(items, lambda: agent_class(**agent_kwargs), concurrency))
+    summary = summarize(results, time.perf_counter() - start)
+    summary["model"] = model_name
+    return results, summary
+
+
+def _format_rate(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.1%}"
+
+
+def _format_ms(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.0f}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("trajectories", nargs="+", help="directories of recorded trajectories")
+    parser.add_argument("--agent", choices=("llm", "vlm"), default="llm")
+    parser.add_argument(
+        "--model",
+        action="append",
+        help="Ollama model (defaults to the agent's), can be repeated to compare models",
+    )
+    parser.add_argument("--concurrency", type=int, default=8, help="queries in flight")
+    parser.add_argument(
+        "--no-history",
+        action="store_true",
+        help="send every query without the previous turns of the recording",
+    )
+    parser.add_argument(
+        "--plan", action="store_true", help="generate all the actions of an instruction at once"
+    )
+    parser.add_argument(
+        "--structured",
+        action="store_true",
+        help="constrain the model to JSON responses following a schema",
+    )
+    parser.add_argument(
+        "--backend",
+        action="append",
+        type=parse_endpoint,
+        help="inference endpoint as URL or URL=MODEL, can be repeated to spread the requests",
+    )
+    parser.add_argument("--strategy", choices=STRATEGIES, default="least_outstanding")
+    parser.add_argument("--output", default=None, help="JSONL file for the result of every query")
+    args = parser.parse_args()
+
+    backend = BackendPool(args.backend, strategy=args.strategy) if args.backend else None
+
+    summaries = []
+    output = open(args.output, "w") if args.output else None
+    try:
+        for model_name in args.model or [None]:
+            results, summary = run_replay(
+                args.trajectories,
+                agent_type=args.agent,
+                model_name=model_name,
+                concurrency=args.concurrency,
+                history=not args.no_history,
+                plan=args.plan,
+                structured=args.structured,
+                backend=backend,
+            )
+            summaries.append(summary)
+            if output is not None:
+                for result in results:
+                    output.write(json.dumps({"model": model_name, **result}) + "\n")
+    finally:
+        if output is not None:
+            output.close()
+
+    print("------")
+    print(
+        f"{'model':<24} {'queries':>8} {'errors':>7} {'q/s':>8} {'p50 ms':>8} {'p99 ms':>8} "
+        f"{'agree':>7} {'kind':>7}"
+    )
+    for summary in summaries:
+        print(
+            f"{summary['model'] or 'default':<24} {summary['queries']:>8} "
+            f"{summary['errors']:>7} {summary['queries_per_s']:>8.2f} "
+            f"{_format_ms(summary['p50_ms']):>8} {_format_ms(summary['p99_ms']):>8} "
+            f"{_format_rate(summary['agreement']):>7} "
+            f"{_format_rate(summary['kind_agreement']):>7}"
+        )
+    if args.output:
+        print(f"Results are available in '{args.output}'.")
+
+
+if __name__ == "__main__":
+    main()
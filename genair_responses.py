@@ -0,0 +1,73 @@
+"""
+Responses of the agents. This module only depends on pydantic, so that tools that parse or
+compare responses (e.g. the parser benchmarks or the replay of trajectories) do not have to
+import the simulator or the HTTP clients.
+"""
+from typing import List, Optional, Union
+
+from pydantic import BaseModel, RootModel
+
+from genair_structured import make_response_format
+
+# Action of the responses whose object is not visible, returned instead of an invalid object ID
+NO_VISIBLE_OBJECT = "No visible object with that id."
+
+
+class AgentResponse(BaseModel):
+    """
+    Base class for agent responses. Provides a method to convert the response
+    to a dictionary, filtering out None values.
+    """
+
+    def to_dict(self) -> dict:
+        """
+        Converts the response object to a dictionary, excluding keys with None values.
+
+        Returns:
+            dict: A dictionary representation of the response.
+        """
+        current_dict = self.model_dump(mode="python")
+        return {key: value for key, value in current_dict.items() if value is not None}
+
+
+class AgentTextualResponse(AgentResponse):
+    """
+    Represents a textual response from the agent.
+
+    Attributes:
+        response (str): The textual response generated by the agent.
+    """
+
+    response: str
+
+
+class AgentActionResponse(AgentResponse):
+    """
+    Represents an action response from the agent.
+
+    Attributes:
+        action (str): The action to be performed by the agent.
+        objectId (Optional[str]): The ID of the object involved in the action, if any.
+        degrees (Optional[float]): The degrees of rotation, if applicable.
+    """
+
+    action: str
+    objectId: Optional[str] = None
+    degrees: Optional[float] = None
+
+
+class AgentPlanResponse(AgentResponse):
+    """
+    Represents a sequence of actions generated by the agent in plan mode.
+
+    Attributes:
+        actions (List[str]): The actions in execution order, e.g. "[Action] OpenObject(Fridge)".
+            Their objects are resolved when they are executed (see `genair_plan.execute_plan`).
+    """
+
+    actions: List[str]
+
+
+# The responses the model can generate in structured mode
+StructuredResponse = RootModel[Union[AgentActionResponse, AgentTextualResponse]]
+STRUCTURED_RESPONSE_FORMAT = make_response_format(StructuredResponse)
@@ -0,0 +1,57 @@
+import re
+
+# "[Action] OpenObject(Fridge)" or "[Action] RotateLeft(90)"
+_ACTION_CALL = re.compile(r"\[Action\]\s*\w+\s*\([^)]*\)")
+# "[Action] MoveAhead" followed by a new line or a punctuation mark
+_ACTION_BARE = re.compile(r"\[Action\]\s*\w+(?=[ \t]*(?:\n|[.,;!?]))")
+# "[Action] OpenObject: Fridge" or "[Action] OpenObject Fridge" (normalised by LLMClient),
+# once the object name is followed by something else
+_ACTION_WITH_OBJECT = re.compile(r"\[Action\] \w+:? \w+(?=\W)")
+# the end of the first sentence of a verbal response
+_SENTENCE_END = re.compile(r"\w[^.!?\n]*[.!?\n](?=\s)")
+
+
+class StreamingResponseParser:
+    """
+    Incremental parser for streamed model responses. Text deltas are fed as they arrive and the
+    parser tells when the response contains a complete action (e.g. "[Action]
+    PickupObject(Apple)") or a finished "[Say]" sentence, so that the stream can be closed
+    without waiting for the model to stop talking.
+
+    Attributes:
+        text (str): The text received so far. Once the response is complete, anything after
+            the action or the first sentence is dropped.
+        complete (bool): Whether a complete action or sentence has been received.
+    """
+
+    def __init__(self) -> None:
+        self.text = ""
+        self.complete = False
+
+    def feed(self, delta: str) -> bool:
+        """
+        Adds a piece of streamed text.
+
+        Args:
+            delta (str): The new text.
+
+        Returns:
+            bool: True once the response is complete and the stream can be closed.
+        """
+        if not self.complete and delta:
+            self.text += delta
+            text = self.text.lstrip()
+            match = self._find_complete(text)
+            if match is not None:
+                self.text = text[: match.end()].rstrip()
+                self.complete = True
+        return self.complete
+
+    def _find_complete(self, text: str):
+        if text.startswith("[Say]"):
+            return _SENTENCE_END.search(text, len("[Say]"))
+
+        # like `genair_actions.parse_response`, an action only counts at the start of the reply
+        return (
+            _ACTION_WITH_OBJECT.match(text) or _ACTION_CALL.match(text) or _ACTION_BARE.match(text)
+        )
@@ -0,0 +1,107 @@
+import threading
+from typing import Optional
+
+from pydantic import BaseModel, ValidationError
+
+# A JSON action such as {"action": "OpenObject", "objectId": "Fridge"} takes about 20 tokens,
+# so a tight limit only stops models that keep talking after the object
+MAX_STRUCTURED_TOKENS = 64
+
+# Appended to the system prompt of the agents in structured mode
+STRUCTURED_PROMPT = """
+Reply with a single JSON object and nothing else. To perform an action, reply with the action
+name and, if needed, the object name, e.g. {"action": "OpenObject", "objectId": "Fridge"}.
+To answer the user, reply with {"response": "<your answer>"}.
+"""
+
+
+def make_response_format(model: type, name: str = "agent_response") -> dict:
+    """
+    Builds the `response_format` argument of a chat completion from a pydantic model. Ollama
+    turns the JSON schema into a grammar, so the model can only generate valid objects.
+
+    Args:
+        model (type): The pydantic model (e.g. a RootModel over the possible responses).
+        name (str): The name of the schema.
+
+    Returns:
+        dict: The response format.
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "schema": model.model_json_schema()},
+    }
+
+
+def parse_structured(model: type, text: str) -> Optional[BaseModel]:
+    """
+    Validates a structured response.
+
+    Args:
+        model (type): The pydantic model of the response. For a RootModel, the validated root
+            is returned.
+        text (str): The raw response from the model.
+
+    Returns:
+        Optional[BaseModel]: The validated response, or None if it does not match the schema.
+    """
+    try:
+        parsed = model.model_validate_json(text)
+    except ValidationError:
+        return None
+    return getattr(parsed, "root", parsed)
+
+
+class StructuredOutputStats:
+    """
+    Counts how often structured responses could not be validated, and how many tokens the
+    completions took in either mode, to compare the structured mode with the tag format.
+
+    Attributes:
+        responses (int): The number of structured responses parsed.
+        parse_failures (int): The number of structured responses that did not match the schema
+            and went through the regular expression parser.
+        completions (int): The number of completions whose usage was reported by the server.
+        output_tokens (int): The number of tokens generated in these completions.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.responses = 0
+        self.parse_failures = 0
+        self.completions = 0
+        self.output_tokens = 0
+
+    def record_response(self, parsed: bool) -> None:
+        with self._lock:
+            self.responses += 1
+            self.parse_failures += int(not parsed)
+
+    def record_usage(self, completion) -> None:
+        usage = getattr(completion, "usage", None)
+        if usage is not None and usage.completion_tokens is not None:
+            with self._lock:
+                self.completions += 1
+                self.output_tokens += usage.completion_tokens
+
+    def summary(self) -> dict:
+        """
+        Returns:
+            dict: The counters, the parse failure rate and the mean number of output tokens.
+        """
+        with self._lock:
+            return {
+                "responses": self.responses,
+                "parse_failures": self.parse_failures,
+                "parse_failure_rate": self.parse_failures / self.responses
+                if self.responses
+                else 0.0,
+                "completions": self.completions,
+                "output_tokens": self.output_tokens,
+                "mean_output_tokens": self.output_tokens / self.completions
+                if self.completions
+                else 0.0,
+            }
@@ -0,0 +1,176 @@
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from typing import Optional
+
+
+_NULL_SPAN = nullcontext()
+
+
+class _Span:
+    __slots__ = ("_tracer", "_name", "_args", "_start")
+
+    def __init__(self, tracer: "Tracer", name: str, args: Optional[dict]) -> None:
+        self._tracer = tracer
+        self._name = name
+        self._args = args
+
+    def __enter__(self) -> "_Span":
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        end = time.perf_counter_ns()
+        # list.append is atomic, so spans can be recorded from several threads without a lock
+        self._tracer.records.append(
+            (self._name, self._start, end - self._start, threading.get_ident(), self._args)
+        )
+
+
+class Tracer:
+    """
+    Records how long each stage of the agent loop takes (prompt building, chat completion,
+    response parsing, simulator steps, text rendering, video encoding...).
+
+    Spans are recorded as plain tuples, and a disabled tracer returns a shared no-op context
+    manager, so tracing can be left in the code at a negligible cost.
+
+    Attributes:
+        enabled (bool): Whether spans are recorded.
+        records (list): The recorded spans as (name, start_ns, duration_ns, thread_id, args).
+    """
+
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self.records = []
+        self._origin = time.perf_counter_ns()
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def clear(self) -> None:
+        self.records = []
+        self._origin = time.perf_counter_ns()
+
+    def span(self, name: str, **args):
+        """
+        Returns a context manager that records the time spent in its block.
+
+        Args:
+            name (str): The name of the stage.
+            **args: Extra information stored with the span (e.g. the action).
+
+        Returns:
+            A context manager recording the span.
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args or None)
+
+    def summary(self) -> list:
+        """
+        Aggregates the recorded spans by stage.
+
+        Returns:
+            list: One dictionary per stage with the number of calls and the total, mean, p50,
+                p95 and maximum duration in milliseconds, sorted by total time.
+        """
+        import numpy
+
+        durations = {}
+        for name, _, duration, _, _ in self.records:
+            durations.setdefault(name, []).append(duration)
+
+        rows = []
+        for name, values in durations.items():
+            values = numpy.array(values) / 1e6
+            rows.append(
+                {
+                    "stage": name,
+                    "count": len(values),
+                    "total_ms": float(values.sum()),
+                    "mean_ms": float(values.mean()),
+                    "p50_ms": float(numpy.percentile(values, 50)),
+                    "p95_ms": float(numpy.percentile(values, 95)),
+                    "max_ms": float(values.max()),
+                }
+            )
+        return sorted(rows, key=lambda row: row["total_ms"], reverse=True)
+
+    def print_summary(self) -> None:
+        """
+        Prints a table with the time spent in each stage.
+        """
+        header = (
+            f"{'stage':<20}{'count':>7}{'total ms':>11}{'mean ms':>10}"
+            f"{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}"
+        )
+        print(header)
+        print("-" * len(header))
+        for row in self.summary():
+            print(
+                f"{row['stage']:<20}{row['count']:>7}{row['total_ms']:>11.1f}"
+                f"{row['mean_ms']:>10.2f}{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}"
+                f"{row['max_ms']:>10.2f}"
+            )
+
+    def export_jsonl(self, path: str) -> None:
+        """
+        Writes one JSON line per span, with times in milliseconds since the tracer started.
+
+        Args:
+            path (str): The output file.
+        """
+        with open(path, "w") as f:
+            for name, start, duration, thread_id, args in self.records:
+                record = {
+                    "name": name,
+                    "start_ms": (start - self._origin) / 1e6,
+                    "duration_ms": duration / 1e6,
+                    "thread": thread_id,
+                }
+                if args:
+                    record["args"] = args
+                f.write(json.dumps(record, default=str) + "\n")
+
+    def export_chrome_trace(self, path: str) -> None:
+        """
+        Writes the spans in the Chrome trace-event format, which can be opened in
+        chrome://tracing or https://ui.perfetto.dev.
+
+        Args:
+            path (str): The output file.
+        """
+        pid = os.getpid()
+        events = []
+        for name, start, duration, thread_id, args in self.records:
+            event = {
+                "name": name,
+                "ph": "X",
+                "ts": (start - self._origin) / 1e3,
+                "dur": duration / 1e3,
+                "pid": pid,
+                "tid": thread_id,
+            }
+            if args:
+                event["args"] = {key: str(value) for key, value in args.items()}
+            events.append(event)
+
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+# Tracer shared by the agents and the scripts. It is disabled until someone enables it.
+tracer = Tracer()
+
+
+def span(name: str, **args):
+    """
+    Records a span with the shared tracer. See `Tracer.span`.
+    """
+    return tracer.span(name, **args)
@@ -0,0 +1,324 @@
+import json
+import os
+from typing import Iterator, Optional, Union
+
+import msgpack
+import numpy
+from PIL import Image
+
+# Name of the files of a trajectory directory
+HEADER_FILE = "header.json"
+FRAMES_FILE = "frames.u8"
+STEPS_FILE = "steps.msgpack"
+
+TRAJECTORY_VERSION = 1
+
+
+def _to_builtin(value):
+    # msgpack only knows the builtin types, but the metadata of the simulator can contain numpy
+    # values
+    if isinstance(value, numpy.generic):
+        return value.item()
+    if isinstance(value, numpy.ndarray):
+        return value.tolist()
+    raise TypeError(f"Cannot serialize an object of type {type(value).__name__}")
+
+
+def _strip_images(messages: Optional[list]) -> Optional[list]:
+    """
+    Replaces the images of a prompt (base64 data URLs) by a placeholder: the frame is already
+    stored with the trajectory, and its encoding would take most of the step log.
+    """
+    if messages is None:
+        return None
+
+    stripped = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            content = [
+                {"type": "image_url", "image_url": {"url": "<frame>"}}
+                if part.get("type") == "image_url"
+                else part
+                for part in content
+            ]
+            message = {**message, "content": content}
+        stripped.append(message)
+    return stripped
+
+
+class TrajectoryWriter:
+    """
+    Records an episode incrementally in a directory, so that nothing is lost except what was
+    not written yet if the program crashes:
+
+    - `frames.u8` contains the raw RGB frames, one after the other, written through a numpy
+      memmap that grows by `grow_by` frames at a time;
+    - `steps.msgpack` is a stream of msgpack records, one per step (observation, model reply,
+      instruction...), each one flushed as soon as it is written;
+    - `header.json` describes the frames (shape, dtype and, once the writer is closed, their
+      number).
+
+    Every record contains its `kind`, its index `step` and the index of the last frame written
+    before it (`frame`, -1 if none), so the frames of any step can be found without reading the
+    others.
+
+    Attributes:
+        path (str): The directory of the trajectory.
+        num_frames (int): The number of frames written so far.
+        num_steps (int): The number of steps written so far.
+    """
+
+    def __init__(self, path: str, grow_by: int = 64) -> None:
+        """
+        Creates the directory of the trajectory.
+
+        Args:
+            path (str): The directory of the trajectory. Existing files are overwritten.
+            grow_by (int): The number of frames added to the memmap when it is full.
+        """
+        if grow_by < 1:
+            raise ValueError("grow_by must be at least 1")
+
+        self.path = path
+        self.num_frames = 0
+        self.num_steps = 0
+        self._grow_by = grow_by
+        self._frame_shape = None
+        self._frames = None
+        self._capacity = 0
+
+        os.makedirs(path, exist_ok=True)
+        self._frames_path = os.path.join(path, FRAMES_FILE)
+        # truncate the frames of a previous trajectory
+        open(self._frames_path, "wb").close()
+        self._steps = open(os.path.join(path, STEPS_FILE), "wb")
+        self._packer = msgpack.Packer(default=_to_builtin)
+        self._write_header()
+
+    def _write_header(self, closed: bool = False) -> None:
+        header = {
+            "version": TRAJECTORY_VERSION,
+            "frame_shape": list(self._frame_shape) if self._frame_shape else None,
+            "dtype": "uint8",
+        }
+        if closed:
+            header["num_frames"] = self.num_frames
+            header["num_steps"] = self.num_steps
+
+        with open(os.path.join(self.path, HEADER_FILE), "w") as f:
+            json.dump(header, f)
+
+    def _resize(self, capacity: int) -> None:
+        if self._frames is not None:
+            self._frames.flush()
+            # the memmap must be released before the file changes size
+            self._frames = None
+
+        frame_size = int(numpy.prod(self._frame_shape))
+        os.truncate(self._frames_path, capacity * frame_size)
+        self._capacity = capacity
+        if capacity:
+            self._frames = numpy.memmap(
+                self._frames_path,
+                dtype=numpy.uint8,
+                mode="r+",
+                shape=(capacity, *self._frame_shape),
+            )
+
+    def append_frame(self, frame: Union[Image.Image, numpy.ndarray]) -> int:
+        """
+        Writes a frame. All the frames of a trajectory must have the same shape.
+
+        Args:
+            frame (Union[Image.Image, numpy.ndarray]): An RGB frame, e.g. `event.frame`.
+
+        Returns:
+            int: The index of the frame.
+        """
+        if isinstance(frame, Image.Image):
+            frame = numpy.asarray(frame.convert("RGB"))
+
+        if self._frame_shape is None:
+            self._frame_shape = tuple(frame.shape)
+            self._write_header()
+        elif tuple(frame.shape) != self._frame_shape:
+            raise ValueError(
+                f"Frame of shape {tuple(frame.shape)} in a trajectory of shape {self._frame_shape}"
+            )
+
+        if self.num_frames == self._capacity:
+            self._resize(self._capacity + self._grow_by)
+
+        self._frames[self.num_frames] = frame
+        self.num_frames += 1
+        return self.num_frames - 1
+
+    def append_step(self, kind: str, **fields) -> int:
+        """
+        Writes a step to the log.
+
+        Args:
+            kind (str): The kind of step, e.g. "observation", "model" or "instruction".
+            **fields: The content of the step. Values must be serializable by msgpack.
+
+        Returns:
+            int: The index of the step.
+        """
+        record = {"kind": kind, "step": self.num_steps, "frame": self.num_frames - 1, **fields}
+        self._steps.write(self._packer.pack(record))
+        self._steps.flush()
+        self.num_steps += 1
+        return self.num_steps - 1
+
+    def append_observation(self, event) -> int:
+        """
+        Writes the frame and the metadata of an observation of the simulator.
+
+        Args:
+            event: The observation.
+
+        Returns:
+            int: The index of the step.
+        """
+        self.append_frame(event.frame)
+        return self.append_step("observation", metadata=event.metadata)
+
+    def append_model_turn(self, language_input: str, response, turn: Optional[dict]) -> int:
+        """
+        Writes a query of the model: the prompt, the raw reply and the parsed response.
+
+        Args:
+            language_input (str): The input sent with the observation.
+            response: The response returned by the agent.
+            turn (Optional[dict]): The `last_turn` of the agent, with the prompt and the reply.
+
+        Returns:
+            int: The index of the step.
+        """
+        turn = turn or {}
+        return self.append_step(
+            "model",
+            language_input=language_input,
+            prompt=_strip_images(turn.get("prompt")),
+            reply=turn.get("reply"),
+            response=response.to_dict(),
+        )
+
+    def close(self) -> None:
+        """
+        Trims the frames to the number written and completes the header.
+        """
+        if self._steps.closed:
+            return
+
+        if self._frame_shape is not None:
+            self._resize(self.num_frames)
+        self._frames = None
+        self._steps.close()
+        self._write_header(closed=True)
+
+    def __enter__(self) -> "TrajectoryWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+class TrajectoryReader:
+    """
+    Opens a trajectory written by `TrajectoryWriter` without loading it: the frames are a
+    read-only memmap, so slicing them only reads the frames asked for, and the steps are
+    decoded one by one while they are iterated.
+
+    A trajectory that was not closed (e.g. after a crash) can be read too: its frames are the
+    ones referenced by the last step that was written.
+
+    Attributes:
+        path (str): The directory of the trajectory.
+        frames (numpy.memmap): The frames, of shape (num_frames, height, width, 3).
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Opens a trajectory.
+
+        Args:
+            path (str): The directory of the trajectory.
+        """
+        self.path = path
+        with open(os.path.join(path, HEADER_FILE)) as f:
+            self.header = json.load(f)
+        if self.header.get("version") != TRAJECTORY_VERSION:
+            raise ValueError(f"Unsupported trajectory version: {self.header.get('version')}")
+
+        self._steps_path = os.path.join(path, STEPS_FILE)
+        self._num_steps = self.header.get("num_steps")
+
+        num_frames = self.header.get("num_frames")
+        if num_frames is None:
+            num_frames = max((step["frame"] + 1 for step in self.steps()), default=0)
+
+        frame_shape = self.header["frame_shape"]
+        if frame_shape is None or num_frames == 0:
+            self.frames = numpy.zeros((0, *(frame_shape or (0, 0, 3))), dtype=numpy.uint8)
+        else:
+            self.frames = numpy.memmap(
+                os.path.join(path, FRAMES_FILE),
+                dtype=self.header["dtype"],
+                mode="r",
+                shape=(num_frames, *frame_shape),
+            )
+
+    @property
+    def num_frames(self) -> int:
+        return len(self.frames)
+
+    @property
+    def num_steps(self) -> int:
+        if self._num_steps is None:
+            self._num_steps = sum(1 for _ in self.steps())
+        return self._num_steps
+
+    def __len__(self) -> int:
+        return self.num_steps
+
+    def steps(self, kind: Optional[str] = None) -> Iterator[dict]:
+        """
+        Iterates over the steps of the trajectory, decoding them as they are read.
+
+        Args:
+            kind (Optional[str]): Only yields the steps of this kind.
+
+        Yields:
+            dict: The steps, in the order in which they were written.
+        """
+        with open(self._steps_path, "rb") as f:
+            # a record cut short by a crash ends the iteration
+            unpacker = msgpack.Unpacker(f, raw=False, strict_map_key=False)
+            for step in unpacker:
+                if kind is None or step["kind"] == kind:
+                    yield step
+
+    def frame(self, index: int) -> numpy.ndarray:
+        """
+        Args:
+            index (int): The index of the frame.
+
+        Returns:
+            numpy.ndarray: A copy of the frame.
+        """
+        return numpy.array(self.frames[index])
+
+    def step_frame(self, step: dict) -> Optional[numpy.ndarray]:
+        """
+        Args:
+            step (dict): A step of the trajectory.
+
+        Returns:
+            Optional[numpy.ndarray]: The last frame written before the step, or None if there
+                was none.
+        """
+        if step["frame"] < 0:
+            return None
+        return self.frame(step["frame"])
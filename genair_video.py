@@ -0,0 +1,218 @@
+import os
+import textwrap
+import threading
+from collections import OrderedDict
+from fractions import Fraction
+from typing import Optional, Union
+
+import av
+import numpy
+from PIL import Image, ImageDraw, ImageFont
+
+
+class VideoRecorder:
+    """
+    Writes the frames of an episode to a video file as soon as they are produced, instead of
+    keeping all of them in memory until the end of the episode.
+
+    MP4/MOV files are written as fragmented MP4: the file is split in self-contained fragments,
+    one per keyframe, so a video interrupted by a crash can still be played up to the last
+    fragment that was written.
+
+    Attributes:
+        path (str): The path of the video file.
+        fps (float): The number of frames per second of the video.
+        codec (str): The codec used to encode the video.
+        frames_written (int): The number of frames appended so far.
+    """
+
+    def __init__(
+        self,
+        path: str = "rollout.mp4",
+        fps: float = 1,
+        codec: str = "libx264",
+        max_keyframe_interval: Optional[int] = None,
+    ) -> None:
+        """
+        Opens the video file and prepares the video stream.
+
+        Args:
+            path (str): The path of the video file.
+            fps (float): The number of frames per second of the video.
+            codec (str): The codec used to encode the video.
+            max_keyframe_interval (Optional[int]): The maximum number of frames between two
+                keyframes. Fragments end at keyframes, so this bounds the number of frames lost
+                if the program crashes. Defaults to one keyframe every 5 seconds of video.
+        """
+        self.path = path
+        self.fps = fps
+        self.codec = codec
+        self.frames_written = 0
+
+        if max_keyframe_interval is None:
+            max_keyframe_interval = max(1, int(5 * fps))
+        self._max_keyframe_interval = max_keyframe_interval
+
+        # `flush_packets` writes every packet to disk straight away instead of buffering it
+        container_options = {"flush_packets": "1"}
+        if os.path.splitext(path)[1].lower() in (".mp4", ".mov"):
+            container_options["movflags"] = "frag_keyframe+empty_moov+default_base_moof"
+
+        self._container = av.open(path, mode="w", options=container_options)
+        # the stream is created with the first frame, once we know the frame size
+        self._stream = None
+
+    def _init_stream(self, width: int, height: int) -> None:
+        codec_options = {}
+        if self.codec == "libx264":
+            # without look-ahead each frame is encoded as soon as it is appended, rather than
+            # being held back by the encoder until several more frames arrive
+            codec_options["tune"] = "zerolatency"
+
+        self._stream = self._container.add_stream(
+            self.codec, rate=Fraction(self.fps).limit_denominator(1000), options=codec_options
+        )
+        self._stream.width = width
+        self._stream.height = height
+        self._stream.pix_fmt = "yuv420p"
+        self._stream.codec_context.gop_size = self._max_keyframe_interval
+
+    def append(self, frame: Union[Image.Image, numpy.ndarray]) -> None:
+        """
+        Encodes a frame and appends it to the video.
+
+        Args:
+            frame (Union[Image.Image, numpy.ndarray]): An RGB frame, either as a PIL image or
+                as an array of shape (height, width, 3).
+        """
+        if self._container is None:
+            raise RuntimeError(f"The video '{self.path}' has already been closed.")
+
+        if isinstance(frame, Image.Image):
+            if frame.mode != "RGB":
+                frame = frame.convert("RGB")
+            frame = numpy.asarray(frame)
+        if self._stream is None:
+            self._init_stream(frame.shape[1], frame.shape[0])
+
+        video_frame = av.VideoFrame.from_ndarray(
+            numpy.ascontiguousarray(frame), format="rgb24"
+        )
+        for packet in self._stream.encode(video_frame):
+            self._container.mux(packet)
+        self.frames_written += 1
+
+    def close(self) -> None:
+        """
+        Flushes the encoder and closes the video file.
+        """
+        if self._container is None:
+            return
+
+        if self._stream is not None:
+            # flush the frames still buffered in the encoder
+            for packet in self._stream.encode(None):
+                self._container.mux(packet)
+        self._container.close()
+        self._container = None
+
+    def __enter__(self) -> "VideoRecorder":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+class TextCardRenderer:
+    """
+    Renders text (e.g. the user instruction or the agent reply) on a white card that can be
+    added to the rollout video. The font is loaded once, blank canvases are created once per
+    size and rendered cards are memoized, so rendering the same text again only costs a copy.
+
+    Attributes:
+        font_size (int): The size of the font.
+        line_height (int): The vertical distance between two lines of text.
+        max_cards (int): The maximum number of rendered cards remembered.
+    """
+
+    def __init__(
+        self,
+        font_path: str = "arial.ttf",
+        font_size: int = 55,
+        line_height: int = 20,
+        max_cards: int = 128,
+    ) -> None:
+        """
+        Initializes the renderer and loads the font.
+
+        Args:
+            font_path (str): The TrueType font to use. If it cannot be loaded, the default PIL
+                font is used instead.
+            font_size (int): The size of the font.
+            line_height (int): The vertical distance between two lines of text.
+            max_cards (int): The maximum number of rendered cards remembered.
+        """
+        self.font_size = font_size
+        self.line_height = line_height
+        self.max_cards = max_cards
+
+        try:
+            self.font = ImageFont.truetype(font_path, font_size)
+        except IOError:
+            self.font = ImageFont.load_default()
+
+        # Wrap the text to fit within max_width
+        max_width = 2000
+        self._wrap_width = int(max_width / (font_size / 2))  # Adjust divisor for char width
+
+        self._templates = {}
+        self._cards = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _template(self, width: int, height: int) -> Image.Image:
+        template = self._templates.get((width, height))
+        if template is None:
+            template = Image.new("RGB", (width, height), "white")
+            self._templates[(width, height)] = template
+        return template
+
+    def _draw(self, text: str, width: int, height: int) -> Image.Image:
+        text_image = self._template(width, height).copy()
+        draw = ImageDraw.Draw(text_image)
+
+        lines = textwrap.wrap(text, width=self._wrap_width)
+
+        # Calculate starting y position to center the text vertically
+        y = (height - len(lines) * self.line_height) // 2
+
+        for line in lines:
+            draw.text((50, y), line, fill="black", font=self.font)
+            y += self.line_height
+
+        return text_image
+
+    def render(self, text: str, width: int = 640, height: int = 640) -> Image.Image:
+        """
+        Renders text centred vertically on a white card.
+
+        Args:
+            text (str): The text to render. Long lines are wrapped.
+            width (int): The width of the card.
+            height (int): The height of the card.
+
+        Returns:
+            Image.Image: The rendered card. It is a copy, so it can be modified freely.
+        """
+        key = (text, width, height)
+        with self._lock:
+            card = self._cards.get(key)
+            if card is not None:
+                self._cards.move_to_end(key)
+                return card.copy()
+
+        card = self._draw(text, width, height)
+        with self._lock:
+            self._cards[key] = card
+            while len(self._cards) > self.max_cards:
+                self._cards.popitem(last=False)
+        return card.copy()
@@ -1,14 +1,20 @@
-import base64
-import io
-import re
-from typing import Optional
-
-import imageio
-import numpy
-from ai2thor.controller import Controller
-from openai import OpenAI
-from PIL import Image
-from pydantic import BaseModel
+import time
+from typing import TYPE_CHECKING, Optional
+
+from genair_agent import AgentClient
+from genair_async import prompt_tokens
+from genair_cache import ResponseCache, hash_frame, make_cache_key
+from genair_escalation import needs_escalation
+from genair_pipeline import AgentPipeline, warm_up_in_background
+from genair_plan import run_instruction
+from genair_responses import AgentResponse as BaseAgentResponse
+from genair_tracing import span, tracer
+
+if TYPE_CHECKING:
+    # The simulator and the image and video libraries are imported on first use, to keep the
+    # import fast
+    from genair_backends import BackendPool
+    from genair_images import ImageEncoder, ImagePyramid
 
 SYSTEM_PROMPT = """
 You are an embodied agent that receives images and acts in a 3D simulated environment. Your task is
@@ -36,189 +42,343 @@ action.
 When answering a question, use the tag `[Say]` to generate a verbal response.",
 """
 
-client = OpenAI(base_url="http://localhost:11434/v1", api_key="ollama")
 
-
-class BaseAgentResponse(BaseModel):
-    def to_dict(self):
-        current_dict = self.model_dump(mode="python")
-
-        return {key: value for key, value in current_dict.items() if value is not None}
-
-
-class AgentTextualResponse(BaseAgentResponse):
-    response: str
-
-
-class AgentActionResponse(BaseAgentResponse):
-    action: str
-    objectId: Optional[str] = None
-    degrees: Optional[float] = None
-
-
-class VLMClient:
+class VLMClient(AgentClient):
+    # The requests to the model and the parsing of the replies are shared with LLMClient (see
+    # genair_agent.AgentClient); this class builds the prompts with the image of the observation
     # You can pass in the model name as a string
     # make sure that you "pull" the model first using ollama pull <model_name>
-    def __init__(self, model_name="gemma3:4b"):
-        self.model_name = model_name
-        self.history = []
+    # An optional ResponseCache avoids calling the model again for the same frame and instruction
+    # The ImageEncoder controls the format, quality and resolution of the images sent to the model
+    # With stream=True, responses are cut as soon as they contain a complete action or sentence
+    # The history keeps the previous instructions and replies within max_history_tokens
+    # With plan=True, the model generates all the actions of an instruction in one reply (without
+    # streaming, since the stream would be cut after the first action)
+    # With structured=True, the model generates JSON following the schema of the responses
+    # (parsed with the tags as a fallback); it cannot be combined with plan=True
+    # A BackendPool spreads the requests over several inference servers
+    # With an ImagePyramid, the observation is sent at the smallest resolution first and at the
+    # next one only when the response cannot be used (see `_act_pyramid`)
+    def __init__(
+        self,
+        model_name="gemma3:4b",
+        cache: Optional[ResponseCache] = None,
+        image_encoder: Optional["ImageEncoder"] = None,
+        stream: bool = False,
+        max_history_tokens: int = 2048,
+        plan: bool = False,
+        structured: bool = False,
+        backend: Optional["BackendPool"] = None,
+        pyramid: Optional["ImagePyramid"] = None,
+    ):
+        super().__init__(
+            model_name,
+            SYSTEM_PROMPT,
+            cache=cache,
+            stream=stream,
+            max_history_tokens=max_history_tokens,
+            plan=plan,
+            structured=structured,
+            backend=backend,
+        )
+        if image_encoder is None:
+            from genair_images import ImageEncoder
+
+            image_encoder = ImageEncoder()
+        self.image_encoder = image_encoder
+        self.pyramid = pyramid
+        self.pyramid_stats = None
+        if pyramid is not None:
+            from genair_images import PyramidStats
+
+            self.pyramid_stats = PyramidStats(len(pyramid))
 
     def reset(self):
         print("Model history reset...")
-        self.history = []
-
-    def encode_image(self, image: Image) -> str:
-        # Convert the PIL image to a byte stream
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-        buffered.seek(0)
-
-        # Encode the byte stream to base64
-        return base64.b64encode(buffered.getvalue()).decode("utf-8")
-
-    def _get_object_id(self, raw_object_id: str, env_observation) -> Optional[str]:
-        visible_objects_ids = [
-            o["objectId"] for o in env_observation.metadata["objects"] if o["visible"]
+        self.history.clear()
+        self.last_turn = None
+
+    def prepare(self, env_observation) -> None:
+        # Encodes the frame ahead of time (e.g. in a background thread while the user types the
+        # next instruction); `act` then finds it in the memo of the encoder
+        if self.pyramid is not None:
+            self.pyramid.levels(env_observation.frame).encode(0)
+        else:
+            self.image_encoder.encode(env_observation.frame)
+
+    def encode_image(self, image) -> str:
+        # Encodes a PIL image or a simulator frame to base64. Frames are encoded straight from
+        # the numpy array and memoized, so an unchanged view is never encoded twice
+        return self.image_encoder.encode(image)
+
+    def _build_messages(self, env_observation, language_input, image_url=None) -> list:
+        if image_url is None:
+            with span("encode_image"):
+                image_url = self.image_encoder.encode_data_url(env_observation.frame)
+
+        # Previous turns only keep their text: the images of past observations would take most
+        # of the context, and leaving them out keeps the prefix identical from one turn to the next
+        return [
+            {"role": "system", "content": self.system_prompt},
+            *self.history.messages(),
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image_url",
+                        "image_url": {"url": image_url},
+                    },
+                    {"type": "text", "text": language_input},
+                ],
+            },
         ]
-        object_id = None
 
-        for visible_object_id in visible_objects_ids:
-            if raw_object_id.lower() in visible_object_id.lower():
-                object_id = visible_object_id
-                break
-
-        return object_id
-
-    def postprocess_response(self, env_observation, response) -> BaseAgentResponse:
-        if response.startswith("[Action]"):
-            raw_action = response.replace("[Action]", "").strip()
-
-            is_interaction_action = any(
-                raw_action.startswith(interaction)
-                for interaction in [
-                    "OpenObject",
-                    "CloseObject",
-                    "PickupObject",
-                    "PutObject",
-                    "DropObject",
-                    "ToggleObject",
-                    "SliceObject",
+    def _cache_key(self, env_observation, language_input) -> Optional[str]:
+        if self.cache is None:
+            return None
+        # hashing the raw frame is much cheaper than encoding it, so we do it before building
+        # the messages
+        return make_cache_key(
+            self.model_name,
+            self._generation_settings(),
+            self.system_prompt,
+            self.history.messages(),
+            hash_frame(env_observation.frame),
+            self.pyramid.settings if self.pyramid is not None else self.image_encoder.settings,
+            language_input,
+        )
+
+    def _record_turn(self, messages, language_input, raw_response) -> None:
+        # The prompt is not rebuilt for cached responses, so `messages` can be None
+        self.last_turn = {"prompt": messages, "reply": raw_response}
+        self.history.add_turn(language_input, raw_response)
+
+    def calibrate_pyramid(self, env_observation, rounds: int = 2) -> None:
+        # Sends the frame at every level of the pyramid with the same short prompt, so that the
+        # savings of the pyramid can be estimated before any query was escalated. The first
+        # round is not measured: it pays for the connection and the loading of the model.
+        levels = self.pyramid.levels(env_observation.frame)
+        for i in range(rounds + 1):
+            attempts = []
+            for level in range(len(levels)):
+                messages = [
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "image_url", "image_url": {"url": levels.data_url(level)}},
+                            {"type": "text", "text": "Reply with one word."},
+                        ],
+                    }
                 ]
+                start = time.perf_counter()
+                with span("calibrate_pyramid", level=level):
+                    completion = self._create(
+                        temperature=0, model=self.model_name, messages=messages, max_tokens=1
+                    )
+                attempts.append((level, prompt_tokens(completion), time.perf_counter() - start))
+            if i > 0:
+                self.pyramid_stats.record_calibration(attempts)
+
+    def _pyramid_messages(self, env_observation, language_input, levels, level: int) -> list:
+        with span("build_prompt"):
+            with span("encode_image", level=level):
+                image_url = levels.data_url(level)
+            return self._build_messages(env_observation, language_input, image_url)
+
+    def _finish_pyramid(
+        self, language_input, cache_key, attempts, messages, raw_response
+    ) -> None:
+        self.pyramid_stats.record_query(attempts)
+        if cache_key is not None:
+            self.cache.put(cache_key, raw_response)
+        self._record_turn(messages, language_input, raw_response)
+
+    def _pyramid_step(
+        self, env_observation, levels, level: int, attempts: list, start, raw_response, num_tokens
+    ) -> tuple:
+        # Records the reply to a level and decides whether the next level must be sent: only
+        # when the reply does not follow the format or names no visible object
+        attempts.append((level, num_tokens, time.perf_counter() - start))
+        with span("parse_response"):
+            response = self.postprocess_response(env_observation, raw_response)
+        if level == len(levels) - 1 or not needs_escalation(
+            self, env_observation, raw_response, response
+        ):
+            return response, None
+        return response, level + 1
+
+    def _act_pyramid(self, env_observation, language_input, cache_key) -> BaseAgentResponse:
+        # The levels of the frame are sent from the smallest one (see `_pyramid_step`). Only
+        # the kept reply goes to the history and to the cache.
+        levels = self.pyramid.levels(env_observation.frame)
+        attempts = []
+        level = 0
+        while level is not None:
+            messages = self._pyramid_messages(env_observation, language_input, levels, level)
+            start = time.perf_counter()
+            try:
+                with span("chat_completion", model=self.model_name, level=level):
+                    raw_response, num_tokens = self._complete(messages)
+            except Exception as e:
+                raise ValueError(f"Error: {e}")
+            response, level = self._pyramid_step(
+                env_observation, levels, level, attempts, start, raw_response, num_tokens
             )
 
-            if is_interaction_action:
-                # create regex to extract object id and action name based on template
-                # e.g. OpenObject(<object_id>)
-
-                pattern = r"(\w+)\((\w+).*\)"
-                match = re.match(pattern, raw_action)
-
-                if match:
-                    action = match.group(1)
-                    raw_object_id = match.group(2)
-
-                    object_id = self._get_object_id(raw_object_id, env_observation)
-                    if object_id is None:
-                        return AgentActionResponse(
-                            action="No visible object with that id."
-                        )
-                    return AgentActionResponse(action=action, objectId=object_id)
-
-            # now extract the first part only
-            main_command = raw_action.split("(")[0]
-            if main_command in ("RotateRight", "RotateLeft"):
-                # attempt to parse the degrees from the raw action
-                degrees = None
-                try:
-                    degrees = float(raw_action.split("(")[1].replace(")", ""))
-                except:
-                    degrees = 30.0
-                # if degrees is not provided, default to 30.0
-                return AgentActionResponse(action=main_command, degrees=degrees)
-            return AgentActionResponse(action=main_command)
+        self._finish_pyramid(language_input, cache_key, attempts, messages, raw_response)
+        return response
+
+    async def _aact_pyramid(
+        self, env_observation, language_input, cache_key
+    ) -> BaseAgentResponse:
+        levels = self.pyramid.levels(env_observation.frame)
+        attempts = []
+        level = 0
+        while level is not None:
+            messages = self._pyramid_messages(env_observation, language_input, levels, level)
+            start = time.perf_counter()
+            try:
+                with span("chat_completion", model=self.model_name, level=level):
+                    raw_response, num_tokens = await self._acomplete(messages)
+            except Exception as e:
+                raise ValueError(f"Error: {e}")
+            response, level = self._pyramid_step(
+                env_observation, levels, level, attempts, start, raw_response, num_tokens
+            )
 
-        else:
-            verbal_response = response.replace("[Say]", "").strip()
-            return AgentTextualResponse(response=verbal_response)
+        self._finish_pyramid(language_input, cache_key, attempts, messages, raw_response)
+        return response
 
     def act(self, env_observation, language_input) -> BaseAgentResponse:
-        pil_image = Image.fromarray(env_observation.frame)
-        base64_image = self.encode_image(pil_image)
+        cache_key = self._cache_key(env_observation, language_input)
+        if cache_key is not None:
+            raw_response = self.cache.get(cache_key)
+            if raw_response is not None:
+                self._record_turn(None, language_input, raw_response)
+                with span("parse_response"):
+                    return self.postprocess_response(env_observation, raw_response)
 
-        try:
-            completion = client.chat.completions.create(
-                temperature=0,
-                model=self.model_name,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/png;base64,{base64_image}"
-                                },
-                            },
-                            {"type": "text", "text": language_input},
-                        ],
-                    },
-                ],
-                # response_format=AgentResponse,
-            )
+        if self.pyramid is not None:
+            return self._act_pyramid(env_observation, language_input, cache_key)
+
+        with span("build_prompt"):
+            messages = self._build_messages(env_observation, language_input)
 
-            raw_response = completion.choices[0].message.content
-            # if action_response.parsed:
-            #     print(action_response.parsed)
-            # elif action_response.refusal:
-            #     print(action_response.refusal)
+        try:
+            with span("chat_completion", model=self.model_name):
+                raw_response, _ = self._complete(messages)
         except Exception as e:
             raise ValueError(f"Error: {e}")
 
-        return self.postprocess_response(env_observation, raw_response)
-
+        if cache_key is not None:
+            self.cache.put(cache_key, raw_response)
+        self._record_turn(messages, language_input, raw_response)
+        with span("parse_response"):
+            return self.postprocess_response(env_observation, raw_response)
+
+    async def aact(self, env_observation, language_input) -> BaseAgentResponse:
+        # Same as `act`, but the request goes through the shared AsyncOpenAI client so that
+        # several episodes can wait for the model at the same time
+        cache_key = self._cache_key(env_observation, language_input)
+        if cache_key is not None:
+            raw_response = self.cache.get(cache_key)
+            if raw_response is not None:
+                self._record_turn(None, language_input, raw_response)
+                with span("parse_response"):
+                    return self.postprocess_response(env_observation, raw_response)
+
+        if self.pyramid is not None:
+            return await self._aact_pyramid(env_observation, language_input, cache_key)
+
+        with span("build_prompt"):
+            messages = self._build_messages(env_observation, language_input)
 
-def main():
-    controller = Controller(
-        quality="Medium", renderDepthImage=False, width=640, height=640
-    )
+        try:
+            with span("chat_completion", model=self.model_name):
+                raw_response, _ = await self._acomplete(messages)
+        except Exception as e:
+            raise ValueError(f"Error: {e}")
 
-    client = VLMClient()
+        if cache_key is not None:
+            self.cache.put(cache_key, raw_response)
+        self._record_turn(messages, language_input, raw_response)
+        with span("parse_response"):
+            return self.postprocess_response(env_observation, raw_response)
 
-    frames = []
-    event = controller.step("Initialize")
-    image = Image.fromarray(event.frame)
-    frames.append(image)
 
-    done = False
+def main():
+    from ai2thor.controller import Controller
 
-    while not done:
-        language_instruction = input("Enter instruction (enter CLOSE to exit): ")
-        if language_instruction == "CLOSE":
-            print("Interrupting task...")
-            break
+    from genair_trajectory import TrajectoryWriter
+    from genair_video import VideoRecorder
 
-        print("Processing instruction...")
-        response = client.act(event, language_instruction)
+    client = VLMClient()
+    # Ollama loads the model while the simulator starts
+    warm_up_in_background(client)
 
-        if isinstance(response, AgentTextualResponse):
-            print(f"Generated response: {response.response}")
-        else:
-            print(f"Generated action: {response}")
-            try:
-                event = controller.step(**response.to_dict(), forceAction=True)
-                # forces the GUI to update
-                controller.step("NoOp")
-                image = Image.fromarray(event.frame)
-                frames.append(image)
-            except Exception as e:
-                print(f"Unable to execute action due to an error: {e}")
+    controller = Controller(
+        quality="Medium", renderDepthImage=False, width=640, height=640
+    )
 
-    # Encode all frames into a mp4 video.
+    # Frames are written to the video as soon as they are produced, so memory usage does not
+    # grow with the length of the session and the video is still usable if the program crashes.
     video_path = "rollout.mp4"
-    imageio.mimsave(str(video_path), numpy.stack(frames), fps=1, codec="libx264")
+    # The raw frames, the metadata of every step, the prompts and the replies of the model are
+    # recorded in a trajectory, which can be opened with genair_trajectory.TrajectoryReader
+    trajectory_path = "rollout_trajectory"
+    # Record how long each stage of the loop takes (see the summary at the end of the session)
+    tracer.enable()
+    # Video frames are written in a background thread while the model generates, and the image
+    # of the next query is encoded while the user types (see genair_pipeline.py)
+    with VideoRecorder(video_path, fps=1, codec="libx264") as recorder, TrajectoryWriter(
+        trajectory_path
+    ) as trajectory, AgentPipeline(client, recorder, trajectory=trajectory) as pipeline:
+        event = controller.step("Initialize")
+        pipeline.observe(event)
+        pipeline.prepare(event)
+
+        done = False
+
+        while not done:
+            language_instruction = input("Enter instruction (enter CLOSE to exit): ")
+            if language_instruction == "CLOSE":
+                print("Interrupting task...")
+                break
+
+            print("Processing instruction...")
+            # The generated actions are executed back-to-back. In plan mode, the model is
+            # queried again if one of them fails.
+            event, record = run_instruction(
+                client,
+                controller,
+                event,
+                language_instruction,
+                max_replans=1 if client.plan else 0,
+                on_step=pipeline.observe,
+                on_response=pipeline.record_response,
+            )
+            # only the last frame of the instruction is encoded for the next query
+            pipeline.prepare(event)
+            pipeline.record_instruction(record)
+            for step in record["steps"]:
+                print(f"Generated action: {step['response']}")
+                if not step["lastActionSuccess"]:
+                    print(f"Unable to execute action due to an error: {step['errorMessage']}")
+
+            response = record["responses"][-1]
+            if "response" in response:
+                print(f"Generated response: {response['response']}")
 
     print(f"Video of the evaluation is available in '{video_path}'.")
+    print(f"Trajectory of the evaluation is available in '{trajectory_path}'.")
+
+    # Time spent in each stage of the agent loop. The trace can be opened in
+    # https://ui.perfetto.dev to see the stages of every turn.
+    print("------")
+    tracer.print_summary()
+    tracer.export_chrome_trace("rollout_trace.json")
+    tracer.export_jsonl("rollout_trace.jsonl")
+    print("Trace of the evaluation is available in 'rollout_trace.json'.")
 
 
 if __name__ == "__main__":
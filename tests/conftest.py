@@ -0,0 +1,51 @@
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+import pytest
+
+from benchmarks.stub_server import StubServer
+
+
+@pytest.fixture
+def stub_server():
+    # a chat completion endpoint answering with canned replies, see benchmarks/stub_server.py
+    with StubServer() as server:
+        yield server
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def start_stub_process():
+    # starts stub endpoints in their own processes, so that they can be killed
+    processes = []
+
+    def start(*args) -> tuple:
+        port = _free_port()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.stub_server", "--port", str(port), *args],
+            stdout=subprocess.DEVNULL,
+        )
+        processes.append(process)
+        base_url = f"http://127.0.0.1:{port}/v1"
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                httpx.get(f"{base_url}/models", timeout=1).raise_for_status()
+                return process, base_url
+            except httpx.HTTPError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    yield start
+    for process in processes:
+        process.kill()
+        process.wait()
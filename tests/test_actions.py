@@ -0,0 +1,50 @@
+import pytest
+
+from genair_actions import (
+    ParsedAction,
+    ParsedSay,
+    follows_format,
+    parse_response,
+    split_actions,
+)
+
+
+@pytest.mark.parametrize(
+    "response, expected",
+    [
+        ("[Action] OpenObject(Fridge)", ParsedAction("OpenObject", object_name="Fridge")),
+        ("  [Action] OpenObject: 'Fridge'", ParsedAction("OpenObject", object_name="Fridge")),
+        ("[Action] RotateLeft(90)", ParsedAction("RotateLeft", degrees=90.0)),
+        ("[Action] RotateRight", ParsedAction("RotateRight", degrees=30.0)),
+        ("[Action] PutObject(Apple, Fridge)", ParsedAction("PutObject", object_name="Fridge")),
+        ("[Action] MoveAhead\nI moved ahead.", ParsedAction("MoveAhead")),
+        ("[Say] Hello there!", ParsedSay("Hello there!")),
+        ("[Say] You can [Action] later", ParsedSay("You can [Action] later")),
+        ("Sure! [Action] OpenObject(Drawer)", ParsedSay("Sure! [Action] OpenObject(Drawer)")),
+    ],
+)
+def test_parse_response(response, expected):
+    assert parse_response(response) == expected
+
+
+def test_toggle_needs_a_direction():
+    # ToggleObject is not an AI2-THOR action: it is passed to the simulator as it is
+    assert parse_response("[Action] ToggleObject(Faucet)") == ParsedAction("ToggleObject")
+    assert parse_response("[Action] ToggleObjectOn(Faucet)") == ParsedAction(
+        "ToggleObjectOn", object_name="Faucet"
+    )
+
+
+def test_follows_format():
+    assert follows_format("[Action] MoveAhead")
+    assert follows_format("\n[Say] Hello")
+    assert not follows_format("I am not sure.")
+    assert not follows_format("Sure! [Action] OpenObject(Drawer)")
+
+
+def test_split_actions():
+    assert split_actions("[Action] MoveAhead\n[Action] OpenObject(Fridge)") == [
+        "[Action] MoveAhead",
+        "[Action] OpenObject(Fridge)",
+    ]
+    assert split_actions("[Say] First [Action] MoveAhead, then open it.") == []
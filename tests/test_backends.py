@@ -0,0 +1,143 @@
+import asyncio
+
+import httpx
+import pytest
+
+from genair_async import configure_async_client
+from genair_backends import BackendPool, parse_endpoint
+from genair_cascade import CascadeClient
+from genair_llm import LLMClient
+
+MESSAGES = [{"role": "user", "content": "Open the fridge"}]
+
+
+def _complete(pool: BackendPool) -> str:
+    completion = pool.create(model="stub", messages=MESSAGES, temperature=0)
+    return completion.choices[0].message.content
+
+
+def test_round_robin_balances_requests(start_stub_process):
+    urls = [start_stub_process()[1] for _ in range(3)]
+    pool = BackendPool(urls, strategy="round_robin")
+
+    for _ in range(9):
+        _complete(pool)
+
+    assert [metrics["requests"] for metrics in pool.metrics()] == [3, 3, 3]
+
+
+def test_least_outstanding_prefers_fast_endpoints(start_stub_process):
+    _, slow = start_stub_process("--latency", "0.1")
+    _, fast = start_stub_process()
+    pool = BackendPool([slow, fast])
+
+    for _ in range(10):
+        _complete(pool)
+
+    slow_metrics, fast_metrics = pool.metrics()
+    assert fast_metrics["requests"] > slow_metrics["requests"]
+
+
+def test_failover_when_an_endpoint_is_killed(start_stub_process):
+    process, killed = start_stub_process()
+    _, alive = start_stub_process()
+    pool = BackendPool([killed, alive], strategy="round_robin", backoff=60)
+    _complete(pool)
+    _complete(pool)
+
+    process.kill()
+    process.wait()
+    for _ in range(4):
+        assert _complete(pool)
+
+    killed_metrics, alive_metrics = pool.metrics()
+    assert killed_metrics["failures"] == 1
+    assert not killed_metrics["available"]
+    assert alive_metrics["requests"] == 5
+
+
+def test_health_check(start_stub_process):
+    process, down = start_stub_process()
+    _, up = start_stub_process()
+    pool = BackendPool([down, up])
+    assert pool.health_check() == {down: True, up: True}
+
+    process.kill()
+    process.wait()
+
+    assert pool.health_check() == {down: False, up: True}
+    assert [metrics["available"] for metrics in pool.metrics()] == [False, True]
+
+
+def test_streams_cut_by_an_error_count_as_failures(stub_server):
+    pool = BackendPool([stub_server.base_url])
+    endpoint = pool.endpoints[0]
+
+    class BrokenStream:
+        async def __anext__(self):
+            raise httpx.ReadError("connection lost")
+
+        def __aiter__(self):
+            return self
+
+        async def close(self):
+            pass
+
+    async def create(**kwargs):
+        return BrokenStream()
+
+    async def consume():
+        endpoint.async_client().chat.completions.create = create
+        with pytest.raises(httpx.ReadError):
+            async for _ in pool.astream(model="stub", messages=MESSAGES):
+                pass
+
+    asyncio.run(consume())
+
+    assert endpoint.failures == 1
+    assert endpoint.requests == 0
+    assert endpoint.outstanding == 0
+
+
+def test_endpoint_models_are_rejected_by_the_cascade(stub_server):
+    pool = BackendPool([parse_endpoint(f"{stub_server.base_url}=llama3.2:1b")])
+
+    with pytest.raises(ValueError):
+        CascadeClient(LLMClient(backend=pool), ["small", "large"])
+
+
+def test_async_requests_share_the_concurrency_limit(stub_server):
+    stub_server.latency = 0.05
+    pool = BackendPool([stub_server.base_url])
+    endpoint = pool.endpoints[0]
+    configure_async_client(max_concurrent_requests=2)
+
+    async def run():
+        peak = 0
+
+        async def watch():
+            nonlocal peak
+            while True:
+                peak = max(peak, endpoint.outstanding)
+                await asyncio.sleep(0.005)
+
+        watcher = asyncio.create_task(watch())
+        await asyncio.gather(
+            *(pool.acreate(model="stub", messages=MESSAGES) for _ in range(4)),
+            *(_drain(pool.astream(model="stub", messages=MESSAGES)) for _ in range(2)),
+        )
+        watcher.cancel()
+        return peak
+
+    try:
+        peak = asyncio.run(run())
+    finally:
+        configure_async_client()
+
+    assert peak == 2
+    assert endpoint.requests == 6
+
+
+async def _drain(stream) -> None:
+    async for _ in stream:
+        pass
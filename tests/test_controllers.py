@@ -0,0 +1,108 @@
+import pytest
+
+from genair_controllers import ControllerPool
+from genair_fake import FakeController
+
+
+class FlakyController(FakeController):
+    # fails the resets to the scenes given in `broken_scenes`, like a Unity process that died
+
+    broken_scenes = set()
+    stopped = 0
+
+    def reset(self, scene=None, **kwargs):
+        if scene in self.broken_scenes:
+            raise RuntimeError("Unity process exited")
+        return super().reset(scene=scene, **kwargs)
+
+    def stop(self) -> None:
+        FlakyController.stopped += 1
+
+
+@pytest.fixture
+def pool():
+    FlakyController.broken_scenes = set()
+    FlakyController.stopped = 0
+    with ControllerPool(
+        size=1, controller_kwargs={"width": 64, "height": 64}, factory=FlakyController
+    ) as pool:
+        yield pool
+
+
+def test_controllers_are_reused_across_episodes(pool):
+    first, event = pool.checkout("FloorPlan1")
+    assert event.metadata["sceneName"] == "FloorPlan1"
+    pool.release(first)
+
+    second, event = pool.checkout("FloorPlan1")
+    pool.release(second)
+
+    assert second is first
+    assert pool.stats()["launches"] == 1
+    assert pool.stats()["resets"] == 2
+
+
+def test_controllers_are_reset_on_scene_change(pool):
+    controller, event = pool.checkout("FloorPlan1")
+    controller.step("MoveAhead")
+    pool.release(controller)
+
+    same, event = pool.checkout("FloorPlan2")
+
+    assert same is controller
+    assert same.scene == "FloorPlan2"
+    assert event.metadata["sceneName"] == "FloorPlan2"
+    assert event.metadata["agent"]["position"]["z"] == 0.0
+
+
+def test_initial_metadata_is_kept_per_scene(pool):
+    assert pool.initial_metadata("FloorPlan1") is None
+
+    controller, event = pool.checkout("FloorPlan1")
+    controller.step("MoveAhead")
+    pool.release(controller)
+    pool.checkout("FloorPlan2")
+
+    metadata = pool.initial_metadata("FloorPlan1")
+    assert metadata["sceneName"] == "FloorPlan1"
+    assert metadata["agent"]["position"]["z"] == 0.0
+    assert pool.stats()["cached_scenes"] == 2
+
+
+def test_failed_reset_replaces_the_controller(pool):
+    broken, _ = pool.checkout("FloorPlan1")
+    pool.release(broken)
+    FlakyController.broken_scenes = {"FloorPlan2"}
+
+    with pytest.raises(RuntimeError):
+        pool.checkout("FloorPlan2")
+    # both the broken controller and its replacement were stopped and given back
+    assert FlakyController.stopped == 2
+    assert pool.stats()["controllers"] == 0
+
+    FlakyController.broken_scenes = set()
+    controller, event = pool.checkout("FloorPlan2")
+    assert controller is not broken
+    assert event.metadata["sceneName"] == "FloorPlan2"
+
+
+def test_release_after_a_failure(pool):
+    controller, _ = pool.checkout("FloorPlan1")
+    pool.release(controller, discard=True)
+
+    assert FlakyController.stopped == 1
+    assert pool.stats()["controllers"] == 0
+
+    replacement, _ = pool.checkout("FloorPlan1", timeout=1)
+    assert replacement is not controller
+    assert pool.stats()["launches"] == 2
+
+
+def test_checkout_waits_for_a_release(pool):
+    controller, _ = pool.checkout("FloorPlan1")
+
+    with pytest.raises(TimeoutError):
+        pool.checkout("FloorPlan1", timeout=0.1)
+
+    pool.release(controller)
+    assert pool.checkout("FloorPlan1", timeout=0.1)[0] is controller
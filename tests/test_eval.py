@@ -0,0 +1,151 @@
+import json
+
+import pytest
+
+import genair_eval
+from genair_eval import check_success, load_manifest, run_episode
+from genair_fake import FakeController
+
+
+@pytest.fixture
+def worker(stub_server):
+    # the state of a worker process, with the fake simulator and an agent talking to the stub
+    genair_eval._init_worker(
+        "llm",
+        None,
+        True,
+        False,
+        1,
+        False,
+        [stub_server.base_url],
+        "least_outstanding",
+        False,
+        None,
+        None,
+    )
+    yield stub_server
+    genair_eval._worker["controllers"].close()
+    genair_eval._worker.clear()
+
+
+def test_load_manifest_json(tmp_path):
+    path = tmp_path / "tasks.json"
+    path.write_text(
+        json.dumps(
+            [
+                {"scene": "FloorPlan1_physics", "instructions": ["Open the fridge"]},
+                {"task_id": "apple", "scene": "FloorPlan2", "instructions": ["Pick it up"]},
+            ]
+        )
+    )
+
+    tasks = load_manifest(str(path))
+
+    assert [task["task_id"] for task in tasks] == ["0", "apple"]
+    assert tasks[0]["success"] == []
+    assert tasks[1]["scene"] == "FloorPlan2"
+
+
+def test_load_manifest_jsonl_expands_categories(tmp_path):
+    path = tmp_path / "tasks.jsonl"
+    task = {"task_id": "fridge", "scene": "kitchens", "instructions": ["Open the fridge"]}
+    path.write_text(json.dumps(task) + "\n\n")
+
+    tasks = load_manifest(str(path))
+
+    assert len(tasks) == 30
+    assert {task["task_id"] for task in tasks} == {"fridge"}
+    assert tasks[0]["scene"] == "FloorPlan1_physics"
+
+
+def test_load_manifest_rejects_incomplete_tasks(tmp_path):
+    path = tmp_path / "tasks.json"
+    path.write_text(json.dumps([{"scene": "FloorPlan1"}]))
+
+    with pytest.raises(ValueError, match="Task 0"):
+        load_manifest(str(path))
+
+
+def test_check_success():
+    controller = FakeController(width=64, height=64)
+    event = controller.last_event
+    fridge = next(o for o in event.metadata["objects"] if o["objectType"] == "Fridge")
+
+    assert check_success([], event)
+    assert not check_success([{"objectType": "Fridge", "isOpen": True}], event)
+    assert not check_success([{"inventory": "Apple"}], event)
+
+    event = controller.step("OpenObject", objectId=fridge["objectId"])
+    assert check_success([{"objectType": "Fridge", "isOpen": True}], event)
+    assert check_success([{"lastActionSuccess": True}], event)
+
+    apple = next(o for o in event.metadata["objects"] if o["objectType"] == "Apple")
+    event = controller.step("PickupObject", objectId=apple["objectId"])
+    assert check_success([{"inventory": "Apple"}, {"objectType": "Fridge", "isOpen": True}], event)
+
+
+def test_run_episode_success(worker):
+    worker.set_replies(["[Action] OpenObject(Fridge)"])
+    task = {
+        "task_id": "fridge",
+        "scene": "FloorPlan1_physics",
+        "instructions": ["Open the fridge"],
+        "success": [{"objectType": "Fridge", "isOpen": True}],
+    }
+
+    result = run_episode(task)
+
+    assert result["error"] is None
+    assert result["success"]
+    assert not result["initially_successful"]
+    assert len(result["steps"]) == 1
+    assert worker.num_requests == 1
+
+
+def test_run_episode_flags_conditions_met_at_the_start(worker):
+    worker.set_replies(["[Action] Teleport"])
+    task = {
+        "task_id": "teleport",
+        "scene": "FloorPlan1_physics",
+        "instructions": ["Teleport to the kitchen"],
+        "success": [{"lastActionSuccess": True}],
+    }
+
+    result = run_episode(task)
+
+    assert result["error"] is None
+    assert not result["success"]
+    assert result["initially_successful"]
+
+
+def test_run_episode_failure(worker):
+    worker.set_replies(["[Action] MoveAhead"])
+    task = {
+        "task_id": "fridge",
+        "scene": "FloorPlan1_physics",
+        "instructions": ["Open the fridge", "Open it now"],
+        "success": [{"objectType": "Fridge", "isOpen": True}],
+    }
+
+    result = run_episode(task)
+
+    assert result["error"] is None
+    assert not result["success"]
+    assert len(result["steps"]) == 2
+
+
+def test_run_episode_reports_errors(worker):
+    worker.failure_rate = 1.0
+    task = {
+        "task_id": "fridge",
+        "scene": "FloorPlan1_physics",
+        "instructions": ["Open the fridge"],
+        "success": [],
+    }
+
+    result = run_episode(task)
+
+    assert not result["success"]
+    assert result["error"] is not None
+    # the simulator goes back to the pool after a failed episode
+    assert genair_eval._worker["controllers"].checkout("FloorPlan1_physics") is not None
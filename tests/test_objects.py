@@ -0,0 +1,44 @@
+from genair_objects import ObjectTable, _interned
+
+
+def _metadata(*objects) -> dict:
+    return {
+        "objects": [
+            {"objectId": object_id, "visible": visible, "distance": distance}
+            for object_id, visible, distance in objects
+        ]
+    }
+
+
+def test_resolve_prefers_exact_then_type_then_substring():
+    table = ObjectTable(
+        _metadata(
+            ("Mug|+01.00|+00.90|-01.00", True, 2.0),
+            ("Mug|+02.00|+00.90|-01.00", True, 1.0),
+            ("CoffeeMachine|+00.50|+00.90|-01.00", True, 1.5),
+            ("Apple|+00.10|+00.90|-01.00", False, 0.5),
+        )
+    )
+
+    assert table.resolve("mug|+01.00|+00.90|-01.00") == "Mug|+01.00|+00.90|-01.00"
+    # two mugs: the nearest one
+    assert table.resolve("Mug") == "Mug|+02.00|+00.90|-01.00"
+    assert table.resolve("machine") == "CoffeeMachine|+00.50|+00.90|-01.00"
+    # not visible
+    assert table.resolve("Apple") is None
+
+
+def test_ranks_only_cover_the_visible_objects():
+    # IDs of other scenes, interned earlier in the process
+    for i in range(1000):
+        _interned.intern(f"Cabinet|{i}|+00.00|+00.00")
+
+    table = ObjectTable(
+        _metadata(
+            ("Cabinet|-1|+00.00|+00.00", True, 1.0),
+            ("Drawer|-1|+00.00|+00.00", True, 1.0),
+        )
+    )
+
+    assert table.resolve("CabinetOrDrawer") is None
+    assert len(_interned._ranks["cabinetordrawer"]) == 2
@@ -0,0 +1,96 @@
+import copy
+
+import pytest
+
+from genair_backends import BackendPool
+from genair_fake import FakeController, FakeEvent
+from genair_llm import LLMClient
+from genair_observations import ObservationEncoder
+
+
+def _events(num_events: int = 20) -> list:
+    controller = FakeController(width=64, height=64, num_objects=200)
+    events = [controller.step("Initialize")]
+    actions = ["MoveAhead", "RotateLeft", "MoveRight", "LookDown", "RotateRight", "MoveBack"]
+    for i in range(num_events - 1):
+        events.append(controller.step(actions[i % len(actions)]))
+    return events
+
+
+def _prompt_tokens(server, events: list, **agent_kwargs) -> int:
+    agent = LLMClient(backend=BackendPool([server.base_url]), **agent_kwargs)
+    before = server.num_prompt_tokens
+    for event in events:
+        agent.act(event, "Open the fridge")
+    return server.num_prompt_tokens - before
+
+
+def test_compact_prompts_are_shorter(stub_server):
+    events = _events()
+
+    full = _prompt_tokens(stub_server, events)
+    compact = _prompt_tokens(stub_server, events, compact_observations=True)
+
+    assert compact < full
+
+
+def test_compact_prompt_prefix_is_stable(stub_server):
+    agent = LLMClient(backend=BackendPool([stub_server.base_url]), compact_observations=True)
+    event = _events(1)[0]
+    # the fridge gets out of view: a small change, the reference list is kept
+    metadata = copy.deepcopy(event.metadata)
+    metadata["objects"][0]["visible"] = False
+    next_event = FakeEvent(metadata, event.frame)
+
+    agent.act(event, "Open the fridge")
+    first = agent.last_turn["prompt"]
+    agent.act(next_event, "Close the fridge")
+    second = agent.last_turn["prompt"]
+
+    assert second[: len(first) - 2] == first[:-2]
+    assert first[-2]["content"] == "Visible objects: same as the reference list."
+    assert second[-2]["content"] == "Visible objects: the reference list, minus Fridge_1."
+    # the observations are not kept in the history
+    assert [m["content"] for m in second[2:4]] == ["Open the fridge", agent.history.turns[0][1]]
+
+
+def test_encoder_deltas_and_aliases():
+    encoder = ObservationEncoder(max_delta_ratio=0.5)
+    event = FakeController(width=64, height=64, num_objects=20).last_event
+    objects = event.metadata["objects"]
+    visible = [o for o in objects if o["visible"]]
+
+    reference, observation = encoder.encode(event)
+    encoder.commit()
+    assert reference.startswith("Reference list of visible objects: Fridge_1, Microwave_1")
+    assert observation == "Visible objects: same as the reference list."
+    assert encoder.resolve("fridge_1") == visible[0]["objectId"]
+
+    visible[0]["visible"] = False
+    assert encoder.encode(event) == (
+        reference,
+        "Visible objects: the reference list, minus Fridge_1.",
+    )
+
+    # a delta larger than the visible objects replaces the reference
+    for o in objects:
+        o["visible"] = not o["visible"]
+    new_reference, observation = encoder.encode(event)
+    assert new_reference != reference
+    assert observation == "Visible objects: same as the reference list."
+
+
+def test_encoder_keeps_the_reference_until_commit():
+    encoder = ObservationEncoder()
+    event = FakeController(width=64, height=64, num_objects=20).last_event
+
+    reference, _ = encoder.encode(event)
+    # the request failed: the next observation still needs a reference
+    assert encoder.encode(event)[0] == reference
+    encoder.commit()
+    assert encoder.encode(event)[0] == reference
+
+
+def test_encoder_rejects_invalid_ratio():
+    with pytest.raises(ValueError):
+        ObservationEncoder(max_delta_ratio=0)
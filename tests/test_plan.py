@@ -0,0 +1,42 @@
+from genair_backends import BackendPool
+from genair_fake import FakeController
+from genair_llm import LLMClient
+from genair_plan import execute_plan
+from genair_responses import AgentPlanResponse
+
+
+class CountingController(FakeController):
+    # records the name of every action it executes
+
+    def step(self, action=None, **action_args):
+        self.actions.append(action if action is not None else action_args.get("action"))
+        return super().step(action, **action_args)
+
+
+def _run(server, actions):
+    controller = CountingController(width=64, height=64)
+    controller.actions = []
+    agent = LLMClient(backend=BackendPool([server.base_url]))
+    plan = AgentPlanResponse(actions=actions)
+    event, steps, completed = execute_plan(agent, controller, controller.last_event, plan)
+    return controller.actions, steps, completed
+
+
+def test_plans_run_a_single_noop_after_the_last_action(stub_server):
+    actions, steps, completed = _run(
+        stub_server, ["[Action] MoveAhead", "[Action] RotateRight(90)", "[Action] MoveAhead"]
+    )
+
+    assert completed
+    assert len(steps) == 3
+    assert actions == ["MoveAhead", "RotateRight", "MoveAhead", "NoOp"]
+
+
+def test_plans_stop_at_the_first_failed_action(stub_server):
+    actions, steps, completed = _run(
+        stub_server, ["[Action] MoveAhead", "[Action] Teleport", "[Action] MoveAhead"]
+    )
+
+    assert not completed
+    assert [s["lastActionSuccess"] for s in steps] == [True, False]
+    assert actions == ["MoveAhead", "Teleport", "NoOp"]
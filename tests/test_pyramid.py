@@ -0,0 +1,40 @@
+import asyncio
+
+from genair_backends import BackendPool
+from genair_fake import FakeController
+from genair_images import ImagePyramid
+from genair_vlm import VLMClient
+
+
+def _agent(server) -> VLMClient:
+    return VLMClient(
+        backend=BackendPool([server.base_url]), pyramid=ImagePyramid(sizes=(32, None))
+    )
+
+
+def test_pyramid_escalates_unusable_replies(stub_server):
+    stub_server.set_replies(["[Action] OpenObject(Spaceship)", "[Action] OpenObject(Fridge)"])
+    agent = _agent(stub_server)
+    event = FakeController(width=64, height=64).last_event
+
+    response = agent.act(event, "Open the fridge")
+
+    assert response.action == "OpenObject"
+    assert response.objectId.startswith("Fridge|")
+    assert stub_server.num_requests == 2
+    summary = agent.pyramid_stats.summary()
+    assert (summary["queries"], summary["escalations"]) == (1, 1)
+    # only the kept reply goes to the history
+    assert agent.history.turns == [("Open the fridge", "[Action] OpenObject(Fridge)")]
+
+
+def test_pyramid_keeps_usable_replies(stub_server):
+    stub_server.set_replies(["[Say] Hello!"])
+    agent = _agent(stub_server)
+    event = FakeController(width=64, height=64).last_event
+
+    response = asyncio.run(agent.aact(event, "Say hello"))
+
+    assert response.response == "Hello!"
+    assert stub_server.num_requests == 1
+    assert agent.pyramid_stats.summary()["escalations"] == 0
@@ -0,0 +1,44 @@
+import pytest
+
+from genair_actions import ParsedAction, ParsedSay, parse_response
+from genair_streaming import StreamingResponseParser
+
+
+def _feed(text: str, size: int = 3) -> StreamingResponseParser:
+    parser = StreamingResponseParser()
+    for i in range(0, len(text), size):
+        if parser.feed(text[i : i + size]):
+            break
+    return parser
+
+
+@pytest.mark.parametrize(
+    "reply, expected",
+    [
+        ("[Action] OpenObject(Fridge) and then I wait", "[Action] OpenObject(Fridge)"),
+        ("  [Action] OpenObject Fridge, since it is closed", "[Action] OpenObject Fridge"),
+        ("[Action] MoveAhead\nI moved ahead.", "[Action] MoveAhead"),
+        ("[Say] Hello there! How are you?", "[Say] Hello there!"),
+    ],
+)
+def test_stream_stops_after_the_first_action_or_sentence(reply, expected):
+    parser = _feed(reply)
+
+    assert parser.complete
+    assert parser.text == expected
+
+
+def test_stream_ignores_actions_after_leading_prose():
+    reply = "Sure, here is what I would do: [Action] OpenObject Fridge, then wait"
+    parser = _feed(reply)
+
+    # the reply is read to the end, and parsed like the final parser does
+    assert not parser.complete
+    assert parser.text == reply
+    assert parse_response(parser.text) == ParsedSay(reply)
+
+
+def test_streamed_actions_parse_like_the_full_reply():
+    parser = _feed("[Action] PickupObject: Apple. I picked it up.")
+
+    assert parse_response(parser.text) == ParsedAction("PickupObject", object_name="Apple")